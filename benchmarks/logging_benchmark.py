@@ -0,0 +1,120 @@
+import argparse
+import logging
+import logging.handlers
+import queue
+import tempfile
+import time
+from pathlib import Path
+from src.utils.logger import (
+    ContextFilter,
+    JsonFormatter,
+    QueueListener,
+    set_stage,
+    start_request_context,
+)
+
+# Stands in for the webhook model, whose repr is the expensive part of a DEBUG line
+PAYLOAD = {"fields": [{"key": f"question_{i}", "value": "x" * 64} for i in range(60)]}
+
+
+def log_request_lazy(logger: logging.Logger, request_id: str):
+    """The log calls made by one /submit/ request, with lazy arguments."""
+    start_request_context(request_id)
+    logger.info("Request started, path=%s, method=%s", "/submit/", "POST")
+    set_stage("dedup")
+    logger.debug("Received data: %s", PAYLOAD)
+    logger.info("File does not exist, proceeding with PDF generation")
+    set_stage("generate")
+    logger.info("Generating PDF for user: %s", "Budi")
+    logger.info("PDF generated successfully: %s", "agreement.pdf")
+    logger.debug("PDF properties: %s", PAYLOAD)
+    set_stage("upload")
+    logger.info("Uploading PDF: %s", "agreement.pdf")
+    logger.info("PDF uploaded and shared successfully: %s", "file-id")
+    logger.info(
+        "Request completed, path=%s, status_code=%s, process_time=%.2fs",
+        "/submit/",
+        200,
+        0.5,
+    )
+
+
+def log_request_eager(logger: logging.Logger, request_id: str):
+    """The same log calls, formatted eagerly with f-strings as before."""
+    logger.info(f"Request started, path={'/submit/'}, method={'POST'}")
+    logger.debug(f"Received data: {PAYLOAD}")
+    logger.info("File does not exist, proceeding with PDF generation")
+    logger.info(f"Generating PDF for user: {'Budi'}")
+    logger.info(f"PDF generated successfully: {'agreement.pdf'}")
+    logger.debug(f"PDF properties: {PAYLOAD}")
+    logger.info(f"Uploading PDF: {'agreement.pdf'}")
+    logger.info(f"PDF uploaded and shared successfully: {'file-id'}")
+    logger.info(
+        f"Request completed, path={'/submit/'}, status_code={200}, process_time={0.5:.2f}s"
+    )
+
+
+def make_logger(name: str, level: str, handlers) -> logging.Logger:
+    logger = logging.getLogger(f"logging_benchmark.{name}")
+    logger.handlers = list(handlers)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def time_requests(log_request, logger: logging.Logger, requests: int) -> float:
+    """Seconds per request spent on the calling thread."""
+    start_time = time.perf_counter()
+    for i in range(requests):
+        log_request(logger, str(i))
+    return (time.perf_counter() - start_time) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the logging overhead per request on the calling thread."
+    )
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--level", default="INFO")
+    parser.add_argument("--format", choices=["default", "json"], default="default")
+    args = parser.parse_args()
+
+    formatter = (
+        JsonFormatter()
+        if args.format == "json"
+        else logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        )
+    )
+    with tempfile.TemporaryDirectory() as directory:
+
+        def file_handler(name: str) -> logging.Handler:
+            handler = logging.FileHandler(Path(directory) / f"{name}.log")
+            handler.setFormatter(formatter)
+            return handler
+
+        # Before: f-strings, handlers writing inline on the calling thread
+        inline = make_logger("inline", args.level, [file_handler("inline")])
+        inline.addFilter(ContextFilter())
+        inline_seconds = time_requests(log_request_eager, inline, args.requests)
+
+        # After: lazy arguments, the listener thread does the writing
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        listener = QueueListener(log_queue, file_handler("queued"))
+        listener.start()
+        queued = make_logger("queued", args.level, [queue_handler])
+        queued_seconds = time_requests(log_request_lazy, queued, args.requests)
+        drain_start = time.perf_counter()
+        listener.stop()
+        drain_seconds = time.perf_counter() - drain_start
+
+    print(f"{args.requests} requests at {args.level}, {args.format} format")
+    print(f"inline handlers, f-strings: {inline_seconds * 1e6:8.1f} us/request")
+    print(f"queue handler, lazy args:   {queued_seconds * 1e6:8.1f} us/request")
+    print(f"listener drain after run:   {drain_seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
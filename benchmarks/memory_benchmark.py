@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import io
+import tracemalloc
+import httpx
+import pymupdf
+from benchmarks.soak_benchmark import handle_drive_request
+from google.oauth2.credentials import Credentials
+from src.utils.async_google_drive import AsyncGoogleDriveClient
+from src.utils.config import config
+
+
+def build_document(pages: int) -> pymupdf.Document:
+    """A multi-page agreement-like document with an incompressible image per page."""
+    doc = pymupdf.open()
+    for page_number in range(pages):
+        page = doc.new_page(width=612, height=1008)
+        page.insert_text((72, 72), f"Page {page_number + 1}")
+        pixmap = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, 600, 600), False)
+        pixmap.set_rect(pixmap.irect, (page_number * 37 % 256, 90, 160))
+        page.insert_image(pymupdf.Rect(72, 100, 540, 568), pixmap=pixmap)
+    return doc
+
+
+class DiscardingTransport(httpx.AsyncBaseTransport):
+    """Answers like Drive, reading each request body chunk by chunk and dropping it.
+
+    Unlike httpx.MockTransport, it never joins the body into one bytes object,
+    so only the copies the client makes show up in the peak.
+    """
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async for _ in request.stream:
+            pass
+        return handle_drive_request(request)
+
+
+async def copying_handoff(doc: pymupdf.Document, client: AsyncGoogleDriveClient):
+    """The generator to storage handoff before buffers were passed by reference."""
+    pdf_stream = io.BytesIO()
+    doc.save(pdf_stream)
+    pdf_stream.seek(0)
+    file_stream = pdf_stream.read()
+    await client.upload(file_stream, "agreement.pdf")
+
+
+async def buffer_handoff(doc: pymupdf.Document, client: AsyncGoogleDriveClient):
+    """The generator hands a view of its buffer to the Drive client."""
+    pdf_stream = io.BytesIO()
+    doc.save(pdf_stream)
+    file_stream = pdf_stream.getbuffer()
+    await client.upload(file_stream, "agreement.pdf")
+    file_stream.release()
+
+
+def measure_peak(
+    loop: asyncio.AbstractEventLoop,
+    handoff,
+    doc: pymupdf.Document,
+    client: AsyncGoogleDriveClient,
+) -> int:
+    """Peak bytes allocated by Python while running one handoff."""
+    tracemalloc.start()
+    try:
+        loop.run_until_complete(handoff(doc, client))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the peak memory of uploading a generated PDF to Drive."
+    )
+    parser.add_argument("--pages", type=int, default=12)
+    args = parser.parse_args()
+
+    # Uploads go to an in-process stand-in, the client code runs unchanged
+    AsyncGoogleDriveClient._credentials = Credentials(token="benchmark")
+    AsyncGoogleDriveClient._http_client = httpx.AsyncClient(
+        transport=DiscardingTransport()
+    )
+    client = AsyncGoogleDriveClient()
+    doc = build_document(args.pages)
+    size = len(doc.tobytes())
+    loop = asyncio.new_event_loop()
+    try:
+        # Warm up the scheduler and the client, so neither run pays for them
+        loop.run_until_complete(client.upload(b"", "warm-up"))
+        copying_peak = measure_peak(loop, copying_handoff, doc, client)
+        buffer_peak = measure_peak(loop, buffer_handoff, doc, client)
+        loop.run_until_complete(AsyncGoogleDriveClient.aclose())
+    finally:
+        loop.close()
+    doc.close()
+
+    mode = "resumable" if size > config.DRIVE_UPLOAD_CHUNK_SIZE else "multipart"
+    print(f"PDF of {args.pages} pages, {size / 1024 / 1024:.1f} MiB, {mode} upload")
+    print(f"copying handoff: {copying_peak / 1024 / 1024:7.1f} MiB peak")
+    print(f"buffer handoff:  {buffer_peak / 1024 / 1024:7.1f} MiB peak")
+    print(f"saved per submission: {(copying_peak - buffer_peak) / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+import httpx
+import pymupdf
+from src.models import DataPerjanjianPemasaranProperti
+from src.pdf_engine_router import create_engine
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.resources import get_rss
+
+ENGINES = ("pymupdf", "pdfkit")
+BACKENDS = ("local", "drive", "s3")
+
+
+class Sample(NamedTuple):
+    iteration: int
+    rss: int
+    heap: int
+    fds: int
+    processes: int
+
+
+def get_open_fd_count() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+def get_child_process_count() -> int:
+    """Children of this process, including the exited ones not yet reaped."""
+    pid = str(os.getpid())
+    count = 0
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces
+        if stat.rsplit(")", 1)[1].split()[1] == pid:
+            count += 1
+    return count
+
+
+def take_sample(iteration: int) -> Sample:
+    # Only what survives a collection counts, cycles awaiting one are not leaks
+    gc.collect()
+    return Sample(
+        iteration,
+        get_rss() or 0,
+        tracemalloc.get_traced_memory()[0],
+        get_open_fd_count(),
+        get_child_process_count(),
+    )
+
+
+def get_snapshot() -> tracemalloc.Snapshot:
+    """The traced allocations, without those of tracemalloc itself."""
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+
+
+def get_growth(samples: List[Sample], metric: str) -> float:
+    """Growth of a metric per 1000 iterations, by least squares over the samples."""
+    if len(samples) < 2:
+        return 0.0
+    slope, _ = statistics.linear_regression(
+        [sample.iteration for sample in samples],
+        [getattr(sample, metric) for sample in samples],
+    )
+    return slope * 1000
+
+
+def build_image(width: int, height: int, shade: int, format: str) -> bytes:
+    pixmap = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, width, height), False)
+    pixmap.clear_with(shade)
+    return pixmap.tobytes(format)
+
+
+def build_pdf(pages: int) -> bytes:
+    doc = pymupdf.open()
+    try:
+        for page_number in range(pages):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Sertifikat, halaman {page_number + 1}")
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+class MediaServer:
+    """Serves the uploaded files of the synthetic submissions over local HTTP.
+
+    Media.download fetches them with requests, as it does from Tally, so the
+    download path is part of the soak.
+    """
+
+    def __init__(self):
+        self.files = {
+            "owner_signature.png": build_image(240, 100, 40, "png"),
+            "agent_signature.png": build_image(240, 100, 80, "png"),
+            # Not an image, MuPDF fails to decode it
+            "broken_signature.png": b"\x89PNG\r\n\x1a\n" + os.urandom(512),
+            "certificate.pdf": build_pdf(2),
+            "ktp.jpg": build_image(640, 400, 160, "jpeg"),
+            "pbb.png": build_image(400, 400, 200, "png"),
+        }
+        files = self.files
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                content = files.get(self.path.lstrip("/"))
+                if content is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "MediaServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def media(self, name: str, mimetype: str) -> Dict:
+        host, port = self.server.server_address
+        return {
+            "id": name,
+            "name": name,
+            "url": f"http://{host}:{port}/{name}",
+            "mimeType": mimetype,
+            "size": len(self.files[name]),
+        }
+
+
+def build_submission(
+    media_server: MediaServer, broken_signature: bool = False
+) -> DataPerjanjianPemasaranProperti:
+    """A synthetic webhook event with signatures and every document attached."""
+    response_id = uuid.uuid4().hex[:8]
+
+    def field(label: str, type: str, value) -> Dict:
+        return {"key": label, "label": label, "type": type, "value": value}
+
+    def choice(label: str, text: str, type: str = "DROPDOWN") -> Dict:
+        return {
+            **field(label, type, ["option"]),
+            "options": [{"id": "option", "text": text}],
+        }
+
+    def files(label: str, type: str, *media: Dict) -> Dict:
+        return field(label, type, list(media))
+
+    owner_signature = "owner_signature.png"
+    if broken_signature:
+        owner_signature = "broken_signature.png"
+    fields = [
+        field("agent_name", "INPUT_TEXT", "Budi Santoso"),
+        field("agent_phone_num", "INPUT_TEXT", "081234567890"),
+        field("owner_name", "INPUT_TEXT", "Siti Rahayu"),
+        field("owner_address", "INPUT_TEXT", "Jl. Melati No. 5, Bandung"),
+        field("owner_ktp_num", "INPUT_TEXT", "3273010101010001"),
+        field("owner_phone_num", "INPUT_TEXT", "081298765432"),
+        field("owner_email", "INPUT_EMAIL", "siti@example.com"),
+        choice("cp_is_owner", "Ya", "CHECKBOXES"),
+        field("cp_relation_with_owner", "INPUT_TEXT", "Pemilik"),
+        choice("transaction_type", "Jual"),
+        choice("property_type", "Rumah"),
+        field("property_address", "INPUT_TEXT", f"Jl. Mawar {response_id}, Jakarta"),
+        field("property_land_area", "INPUT_NUMBER", 120),
+        field("property_building_area", "INPUT_NUMBER", 90),
+        field("property_facade_width", "INPUT_NUMBER", 8),
+        field("property_road_width", "INPUT_NUMBER", 6),
+        field("property_floor_count", "INPUT_NUMBER", 2),
+        field("property_bedroom", "INPUT_NUMBER", 3),
+        field("property_helper_bedroom", "INPUT_NUMBER", 1),
+        field("property_bathroom", "INPUT_NUMBER", 2),
+        field("property_helper_bathroom", "INPUT_NUMBER", 1),
+        field("property_garage", "INPUT_NUMBER", 1),
+        choice("property_facing_to", "Utara"),
+        field("property_condition", "INPUT_TEXT", "Baik"),
+        choice("property_certificate_status", "SHM"),
+        choice("property_wattage", "2200"),
+        choice("property_water_type", "PAM"),
+        field("property_air_cond_count", "INPUT_NUMBER", 2),
+        choice("property_furniture_completion", "Lengkap"),
+        files(
+            "property_certificate_file",
+            "FILE_UPLOAD",
+            media_server.media("certificate.pdf", "application/pdf"),
+        ),
+        files(
+            "owner_ktp_file",
+            "FILE_UPLOAD",
+            media_server.media("ktp.jpg", "image/jpeg"),
+        ),
+        files(
+            "property_pbb_file",
+            "FILE_UPLOAD",
+            media_server.media("pbb.png", "image/png"),
+        ),
+        files("property_imb_file", "FILE_UPLOAD"),
+        field("price", "INPUT_NUMBER", 1500000000),
+        field("rent_payment_frequency", "INPUT_NUMBER", 1),
+        field("additional_notes", "TEXTAREA", "Siap huni"),
+        choice("agreement_online_marketing", "Setuju", "CHECKBOXES"),
+        choice("agreement_offline_marketing", "Setuju", "CHECKBOXES"),
+        files(
+            "owner_signature",
+            "SIGNATURE",
+            media_server.media(owner_signature, "image/png"),
+        ),
+        files(
+            "agent_signature",
+            "SIGNATURE",
+            media_server.media("agent_signature.png", "image/png"),
+        ),
+        field("success_fee", "INPUT_NUMBER", 3),
+    ]
+    created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return DataPerjanjianPemasaranProperti(
+        eventId=str(uuid.uuid4()),
+        eventType="FORM_RESPONSE",
+        createdAt=created_at,
+        data={
+            "responseId": response_id,
+            "submissionId": f"s{response_id}",
+            "respondentId": f"r{response_id}",
+            "formId": "soak",
+            "formName": "Perjanjian Jasa Pemasaran Properti",
+            "createdAt": created_at,
+            "fields": fields,
+        },
+    )
+
+
+def handle_drive_request(request: httpx.Request) -> httpx.Response:
+    """Stand-in for the Drive API, answering like Drive without keeping anything."""
+    if request.url.path.endswith("/permissions"):
+        return httpx.Response(200, json={"id": uuid.uuid4().hex})
+    if request.method == "GET":
+        return httpx.Response(200, json={"files": []})
+    if request.url.params.get("uploadType") == "resumable":
+        session_url = f"https://soak.invalid/upload/{uuid.uuid4().hex}"
+        return httpx.Response(200, headers={"Location": session_url})
+    if request.method == "PUT":
+        content_range = request.headers["Content-Range"]
+        span, total = content_range.removeprefix("bytes ").split("/")
+        end = int(span.split("-")[1]) + 1 if span != "*" else int(total)
+        if end < int(total):
+            return httpx.Response(308, headers={"Range": f"bytes=0-{end - 1}"})
+    return httpx.Response(200, json={"id": uuid.uuid4().hex})
+
+
+def handle_s3_request(request: httpx.Request) -> httpx.Response:
+    """Stand-in for an S3 bucket, answering like S3 without keeping anything."""
+    if request.method == "GET":
+        return httpx.Response(404)
+    if request.method == "DELETE":
+        return httpx.Response(204)
+    if request.method == "POST" and "uploads" in request.url.params:
+        body = f"<UploadId>{uuid.uuid4().hex}</UploadId>"
+        return httpx.Response(200, content=body.encode())
+    return httpx.Response(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+
+def install_stand_ins(storage_directory: str):
+    """Point the storage backends at a temporary directory and in-process APIs."""
+    from google.oauth2.credentials import Credentials
+    from src.utils.async_google_drive import AsyncGoogleDriveClient
+    from src.utils.async_s3 import AsyncS3StorageClient
+    from src.utils.scheduler import TokenBucket, drive_scheduler
+
+    config.LOCAL_STORAGE_DIR = storage_directory
+    config.S3_BUCKET = config.S3_BUCKET or "soak"
+    config.S3_ACCESS_KEY_ID = config.S3_ACCESS_KEY_ID or "soak"
+    config.S3_SECRET_ACCESS_KEY = config.S3_SECRET_ACCESS_KEY or "soak"
+    AsyncGoogleDriveClient._credentials = Credentials(token="soak")
+    AsyncGoogleDriveClient._http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handle_drive_request)
+    )
+    AsyncS3StorageClient._http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handle_s3_request)
+    )
+    # The stand-in has no quota to protect
+    drive_scheduler.bucket = TokenBucket(
+        1_000_000, 1_000_000, path=os.path.join(storage_directory, "drive_rate.sqlite3")
+    )
+
+
+def create_storage_client(backend: str):
+    """A fresh client of the given backend, as the dependencies build per request."""
+    if backend == "drive":
+        from src.utils.async_google_drive import AsyncGoogleDriveClient
+
+        return AsyncGoogleDriveClient()
+    if backend == "s3":
+        from src.utils.async_s3 import AsyncS3StorageClient
+
+        return AsyncS3StorageClient()
+    from src.utils.async_storage import AsyncLocalStorageClient
+
+    return AsyncLocalStorageClient()
+
+
+async def submit(
+    engine: str, backend: str, data: DataPerjanjianPemasaranProperti
+) -> None:
+    """Render, upload and share one submission the way the /submit/ route does."""
+    pdf_stream = create_engine(engine).generate(data)
+    storage_client = create_storage_client(backend)
+    filename = data.get_filename()
+    file_id = await storage_client.upload(
+        pdf_stream, filename, "application/pdf", None, data.get_form_properties()
+    )
+    await storage_client.share(file_id, data.owner_email)
+    for name, content, mimetype in data.get_supplementary_documents():
+        await storage_client.upload(content, f"{name}_{filename}", mimetype)
+
+
+async def soak(
+    engine: str,
+    backend: str,
+    media_server: MediaServer,
+    iterations: int,
+    warmup: int,
+    sample_every: int,
+    fail_every: int,
+) -> tuple:
+    """Run the submissions of one engine and backend, sampling as they go.
+
+    Returns the samples taken after warm-up, the tracemalloc snapshot the
+    warm-up ended with, and the number of failed submissions.
+    """
+    samples = []
+    baseline = None
+    failures = 0
+    for iteration in range(1, iterations + 1):
+        broken = fail_every > 0 and iteration % fail_every == 0
+        try:
+            await submit(engine, backend, build_submission(media_server, broken))
+        except Exception as e:
+            failures += 1
+            if not broken:
+                logger.warning("Submission %s failed: %s", iteration, e)
+        if iteration == warmup:
+            baseline = get_snapshot()
+        if iteration >= warmup and iteration % sample_every == 0:
+            samples.append(take_sample(iteration))
+    if baseline is None:
+        baseline = get_snapshot()
+    return samples, baseline, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Push synthetic agreements through each PDF engine and storage backend,"
+            " and fail when memory, file descriptors or processes keep growing."
+        )
+    )
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--sample-every", type=int, default=50)
+    parser.add_argument(
+        "--fail-every",
+        type=int,
+        default=20,
+        help="Send a broken signature every N submissions, 0 to never",
+    )
+    parser.add_argument(
+        "--max-rss-growth", type=float, default=2048, help="KiB per 1000 submissions"
+    )
+    parser.add_argument(
+        "--max-heap-growth", type=float, default=512, help="KiB per 1000 submissions"
+    )
+    parser.add_argument("--max-fd-growth", type=float, default=1)
+    parser.add_argument("--max-process-growth", type=float, default=1)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    engines = args.engines.split(",")
+    backends = args.backends.split(",")
+    for name in set(engines) - set(ENGINES):
+        parser.error(f"Unknown engine: {name}")
+    for name in set(backends) - set(BACKENDS):
+        parser.error(f"Unknown backend: {name}")
+    if not 0 < args.warmup < args.iterations:
+        parser.error("--warmup must be between 0 and --iterations")
+
+    # Request logs would dominate both the runtime and the log volume
+    logger.setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    limits = {
+        "rss": args.max_rss_growth * 1024,
+        "heap": args.max_heap_growth * 1024,
+        "fds": args.max_fd_growth,
+        "processes": args.max_process_growth,
+    }
+
+    leaking = False
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as directory, MediaServer() as media_server:
+        install_stand_ins(directory)
+        for engine in engines:
+            for backend in backends:
+                start_time = time.perf_counter()
+                samples, baseline, failures = asyncio.run(
+                    soak(
+                        engine,
+                        backend,
+                        media_server,
+                        args.iterations,
+                        args.warmup,
+                        args.sample_every,
+                        args.fail_every,
+                    )
+                )
+                elapsed = time.perf_counter() - start_time
+                print(
+                    f"{engine} -> {backend}: {args.iterations} submissions"
+                    f" ({failures} failed) in {elapsed:.0f}s,"
+                    f" {args.iterations / elapsed:.1f}/s"
+                )
+                for metric, limit in limits.items():
+                    growth = get_growth(samples, metric)
+                    status = "ok" if growth <= limit else "GROWING"
+                    leaking |= growth > limit
+                    if metric in ("rss", "heap"):
+                        print(
+                            f"  {metric:<10} {growth / 1024:+10.1f} KiB/1000"
+                            f"  (limit {limit / 1024:.0f})  {status}"
+                        )
+                    else:
+                        print(
+                            f"  {metric:<10} {growth:+10.2f} /1000"
+                            f"      (limit {limit:g})  {status}"
+                        )
+                growth = [
+                    stat
+                    for stat in get_snapshot().compare_to(baseline, "lineno")
+                    if stat.size_diff > 0
+                ]
+                for stat in growth[: args.top]:
+                    print(f"    {stat}")
+    tracemalloc.stop()
+
+    if leaking:
+        print("Growth past the configured slope, see above")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
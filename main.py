@@ -1,30 +1,112 @@
+import asyncio
 import base64
 import hmac
 import hashlib
+import os
+import tempfile
 import time
-from fastapi import Depends, FastAPI, Header, Request, Response
-from fastapi.responses import JSONResponse
+import uuid
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    Header,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
 from src.pdf_generator import PDFGenerator
-from src.utils.logger import logger
+from src.utils.logger import logger, set_stage, start_request_context
+from src.utils.admission import submit_admission
+from src.utils.agreement_index import (
+    PYARROW_AVAILABLE,
+    agreement_index,
+    sync_from_drive,
+)
+from src.utils.buffers import Buffer
+from src.utils.checkpoints import Submission, submission_checkpoints
+from src.utils.dedup import completed_responses, scan_event_ids
+from src.utils.disk_cache import DiskCache
+from src.utils.metrics import metrics
+from src.utils.profiling import is_profile_requested, profile_call, profile_session
+from src.utils.readiness import readiness
+from src.utils.streaming import (
+    etag_matches,
+    get_file_etag,
+    iter_file,
+    parse_range_header,
+)
 from src.utils.config import config
-from src.utils.dependencies import get_pdf_generator, get_storage_client
-from src.utils.storage import GoogleDriveClient, LocalStorageClient, StorageClient
+from src.utils.async_storage import AsyncStorageClient
+from src.utils.dependencies import get_async_storage_client, get_pdf_generator
+from src.utils.warmup import warm_up
 from src.utils.exceptions import (
     FeatureDisabledError,
     FileNotFoundError,
     InvalidSignatureError,
     PDFGenerationError,
+    RangeNotSatisfiableError,
+    ServiceOverloadedError,
+    UnauthorizedError,
 )
 from src.models import DataPerjanjianPemasaranProperti
+from contextlib import asynccontextmanager
 from functools import wraps
-
-
-app = FastAPI()
+from typing import BinaryIO, Literal, Optional, Tuple
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(warm_up)
+    if config.HEPI_FF_FAST_DEDUP:
+        await asyncio.to_thread(completed_responses.load)
+    sweeper = None
+    if config.HEPI_FF_CHECKPOINTS:
+        sweeper = asyncio.create_task(sweep_checkpoints())
+    monitor = None
+    if config.HEPI_FF_LOOP_MONITOR:
+        from src.utils.loop_monitor import loop_monitor
+
+        monitor = asyncio.create_task(loop_monitor.run())
+    syncer = None
+    if config.HEPI_FF_DRIVE_SYNC and config.HEPI_FF_UPLOAD_TO_DRIVE:
+        syncer = asyncio.create_task(sync_agreement_index())
+    readiness.mark_ready()
+    yield
+    if sweeper:
+        sweeper.cancel()
+    if syncer:
+        syncer.cancel()
+    if monitor:
+        monitor.cancel()
+    if config.HEPI_FF_NORMALIZE_IMAGES:
+        from src.image_normalizer import image_normalizer
+
+        image_normalizer.shutdown()
+    if config.HEPI_FF_FAST_DEDUP:
+        await asyncio.to_thread(completed_responses.save)
+    if config.HEPI_FF_UPLOAD_TO_DRIVE:
+        from src.utils.async_google_drive import AsyncGoogleDriveClient
+
+        await AsyncGoogleDriveClient.aclose()
+    elif config.HEPI_FF_UPLOAD_TO_S3:
+        from src.utils.async_s3 import AsyncS3StorageClient
+
+        await AsyncS3StorageClient.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+pdf_cache = DiskCache(config.PDF_CACHE_DIR, config.PDF_CACHE_MAX_BYTES, name="pdf")
+preview_cache = DiskCache(
+    config.PREVIEW_CACHE_DIR, config.PREVIEW_CACHE_MAX_BYTES, name="preview"
+)
 
 
 @app.exception_handler(FeatureDisabledError)
 async def feature_disabled_handler(request: Request, exc: FeatureDisabledError):
-    logger.warning(f"Feature disabled: {str(exc)}")
+    logger.warning("Feature disabled: %s", exc)
     return JSONResponse(
         status_code=403,
         content={"message": "Feature is disabled"},
@@ -33,7 +115,7 @@ async def feature_disabled_handler(request: Request, exc: FeatureDisabledError):
 
 @app.exception_handler(FileNotFoundError)
 async def file_not_found_handler(request: Request, exc: FileNotFoundError):
-    logger.warning(f"File not found: {str(exc)}")
+    logger.warning("File not found: %s", exc)
     return JSONResponse(
         status_code=404,
         content={"message": str(exc)},
@@ -42,16 +124,26 @@ async def file_not_found_handler(request: Request, exc: FileNotFoundError):
 
 @app.exception_handler(InvalidSignatureError)
 async def invalid_signature_handler(request: Request, exc: InvalidSignatureError):
-    logger.warning(f"Invalid signature: {str(exc)}")
+    logger.warning("Invalid signature: %s", exc)
     return JSONResponse(
         status_code=401,
         content={"message": "Invalid signature"},
     )
 
 
+@app.exception_handler(UnauthorizedError)
+async def unauthorized_handler(request: Request, exc: UnauthorizedError):
+    logger.warning("Unauthorized: %s", exc)
+    return JSONResponse(
+        status_code=401,
+        content={"message": "Unauthorized"},
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {str(exc)}")
+    logger.error("Unhandled exception: %s", exc)
     return JSONResponse(
         status_code=500,
         content={"message": "Internal server error"},
@@ -60,22 +152,102 @@ async def generic_exception_handler(request: Request, exc: Exception):
 
 @app.exception_handler(PDFGenerationError)
 async def pdf_generation_handler(request: Request, exc: PDFGenerationError):
-    logger.error(f"PDF generation failed: {exc}")
+    logger.error("PDF generation failed: %s", exc)
     return JSONResponse(
         status_code=500,
         content={"message": "Failed to generate PDF"},
     )
 
 
+@app.middleware("http")
+async def limit_concurrent_submissions(request: Request, call_next):
+    """
+    Admit a bounded number of submissions, and shed the rest with a fast 503.
+
+    Also answers the ServiceOverloadedError a submission raises itself, which
+    reaches this middleware through call_next.
+    """
+    if request.method != "POST" or request.url.path != "/submit/":
+        return await call_next(request)
+    try:
+        async with submit_admission.admit():
+            return await call_next(request)
+    except ServiceOverloadedError:
+        return JSONResponse(
+            status_code=503,
+            content={"message": "Server is busy, retry later"},
+            headers={"Retry-After": str(config.SUBMIT_RETRY_AFTER)},
+        )
+
+
+@app.middleware("http")
+async def reject_duplicate_submissions(request: Request, call_next):
+    """
+    Answer redelivered webhooks of completed responses before the body is parsed.
+    """
+    if not (
+        config.HEPI_FF_FAST_DEDUP
+        and config.HEPI_FF_SUBMIT_FORM
+        and request.method == "POST"
+        and request.url.path == "/submit/"
+    ):
+        return await call_next(request)
+
+    body = await request.body()
+    if not is_valid_webhook(body, request.headers.get("tally-signature")):
+        # Let the endpoint reject it as usual
+        return await call_next(request)
+    request.state.tally_signature_verified = True
+
+    event_id, response_id = scan_event_ids(body)
+    result = completed_responses.get(event_id, response_id)
+    if (
+        result is None
+        and response_id
+        and completed_responses.might_contain(response_id)
+    ):
+        # Confirm the Bloom filter hit, without parsing the body
+        metrics.increment("dedup_bloom_hits")
+        get_client = app.dependency_overrides.get(
+            get_async_storage_client, get_async_storage_client
+        )
+        try:
+            file_url = await get_client().get_file_url(response_id)
+        except Exception as e:
+            logger.warning(
+                "Failed to confirm duplicate response %s: %s", response_id, e
+            )
+            file_url = None
+        if file_url:
+            result = {"message": "File already exists", "file_url": file_url}
+            await asyncio.to_thread(
+                completed_responses.add, event_id, response_id, result
+            )
+        else:
+            metrics.increment("dedup_bloom_false_positives")
+
+    if result is None:
+        return await call_next(request)
+    metrics.increment("dedup_fast_path_hits")
+    logger.info("Answering duplicate webhook for response_id: %s", response_id)
+    return JSONResponse(content=result)
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
-    logger.info(f"Request started, path={request.url.path}, method={request.method}")
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    start_request_context(request_id)
+    logger.info("Request started, path=%s, method=%s", request.url.path, request.method)
     response = await call_next(request)
     process_time = time.time() - start_time
     logger.info(
-        f"Request completed, path={request.url.path}, status_code={response.status_code}, process_time={process_time:.2f}s"
+        "Request completed, path=%s, status_code=%s, process_time=%.2fs",
+        request.url.path,
+        response.status_code,
+        process_time,
     )
+    response.headers["X-Request-ID"] = request_id
     return response
 
 
@@ -93,6 +265,26 @@ def check_feature_enabled(feature_flag: str):
     return decorator
 
 
+def profile_if_requested(func):
+    """
+    Profile a submission when asked by a signed header, or when sampled.
+    """
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not config.HEPI_FF_PROFILING:
+            return await func(*args, **kwargs)
+
+        response_id = kwargs["data"].data.responseId
+        signature = kwargs["request"].headers.get("x-profile-signature")
+        if not is_profile_requested(signature, response_id):
+            return await func(*args, **kwargs)
+        with profile_session(response_id):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
 # Function to verify the Tally signature
 def verify_tally_signature(payload: bytes, received_signature: str) -> bool:
     """
@@ -106,6 +298,17 @@ def verify_tally_signature(payload: bytes, received_signature: str) -> bool:
     return hmac.compare_digest(computed_hmac, received_signature.encode("utf-8"))
 
 
+def is_valid_webhook(payload: bytes, tally_signature: str) -> bool:
+    """
+    Check a webhook signature, which is not required in development/test/local.
+    """
+    if config.ENVIRONMENT in ["development", "test", "local"]:
+        return True
+    return tally_signature is not None and verify_tally_signature(
+        payload, tally_signature
+    )
+
+
 # Dependency to verify the Tally signature
 async def verify_webhook(
     request: Request, tally_signature: str = Header(None, alias="tally-signature")
@@ -113,8 +316,11 @@ async def verify_webhook(
     if config.ENVIRONMENT in ["development", "test", "local"]:
         logger.debug("Skipping signature verification in development/test/local")
         return True
+    if getattr(request.state, "tally_signature_verified", False):
+        return True
 
-    logger.debug(f"Received Tally signature: {tally_signature}")
+    set_stage("verify")
+    logger.debug("Received Tally signature: %s", tally_signature)
     payload = await request.body()
     if tally_signature is None or not verify_tally_signature(payload, tally_signature):
         raise InvalidSignatureError()
@@ -126,6 +332,18 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+async def ready():
+    if not readiness.is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming up"})
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+
 # Endpoint to generate, upload, and share a PDF
 @app.post(
     "/submit/",
@@ -138,114 +356,582 @@ async def health():
     },
 )
 @check_feature_enabled("HEPI_FF_SUBMIT_FORM")
+@profile_if_requested
 async def submit(
     data: DataPerjanjianPemasaranProperti,
+    request: Request,
+    background_tasks: BackgroundTasks,
     pdf_generator: PDFGenerator = Depends(get_pdf_generator),
-    storage_client: StorageClient = Depends(get_storage_client),
+    storage_client: AsyncStorageClient = Depends(get_async_storage_client),
     _: bool = Depends(verify_webhook),
 ):
-    logger.debug(f"Received data: {data}")
+    logger.debug("Received data: %s", data)
+
+    # Resume a previous attempt that got as far as rendering the PDF
+    if config.HEPI_FF_CHECKPOINTS:
+        submission = await asyncio.to_thread(
+            submission_checkpoints.load, data.data.responseId
+        )
+        if submission:
+            logger.info("Resuming submission from its checkpoint")
+            return await complete_submission(
+                data, submission, storage_client, background_tasks
+            )
 
     # Check if file already exists
-    existing_file = storage_client.get_file_url(data.data.responseId)
+    set_stage("dedup")
+    existing_file = await storage_client.get_file_url(data.data.responseId)
     if existing_file:
-        logger.info(f"File already exists: {existing_file}")
-        return {"message": "File already exists", "file_url": existing_file}
-    logger.info(f"File does not exist, proceeding with PDF generation")
+        logger.info("File already exists: %s", existing_file)
+        result = {"message": "File already exists", "file_url": existing_file}
+        await record_completed_response(data, result)
+        return result
+    logger.info("File does not exist, proceeding with PDF generation")
 
     # Generate and upload the PDF
-    logger.info(f"Generating PDF for user: {data.owner_name}")
-    pdf_stream = pdf_generator.generate(data)
+    set_stage("generate")
+    logger.info("Generating PDF for user: %s", data.owner_name)
+    # Rendering is blocking, and downloads the signatures, so it runs in a
+    # thread, letting the admitted submissions actually proceed concurrently
+    pdf_stream = await asyncio.to_thread(profile_call, pdf_generator.generate, data)
 
     filename = data.get_filename()
     properties = data.get_form_properties()
-    logger.info(f"PDF generated successfully: {filename}")
-    logger.debug(f"PDF properties: {properties}")
-
-    # Upload the PDF to Google Drive
-    logger.info(f"Uploading PDF: {filename}")
-    file_id = upload_file(pdf_stream, filename, "application/pdf", storage_client, properties)
-    if data.owner_email:
-        logger.info(f"Sharing PDF with email: {data.owner_email}")
-        storage_client.share(file_id, data.owner_email)
-
-    # Upload the supplementary documents if it exists
-    logger.info("Uploading supplementary documents")
-    if file := data.property_certificate_file:
-        upload_filename = filename.replace(".pdf", "_property_certificate.pdf")
-        mimetype = data.property_certificate_mime_type
-        if mimetype == "image/jpeg":
-            upload_filename = upload_filename.replace(".pdf", ".jpg")
-        elif mimetype == "image/png":
-            upload_filename = upload_filename.replace(".pdf", ".png")
-        upload_file(file, upload_filename, mimetype, storage_client)
-
-    if file := data.owner_ktp_file:
-        upload_filename = filename.replace(".pdf", "_owner_ktp.pdf")
-        mimetype = data.owner_ktp_mime_type
-        if mimetype == "image/jpeg":
-            upload_filename = upload_filename.replace(".pdf", ".jpg")
-        elif mimetype == "image/png":
-            upload_filename = upload_filename.replace(".pdf", ".png")
-        upload_file(file, upload_filename, mimetype, storage_client)
-
-    if file := data.property_pbb_file:
-        upload_filename = filename.replace(".pdf", "_property_pbb.pdf")
-        mimetype = data.property_pbb_mime_type
-        if mimetype == "image/jpeg":
-            upload_filename = upload_filename.replace(".pdf", ".jpg")
-        elif mimetype == "image/png":
-            upload_filename = upload_filename.replace(".pdf", ".png")
-        upload_file(file, upload_filename, mimetype, storage_client)
-
-    if file := data.property_imb_file:
-        upload_filename = filename.replace(".pdf", "_property_imb.pdf")
-        mimetype = data.property_imb_mime_type
-        if mimetype == "image/jpeg":
-            upload_filename = upload_filename.replace(".pdf", ".jpg")
-        elif mimetype == "image/png":
-            upload_filename = upload_filename.replace(".pdf", ".png")
-        upload_file(file, upload_filename, mimetype, storage_client)
-
-    logger.info(f"PDF uploaded and shared successfully: {file_id}")
-    return {"message": "PDF uploaded and shared", "file_id": file_id}
-
-
-def upload_file(
-    file: bytes,
+    properties["pdf_engine"] = pdf_generator.engine
+    logger.info("PDF generated successfully: %s", filename)
+    logger.debug("PDF properties: %s", properties)
+
+    # Shrink the supplementary photos if enabled
+    documents = await asyncio.to_thread(profile_call, data.get_supplementary_documents)
+    if config.HEPI_FF_NORMALIZE_IMAGES and documents:
+        from src.image_normalizer import image_normalizer
+
+        set_stage("normalize")
+        documents = await image_normalizer.normalize(documents)
+
+    # Merge the supplementary documents into the agreement if enabled
+    if config.HEPI_FF_BUNDLE_DOCUMENTS and documents:
+        from src.pdf_bundler import PyMuPDFDocumentBundler
+
+        set_stage("bundle")
+        logger.info("Bundling supplementary documents into the PDF")
+        pdf_stream, documents = await asyncio.to_thread(
+            profile_call, PyMuPDFDocumentBundler().bundle, pdf_stream, documents
+        )
+
+    submission = Submission(
+        response_id=data.data.responseId,
+        filename=filename,
+        email=data.owner_email,
+        properties=properties,
+        pdf=pdf_stream,
+        documents=documents,
+    )
+    if config.HEPI_FF_CHECKPOINTS:
+        set_stage("checkpoint")
+        await asyncio.to_thread(submission_checkpoints.save, submission)
+    return await complete_submission(data, submission, storage_client, background_tasks)
+
+
+async def complete_submission(
+    data: DataPerjanjianPemasaranProperti,
+    submission: Submission,
+    storage_client: AsyncStorageClient,
+    background_tasks: BackgroundTasks,
+) -> dict:
+    """
+    Upload a rendered submission, and record its result.
+    """
+    if config.HEPI_FF_CHECKPOINTS:
+        async with lock_checkpoint(submission.response_id) as acquired:
+            if not acquired:
+                raise ServiceOverloadedError("Submission is being resumed elsewhere")
+            file_id = await upload_submission(submission, storage_client)
+            await asyncio.to_thread(
+                submission_checkpoints.remove, submission.response_id
+            )
+    else:
+        file_id = await upload_submission(submission, storage_client)
+
+    if config.HEPI_FF_AGREEMENTS_API:
+        await index_agreement(file_id, submission.properties, submission.folder_id)
+    if config.HEPI_FF_PDF_PREVIEW:
+        background_tasks.add_task(
+            asyncio.to_thread, cache_preview, submission.response_id, submission.pdf
+        )
+    result = {"message": "PDF uploaded and shared", "file_id": file_id}
+    if submission.file_url:
+        result["file_url"] = submission.file_url
+    await record_completed_response(data, result)
+    return result
+
+
+async def upload_submission(
+    submission: Submission, storage_client: AsyncStorageClient
+) -> str:
+    """
+    Upload and share the PDF and upload the supplementary documents concurrently,
+    skipping what an earlier attempt already did.
+    """
+    set_stage("upload")
+    if submission.folder_id is None:
+        submission.folder_id = await get_result_folder(
+            submission.properties, storage_client
+        )
+
+    async def upload_agreement() -> str:
+        file_id = submission.uploads.get("agreement")
+        if file_id is None:
+            logger.info("Uploading PDF: %s", submission.filename)
+            file_id = await upload_file(
+                submission.pdf,
+                submission.filename,
+                "application/pdf",
+                storage_client,
+                submission.properties,
+                submission.folder_id,
+            )
+            submission.uploads["agreement"] = file_id
+            await save_progress(submission)
+        if submission.email and not submission.shared:
+            logger.info("Sharing PDF with email: %s", submission.email)
+            # S3 cannot notify the owner, and hands back a presigned URL instead
+            submission.file_url = await storage_client.share(
+                file_id, submission.email
+            )
+            submission.shared = True
+            await save_progress(submission)
+        return file_id
+
+    async def upload_document(name: str, file: Buffer, mimetype: str):
+        if name in submission.uploads:
+            return
+        file_id = await upload_file(
+            file,
+            get_supplementary_filename(submission.filename, name, mimetype),
+            mimetype,
+            storage_client,
+            folder_id=submission.folder_id,
+        )
+        submission.uploads[name] = file_id
+        await save_progress(submission)
+
+    file_id, *_ = await asyncio.gather(
+        upload_agreement(),
+        *[
+            upload_document(name, file, mimetype)
+            for name, file, mimetype in submission.documents
+        ],
+    )
+    logger.info("PDF uploaded and shared successfully: %s", file_id)
+    return file_id
+
+
+async def get_result_folder(
+    properties: dict, storage_client: AsyncStorageClient
+) -> Optional[str]:
+    """
+    The folder a submission is uploaded to, its date and agent shard if enabled.
+    """
+    if not (
+        config.HEPI_FF_DRIVE_SHARDING
+        and config.HEPI_FF_UPLOAD_TO_DRIVE
+        and config.HEPI_PDF_RESULT_DRIVE_ID
+    ):
+        return config.HEPI_PDF_RESULT_DRIVE_ID
+    from src.utils.drive_folders import drive_folders
+
+    return await drive_folders.get_shard_folder(storage_client, properties)
+
+
+async def save_progress(submission: Submission):
+    """
+    Remember the uploads and share done so far, so a retry does not redo them.
+    """
+    if config.HEPI_FF_CHECKPOINTS:
+        await asyncio.to_thread(submission_checkpoints.record, submission)
+
+
+@asynccontextmanager
+async def lock_checkpoint(response_id: str):
+    """
+    Hold the lock of a checkpoint, opening and releasing its file off the loop.
+    """
+    lock = submission_checkpoints.lock(response_id)
+    acquired = await asyncio.to_thread(lock.__enter__)
+    try:
+        yield acquired
+    finally:
+        await asyncio.to_thread(lock.__exit__, None, None, None)
+
+
+async def sweep_checkpoints():
+    """
+    Finish the uploads of submissions left stuck, e.g. by a failed share.
+    """
+    storage_client = get_async_storage_client()
+    while True:
+        await asyncio.sleep(config.CHECKPOINT_SWEEP_INTERVAL)
+        stale = await asyncio.to_thread(
+            submission_checkpoints.get_stale, config.CHECKPOINT_SWEEP_AFTER
+        )
+        for response_id in stale:
+            start_request_context(f"sweep-{uuid.uuid4().hex[:8]}")
+            async with lock_checkpoint(response_id) as acquired:
+                if not acquired:
+                    continue
+                submission = await asyncio.to_thread(
+                    submission_checkpoints.load, response_id
+                )
+                if submission is None:
+                    continue
+                try:
+                    logger.info("Resuming stuck submission: %s", response_id)
+                    file_id = await upload_submission(submission, storage_client)
+                except Exception as e:
+                    logger.warning("Failed to resume %s: %s", response_id, e)
+                    metrics.increment("checkpoints_sweep_failures")
+                    continue
+                await asyncio.to_thread(submission_checkpoints.remove, response_id)
+            metrics.increment("checkpoints_swept")
+            if config.HEPI_FF_AGREEMENTS_API:
+                await index_agreement(
+                    file_id, submission.properties, submission.folder_id
+                )
+
+
+async def sync_agreement_index():
+    """
+    Apply the Drive changes to the agreement index, e.g. trashed agreements.
+
+    Only the worker holding the sync lock polls Drive, the others wait to take
+    over should it exit.
+    """
+    while True:
+        with agreement_index.sync_lock() as leader:
+            if leader:
+                logger.info("Following the Drive changes feed in this worker")
+                while True:
+                    try:
+                        await sync_from_drive(agreement_index)
+                    except Exception as e:
+                        logger.warning("Failed to sync the agreement index: %s", e)
+                        metrics.increment("agreement_index_sync_failures")
+                    await asyncio.sleep(config.DRIVE_SYNC_INTERVAL)
+        await asyncio.sleep(config.DRIVE_SYNC_INTERVAL)
+
+
+async def record_completed_response(
+    data: DataPerjanjianPemasaranProperti, result: dict
+):
+    """
+    Remember the result of a response, so its redeliveries take the fast path.
+    """
+    if config.HEPI_FF_FAST_DEDUP:
+        await asyncio.to_thread(
+            completed_responses.add, str(data.eventId), data.data.responseId, result
+        )
+
+
+async def index_agreement(file_id: str, properties: dict, folder_id: Optional[str]):
+    """
+    Keep the agreement index current, without failing the submission.
+    """
+    try:
+        await asyncio.to_thread(agreement_index.upsert, file_id, properties, folder_id)
+    except Exception as e:
+        logger.warning("Failed to index agreement %s: %s", file_id, e)
+
+
+def cache_preview(response_id: str, pdf_stream: Buffer):
+    """
+    Cache a freshly generated PDF and its thumbnail, so the first preview is a hit.
+    """
+    try:
+        path = pdf_cache.put(response_id, pdf_stream)
+        with open(path, "rb") as pdf_file:
+            render_preview(response_id, pdf_file, config.PREVIEW_WIDTH)
+    except Exception as e:
+        logger.warning("Failed to cache preview of %s: %s", response_id, e)
+
+
+def get_supplementary_filename(filename: str, name: str, mimetype: str) -> str:
+    """
+    Derive the upload filename of a supplementary document from the agreement's.
+    """
+    upload_filename = filename.replace(".pdf", f"_{name}.pdf")
+    if mimetype == "image/jpeg":
+        upload_filename = upload_filename.replace(".pdf", ".jpg")
+    elif mimetype == "image/png":
+        upload_filename = upload_filename.replace(".pdf", ".png")
+    return upload_filename
+
+
+async def upload_file(
+    file: Buffer,
     filename: str,
     file_mimetype: str = "application/pdf",
-    storage_client: StorageClient = Depends(get_storage_client),
+    storage_client: AsyncStorageClient = Depends(get_async_storage_client),
     custom_property: dict = None,
+    folder_id: Optional[str] = config.HEPI_PDF_RESULT_DRIVE_ID,
 ) -> str:
     """
     Upload a document to Storage Client.
     """
-    logger.info(f"Uploading document: {filename}")
-    file_id = storage_client.upload(
-        file, filename, file_mimetype, config.HEPI_PDF_RESULT_DRIVE_ID, custom_property
+    logger.info("Uploading document: %s", filename)
+    file_id = await storage_client.upload(
+        file, filename, file_mimetype, folder_id, custom_property
     )
-    logger.info(f"Document uploaded successfully: {file_id}")
+    logger.info("Document uploaded successfully: %s", file_id)
     return file_id
 
 
+# Dependency to verify the reporting API token
+async def verify_api_token(authorization: str = Header(None)):
+    expected = config.AGREEMENTS_API_TOKEN
+    if not expected or not authorization:
+        raise UnauthorizedError("Missing API token")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode("utf-8"), expected.encode("utf-8")
+    ):
+        raise UnauthorizedError("Invalid API token")
+    return True
+
+
+@app.get("/agreements")
+@check_feature_enabled("HEPI_FF_AGREEMENTS_API")
+async def list_agreements(
+    agent_name: Optional[str] = None,
+    owner_name: Optional[str] = None,
+    cp_name: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    property_type: Optional[str] = None,
+    property_address: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    sort: Literal["created_at", "agent_name", "owner_name", "property_type"] = (
+        "created_at"
+    ),
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    _: bool = Depends(verify_api_token),
+):
+    """
+    Find agreements in the local metadata index, without querying Drive.
+    """
+    filters = {
+        "agent_name": agent_name,
+        "owner_name": owner_name,
+        "cp_name": cp_name,
+        "transaction_type": transaction_type,
+        "property_type": property_type,
+        "property_address": property_address,
+    }
+    items, total = await asyncio.to_thread(
+        agreement_index.query,
+        filters,
+        created_from,
+        created_to,
+        sort,
+        order == "desc",
+        limit,
+        offset,
+    )
+    return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+
+@app.get("/agreements/export")
+@check_feature_enabled("HEPI_FF_AGREEMENTS_API")
+async def export_agreements(
+    format: Literal["json", "parquet"] = "json",
+    _: bool = Depends(verify_api_token),
+):
+    """
+    Export the whole index column by column, for bulk analysis.
+    """
+    if format == "parquet":
+        if not PYARROW_AVAILABLE:
+            raise FeatureDisabledError("Parquet export requires pyarrow")
+        content = await asyncio.to_thread(agreement_index.export_parquet)
+        return Response(
+            content=content,
+            media_type="application/vnd.apache.parquet",
+            headers={
+                "Content-Disposition": 'attachment; filename="agreements.parquet"'
+            },
+        )
+    return await asyncio.to_thread(agreement_index.export_columns)
+
+
 @app.get("/pdf/{response_id}")
 @check_feature_enabled("HEPI_FF_DOWNLOAD_PDF")
 async def get_pdf(
     response_id: str,
-    storage_client: StorageClient = Depends(get_storage_client),
+    request: Request,
+    storage_client: AsyncStorageClient = Depends(get_async_storage_client),
+    authorization: str = Header(None),
 ):
-    logger.info(f"Fetching file by response_id: {response_id}")
-    file_url = storage_client.get_file_url(response_id)
-
-    # Redirect to the file URL
-    logger.info(f"Redirecting to sharable link: {file_url}")
+    # The bytes are only served to API clients. Anyone else, e.g. a respondent
+    # redirected by Tally, is sent to the stored file, whose sharing decides.
+    # Local files have no URL of their own, so they are always streamed.
+    if storage_client.url_is_app_route or (
+        config.HEPI_FF_STREAM_PDF and authorization
+    ):
+        await verify_api_token(authorization)
+        return await stream_pdf(response_id, request, storage_client)
+
+    # A presigned URL is as good as the file, unlike a link checked by Drive
+    if storage_client.url_grants_access:
+        await verify_api_token(authorization)
+
+    logger.info("Fetching file by response_id: %s", response_id)
+    file_url = await storage_client.get_file_url(response_id)
+
+    # Redirect to the file URL, without logging a presigned signature
+    logger.info("Redirecting to sharable link: %s", file_url.partition("?")[0])
     return Response(
         status_code=302,
         headers={"Location": file_url},
     )
 
 
+async def open_cached_pdf(
+    response_id: str, storage_client: AsyncStorageClient
+) -> BinaryIO:
+    """
+    Open the PDF in the local cache, downloading it on a cache miss.
+
+    The caller reads it through the handle, which stays valid when another
+    worker evicts the file, and closes it.
+    """
+    pdf_file = await asyncio.to_thread(open_cache_entry, pdf_cache, response_id)
+    if pdf_file is not None:
+        return pdf_file
+    logger.info("Downloading file to cache by response_id: %s", response_id)
+    file_stream = await storage_client.download(response_id)
+    content = file_stream.read()
+    path = await asyncio.to_thread(pdf_cache.put, response_id, content)
+    try:
+        return await asyncio.to_thread(open, path, "rb")
+    except OSError:
+        # Evicted right away, e.g. when larger than the whole cache
+        pdf_file = await asyncio.to_thread(tempfile.TemporaryFile)
+        await asyncio.to_thread(pdf_file.write, content)
+        return pdf_file
+
+
+def open_cache_entry(cache: DiskCache, key: str) -> Optional[BinaryIO]:
+    path = cache.get(key)
+    if path is None:
+        return None
+    try:
+        return open(path, "rb")
+    except OSError:
+        # Evicted by another worker in the meantime
+        return None
+
+
+async def stream_pdf(
+    response_id: str, request: Request, storage_client: AsyncStorageClient
+) -> Response:
+    """
+    Serve the PDF bytes from the local cache, downloading it on a cache miss.
+    """
+    pdf_file = await open_cached_pdf(response_id, storage_client)
+    try:
+        etag = await asyncio.to_thread(get_file_etag, pdf_file)
+        size = os.fstat(pdf_file.fileno()).st_size
+    except BaseException:
+        pdf_file.close()
+        raise
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        pdf_file.close()
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range_header(request.headers.get("range"), size)
+        except RangeNotSatisfiableError as e:
+            logger.warning("Range not satisfiable: %s", e)
+            pdf_file.close()
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Disposition"] = f'inline; filename="{response_id}.pdf"'
+
+    logger.info("Streaming file %s, bytes=%s-%s/%s", response_id, start, end, size)
+    return StreamingResponse(
+        iter_file(pdf_file, start, end),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers,
+    )
+
+
+@app.get("/pdf/{response_id}/preview.png")
+@check_feature_enabled("HEPI_FF_PDF_PREVIEW")
+async def get_pdf_preview(
+    response_id: str,
+    request: Request,
+    width: int = Query(config.PREVIEW_WIDTH, ge=64, le=config.PREVIEW_MAX_WIDTH),
+    storage_client: AsyncStorageClient = Depends(get_async_storage_client),
+    _: bool = Depends(verify_api_token),
+):
+    """
+    Serve a PNG thumbnail of the first page of the PDF, rendered once per width.
+    """
+    pdf_file = await open_cached_pdf(response_id, storage_client)
+    try:
+        content, etag = await asyncio.to_thread(
+            render_preview, response_id, pdf_file, width
+        )
+    finally:
+        pdf_file.close()
+    # Thumbnails are keyed by the document hash, so they never go stale
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="image/png", headers=headers)
+
+
+def render_preview(
+    response_id: str, pdf_file: BinaryIO, width: int
+) -> Tuple[bytes, str]:
+    """
+    Return the cached thumbnail of a PDF and its ETag, rendering it on a cache miss.
+    """
+    from src.pdf_preview import render_first_page
+
+    document_hash = get_file_etag(pdf_file).strip('"')
+    key = f"{response_id}:{document_hash}:{width}"
+    etag = f'"{document_hash}-{width}"'
+    preview_file = open_cache_entry(preview_cache, key)
+    if preview_file is not None:
+        with preview_file:
+            return preview_file.read(), etag
+    logger.info("Rendering %spx preview of response_id: %s", width, response_id)
+    pdf_file.seek(0)
+    content = render_first_page(pdf_file.read(), width)
+    preview_cache.put(key, content)
+    return content, etag
+
+
 # Run the server
 if __name__ == "__main__":
     import uvicorn
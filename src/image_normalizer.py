@@ -0,0 +1,192 @@
+import asyncio
+import multiprocessing
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+import pymupdf
+from src.pdf_bundler import IMAGE_MIME_TYPES, PDF_MIME_TYPE, SupplementaryDocument
+from src.utils.config import config
+from src.utils.exceptions import ImageNormalizationError
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# Counterclockwise rotation that displays a JPEG upright, by EXIF orientation.
+# The mirrored orientations are left alone, phone cameras do not produce them.
+EXIF_ROTATIONS = {3: 180, 6: 270, 8: 90}
+
+
+def get_exif_orientation(content: bytes) -> int:
+    """The EXIF orientation of a JPEG, 1 (upright) if it has none."""
+    offset = 2
+    while offset + 4 <= len(content) and content[offset] == 0xFF:
+        marker = content[offset + 1]
+        (length,) = struct.unpack(">H", content[offset + 2 : offset + 4])
+        segment = content[offset + 4 : offset + 2 + length]
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            tiff = segment[6:]
+            endian = "<" if tiff[:2] == b"II" else ">"
+            (ifd,) = struct.unpack(f"{endian}I", tiff[4:8])
+            (entries,) = struct.unpack(f"{endian}H", tiff[ifd : ifd + 2])
+            for i in range(entries):
+                entry = tiff[ifd + 2 + i * 12 : ifd + 14 + i * 12]
+                tag, _, _, value = struct.unpack(f"{endian}HHIH", entry[:10])
+                if tag == 0x0112:
+                    return value
+            return 1
+        if marker == 0xDA:
+            # Start of the image data, the metadata segments are all before it
+            break
+        offset += 2 + length
+    return 1
+
+
+def render_image(content: bytes, width: int, height: int, rotate: int):
+    """Rasterize an image at the given size, after rotating it counterclockwise."""
+    doc = pymupdf.open()
+    try:
+        page = doc.new_page(width=width, height=height)
+        page.insert_image(page.rect, stream=content, rotate=rotate)
+        return page.get_pixmap(alpha=False)
+    finally:
+        doc.close()
+
+
+def image_to_pdf(content: bytes, margin: int = 36) -> bytes:
+    """Wrap an image in a single A4 page, landscape for landscape images."""
+    pixmap = pymupdf.Pixmap(content)
+    landscape = pixmap.width > pixmap.height
+    page_rect = pymupdf.paper_rect("a4-l" if landscape else "a4")
+    doc = pymupdf.open()
+    try:
+        page = doc.new_page(width=page_rect.width, height=page_rect.height)
+        rect = page_rect + (margin, margin, -margin, -margin)
+        page.insert_image(rect, stream=content, keep_proportion=True)
+        return doc.tobytes(garbage=3, deflate=True)
+    finally:
+        doc.close()
+
+
+def normalize_image(
+    content: bytes, mimetype: str, max_side: int, jpeg_quality: int, to_pdf: bool
+) -> Tuple[bytes, str, float]:
+    """Downscale and recompress an image, returning it with its mimetype.
+
+    Runs in the worker processes, so it only takes and returns plain values.
+    The time spent is returned too, excluding the wait for a free worker.
+    """
+    start_time = time.perf_counter()
+    try:
+        pixmap = pymupdf.Pixmap(content)
+    except Exception as e:
+        # MuPDF errors cannot be pickled back to the calling process
+        raise ImageNormalizationError(f"Cannot decode image: {e}") from None
+    rotate = 0
+    if mimetype == "image/jpeg":
+        rotate = EXIF_ROTATIONS.get(get_exif_orientation(content), 0)
+    scale = min(1.0, max_side / max(pixmap.width, pixmap.height))
+
+    if scale < 1 or rotate:
+        width, height = round(pixmap.width * scale), round(pixmap.height * scale)
+        if rotate in (90, 270):
+            width, height = height, width
+        pixmap = render_image(content, width, height, rotate)
+    elif pixmap.alpha and mimetype == "image/jpeg":
+        pixmap = pymupdf.Pixmap(pixmap, 0)
+    if pixmap.colorspace and pixmap.colorspace.n > 3:
+        pixmap = pymupdf.Pixmap(pymupdf.csRGB, pixmap)
+
+    if mimetype == "image/jpeg":
+        result = pixmap.tobytes("jpeg", jpg_quality=jpeg_quality)
+    else:
+        result = pixmap.tobytes("png")
+    # Recompressing an already compact image can make it bigger
+    if len(result) >= len(content) and not rotate:
+        result = content
+    if to_pdf:
+        return image_to_pdf(result), PDF_MIME_TYPE, time.perf_counter() - start_time
+    return result, mimetype, time.perf_counter() - start_time
+
+
+class ImageNormalizer:
+    """Shrinks the supplementary photos before they are uploaded or bundled.
+
+    Images of IMAGE_MIN_BYTES or less are passed through, as are documents that
+    are not JPEG or PNG. The work is CPU bound, so it runs on a pool of
+    processes started on first use, and each document is normalized in
+    parallel. A document that fails to normalize is kept as it is.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Spawned rather than forked, as the workers of the pre-fork
+                # server run threads that a fork would copy mid-operation
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def should_normalize(self, content: bytes, mimetype: Optional[str]) -> bool:
+        return mimetype in IMAGE_MIME_TYPES and len(content) > config.IMAGE_MIN_BYTES
+
+    async def normalize(
+        self, documents: List[SupplementaryDocument]
+    ) -> List[SupplementaryDocument]:
+        return list(
+            await asyncio.gather(
+                *[self._normalize_document(*document) for document in documents]
+            )
+        )
+
+    async def _normalize_document(
+        self, name: str, content: bytes, mimetype: Optional[str]
+    ) -> SupplementaryDocument:
+        if not self.should_normalize(content, mimetype):
+            metrics.increment("image_normalize_skipped")
+            return name, content, mimetype
+
+        loop = asyncio.get_running_loop()
+        try:
+            result, result_mimetype, elapsed = await loop.run_in_executor(
+                self.get_pool(),
+                normalize_image,
+                bytes(content),
+                mimetype,
+                config.IMAGE_MAX_SIDE,
+                config.IMAGE_JPEG_QUALITY,
+                config.IMAGE_TO_PDF,
+            )
+        except Exception as e:
+            logger.warning("Failed to normalize %s, keeping it as is: %s", name, e)
+            metrics.increment("image_normalize_failures")
+            return name, content, mimetype
+
+        saved = len(content) - len(result)
+        metrics.increment("image_normalize_bytes_saved", saved)
+        metrics.increment("image_normalize_seconds", elapsed)
+        logger.info(
+            "Normalized %s from %s to %s bytes (%s saved) in %.0fms",
+            name,
+            len(content),
+            len(result),
+            saved,
+            elapsed * 1000,
+        )
+        return name, result, result_mimetype
+
+
+# Singleton instance of ImageNormalizer
+image_normalizer = ImageNormalizer(config.IMAGE_WORKERS)
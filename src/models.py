@@ -12,7 +12,18 @@ from pydantic import (
     field_validator,
 )
 from datetime import datetime
-from typing import Annotated, Any, Dict, List, Optional, Union
+from typing import Annotated, Any, Dict, List, Optional, Tuple, Union
+from src.utils.config import config
+from src.utils.disk_cache import DiskCache
+
+# Uploaded media never changes, so every worker and every render of a response
+# can share one download of it
+media_cache = DiskCache(
+    config.MEDIA_CACHE_DIR,
+    config.MEDIA_CACHE_MAX_BYTES,
+    ttl=config.MEDIA_CACHE_TTL,
+    name="media",
+)
 
 
 class BaseField(BaseModel):
@@ -58,10 +69,33 @@ class Media(BaseModel):
     mimeType: str
     size: int
 
+    @property
+    def cache_key(self) -> str:
+        return f"{self.id}:{self.size}"
+
     def download(self) -> bytes:
+        """Fetch the media, through the disk cache if enabled.
+
+        Both the cache and the download block, so this must not be called on
+        the event loop: rendering and get_supplementary_documents run in a
+        worker thread.
+        """
+        if config.HEPI_FF_MEDIA_CACHE:
+            path = media_cache.get(self.cache_key)
+            if path is not None:
+                try:
+                    return path.read_bytes()
+                except FileNotFoundError:
+                    # Evicted by another worker in the meantime
+                    pass
+
         response = requests.get(self.url)
         response.raise_for_status()
-        return response.content
+        content = response.content
+        # A short read is not cached, so the next render downloads it again
+        if config.HEPI_FF_MEDIA_CACHE and len(content) == self.size:
+            media_cache.put(self.cache_key, content)
+        return content
 
 
 class MediaFields(BaseField):
@@ -493,6 +527,20 @@ class DataPerjanjianPemasaranProperti(TallyWebhookEvent):
         property_address_trimmed = self.property_address.split(",")[0][:72]
         return f"Listing - {self.transaction_type} {self.property_type} {property_address_trimmed}.pdf"
 
+    def get_supplementary_documents(self) -> List[Tuple[str, bytes, Optional[str]]]:
+        """Return (name, content, mimetype) of every uploaded supporting document."""
+        documents = [
+            (
+                "property_certificate",
+                self.property_certificate_file,
+                self.property_certificate_mime_type,
+            ),
+            ("owner_ktp", self.owner_ktp_file, self.owner_ktp_mime_type),
+            ("property_pbb", self.property_pbb_file, self.property_pbb_mime_type),
+            ("property_imb", self.property_imb_file, self.property_imb_mime_type),
+        ]
+        return [document for document in documents if document[1]]
+
     def get_form_properties(self) -> Dict[str, str]:
         return {
             "agent_name": self.agent_name,
@@ -0,0 +1,66 @@
+import pymupdf
+from typing import List, Optional, Tuple
+from src.utils.buffers import Buffer
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+SupplementaryDocument = Tuple[str, Buffer, Optional[str]]
+
+IMAGE_MIME_TYPES = {"image/jpeg", "image/png"}
+PDF_MIME_TYPE = "application/pdf"
+
+
+class PyMuPDFDocumentBundler:
+    """Merge supplementary documents into the agreement PDF as extra pages."""
+
+    def __init__(self, margin: int = 36):
+        self.margin = margin
+
+    def bundle(
+        self, agreement: Buffer, documents: List[SupplementaryDocument]
+    ) -> Tuple[memoryview, List[SupplementaryDocument]]:
+        """Append the bundleable documents to the agreement.
+
+        Returns the merged PDF and the documents that could not be bundled,
+        either for their mimetype or because they failed to insert, so the
+        caller can still upload those separately.
+        """
+        doc = pymupdf.open(stream=agreement, filetype="pdf")
+        try:
+            page_rect = doc[0].rect if doc.page_count else pymupdf.paper_rect("legal")
+            leftovers = []
+            for name, content, mimetype in documents:
+                if mimetype not in IMAGE_MIME_TYPES and mimetype != PDF_MIME_TYPE:
+                    logger.warning("Cannot bundle %s with mimetype: %s", name, mimetype)
+                    leftovers.append((name, content, mimetype))
+                    continue
+                page_count = doc.page_count
+                try:
+                    if mimetype == PDF_MIME_TYPE:
+                        self._insert_pdf(doc, content)
+                    else:
+                        self._insert_image(doc, content, page_rect)
+                except Exception as e:
+                    # Drop any page already added for it, upload it separately
+                    if doc.page_count > page_count:
+                        doc.delete_pages(page_count, doc.page_count - 1)
+                    logger.warning("Failed to bundle %s, keeping it apart: %s", name, e)
+                    metrics.increment("bundle_failures")
+                    leftovers.append((name, content, mimetype))
+                    continue
+                logger.info("Bundled supplementary document: %s", name)
+            return memoryview(doc.tobytes(garbage=3, deflate=True)), leftovers
+        finally:
+            doc.close()
+
+    def _insert_pdf(self, doc, content: bytes):
+        # insert_pdf copies the page objects as-is, so vector content and
+        # embedded fonts are kept without rasterizing.
+        with pymupdf.open(stream=content, filetype="pdf") as attachment:
+            doc.insert_pdf(attachment)
+
+    def _insert_image(self, doc, content: bytes, page_rect):
+        page = doc.new_page(width=page_rect.width, height=page_rect.height)
+        rect = page_rect + (self.margin, self.margin, -self.margin, -self.margin)
+        # The original image stream is embedded untouched, only scaled to fit.
+        page.insert_image(rect, stream=content, keep_proportion=True)
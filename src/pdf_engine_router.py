@@ -0,0 +1,209 @@
+import collections
+import statistics
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from src.models import DataPerjanjianPemasaranProperti
+from src.pdf_generator import PerjanjianJasaPemasaranPropertiPDFGenerator
+from src.utils.buffers import Buffer
+from src.utils.config import config
+from src.utils.exceptions import PDFGenerationError
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+
+def create_engine(
+    name: str, timeout: Optional[float] = None
+) -> PerjanjianJasaPemasaranPropertiPDFGenerator:
+    """A fresh generator of the given engine, imported on first use."""
+    if name == "pdfkit":
+        from src.pdfkit_pdf_generator import (
+            PDFKitPerjanjianJasaPemasaranPropertiPDFGenerator,
+        )
+
+        return PDFKitPerjanjianJasaPemasaranPropertiPDFGenerator(timeout=timeout)
+    from src.pymupdf_pdf_generator import (
+        PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator,
+    )
+
+    return PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator()
+
+
+class EngineHealth:
+    """Rolling render latency and outcome of one engine, and its circuit breaker.
+
+    A render fails when it raises or runs past the engine's budget. The
+    breaker opens after `max_failures` failures in a row, or when at least
+    half the window has failed at `max_error_rate` or more, and skips the
+    engine for `cooldown` seconds. After that, a single trial render is let
+    through, whose outcome closes the breaker again or reopens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        budget: float,
+        window: int,
+        max_failures: int,
+        max_error_rate: float,
+        cooldown: float,
+    ):
+        self.name = name
+        self.budget = budget
+        self.max_failures = max_failures
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def error_rate(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(not ok for _, ok in self._samples) / len(self._samples)
+
+    def allow(self) -> bool:
+        """Whether the engine may render now, claiming the trial if half-open."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.open_until:
+                return False
+            if self.open_until:
+                # Half-open: hold the breaker open for everyone else meanwhile
+                self.open_until = now + self.cooldown
+            return True
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._samples.append((latency, ok))
+            if ok:
+                self.consecutive_failures = 0
+                self.open_until = 0.0
+            else:
+                self.consecutive_failures += 1
+            if not ok and self._should_trip():
+                self._trip()
+            self._update_gauges()
+
+    def _should_trip(self) -> bool:
+        if self.open_until or self.consecutive_failures >= self.max_failures:
+            return True
+        enough_samples = len(self._samples) * 2 >= self._samples.maxlen
+        return enough_samples and self.error_rate >= self.max_error_rate
+
+    def _trip(self):
+        logger.warning(
+            "Opening the %s circuit breaker for %ss, error rate %.0f%%",
+            self.name,
+            self.cooldown,
+            self.error_rate * 100,
+        )
+        metrics.increment(f"pdf_engine_{self.name}_breaker_trips")
+        self.open_until = time.monotonic() + self.cooldown
+        self.consecutive_failures = 0
+        self._samples.clear()
+
+    def _update_gauges(self):
+        prefix = f"pdf_engine_{self.name}"
+        metrics.set_gauge(f"{prefix}_error_rate", self.error_rate)
+        metrics.set_gauge(f"{prefix}_breaker_open", int(bool(self.open_until)))
+        latencies = [latency for latency, _ in self._samples]
+        if len(latencies) >= 2:
+            p50, *_, p95 = statistics.quantiles(latencies, n=20)
+            metrics.set_gauge(f"{prefix}_latency_p50", p50)
+            metrics.set_gauge(f"{prefix}_latency_p95", p95)
+
+
+class PDFEngineRouter:
+    """Picks the engine of each render, falling back when one is slow or failing.
+
+    The configured engine is tried first. wkhtmltopdf is killed once it runs
+    past its budget, PyMuPDF renders in-process and cannot be interrupted, so
+    a slow render is kept but still counts as a failure.
+    """
+
+    def __init__(self, engines: Dict[str, EngineHealth]):
+        self.engines = engines
+
+    def get_order(self) -> List[str]:
+        preferred = "pdfkit" if config.USE_HTML_PDF_GENERATOR else "pymupdf"
+        return [preferred, *[name for name in self.engines if name != preferred]]
+
+    def get_candidates(self, order: List[str]) -> Iterator[str]:
+        """The engines to try in turn, each checked only when its turn comes.
+
+        Checking claims the single trial of a half-open breaker, so an engine
+        is not checked unless it would be tried right away.
+        """
+        allowed = False
+        for name in order:
+            if self.engines[name].allow():
+                allowed = True
+                yield name
+        if not allowed:
+            # Every breaker is open, failing outright would not help anyone
+            logger.warning("Every PDF engine is unhealthy, trying %s", order[0])
+            yield order[0]
+
+    def generate(self, data: DataPerjanjianPemasaranProperti) -> Tuple[Buffer, str]:
+        """Render the agreement, returning the PDF and the engine that made it."""
+        order = self.get_order()
+        last_error = None
+        for name in self.get_candidates(order):
+            health = self.engines[name]
+            start_time = time.perf_counter()
+            try:
+                pdf = create_engine(name, timeout=health.budget).generate(data)
+            except Exception as e:
+                health.record(time.perf_counter() - start_time, ok=False)
+                metrics.increment(f"pdf_engine_{name}_failures")
+                logger.warning("PDF engine %s failed: %s", name, e)
+                last_error = e
+                continue
+
+            latency = time.perf_counter() - start_time
+            within_budget = latency <= health.budget
+            health.record(latency, ok=within_budget)
+            if not within_budget:
+                logger.warning(
+                    "PDF engine %s took %.2fs, over its %ss budget",
+                    name,
+                    latency,
+                    health.budget,
+                )
+            if name != order[0]:
+                metrics.increment("pdf_engine_fallbacks")
+            metrics.increment(f"pdf_engine_{name}_renders")
+            return pdf, name
+
+        raise PDFGenerationError(f"Every PDF engine failed: {last_error}")
+
+
+class RoutingPerjanjianJasaPemasaranPropertiPDFGenerator(
+    PerjanjianJasaPemasaranPropertiPDFGenerator
+):
+    def generate(self, data: DataPerjanjianPemasaranProperti) -> Buffer:
+        pdf, self.engine = pdf_engine_router.generate(data)
+        return pdf
+
+
+def get_engine_health(name: str, budget: float) -> EngineHealth:
+    return EngineHealth(
+        name,
+        budget=budget,
+        window=config.PDF_ENGINE_WINDOW,
+        max_failures=config.PDF_ENGINE_MAX_FAILURES,
+        max_error_rate=config.PDF_ENGINE_MAX_ERROR_RATE,
+        cooldown=config.PDF_ENGINE_COOLDOWN,
+    )
+
+
+# Singleton instance of PDFEngineRouter
+pdf_engine_router = PDFEngineRouter(
+    {
+        "pdfkit": get_engine_health("pdfkit", config.PDF_ENGINE_BUDGET_PDFKIT),
+        "pymupdf": get_engine_health("pymupdf", config.PDF_ENGINE_BUDGET_PYMUPDF),
+    }
+)
@@ -1,15 +1,20 @@
 import abc
 import io
+from typing import Optional
 from src.models import DataPerjanjianPemasaranProperti
+from src.utils.buffers import Buffer
 
 
 class PDFGenerator(abc.ABC):
+    # Name of the engine that rendered the last document, kept in its properties
+    engine: Optional[str] = None
+
     @abc.abstractmethod
-    def generate(self, *args, **kwargs) -> bytes:
+    def generate(self, *args, **kwargs) -> Buffer:
         pass
 
 
 class PerjanjianJasaPemasaranPropertiPDFGenerator(PDFGenerator, abc.ABC):
     @abc.abstractmethod
-    def generate(self, data: DataPerjanjianPemasaranProperti) -> bytes:
+    def generate(self, data: DataPerjanjianPemasaranProperti) -> Buffer:
         pass
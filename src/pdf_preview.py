@@ -0,0 +1,14 @@
+import pymupdf
+from src.utils.buffers import Buffer
+
+
+def render_first_page(pdf: Buffer, width: int) -> bytes:
+    """Render the first page of a PDF as a PNG of the given width in pixels."""
+    doc = pymupdf.open(stream=pdf, filetype="pdf")
+    try:
+        page = doc[0]
+        zoom = width / page.rect.width
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return pixmap.tobytes("png")
+    finally:
+        doc.close()
@@ -1,42 +1,171 @@
 import base64
-import io
+import functools
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
 import pdfkit
-from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from markupsafe import Markup
 from src.pdf_generator import PerjanjianJasaPemasaranPropertiPDFGenerator
+from src.utils.config import config
+from src.utils.exceptions import PDFGenerationError
 
-templates = Jinja2Templates(directory="static/templates")
-template = templates.get_template("template_v1.html.j2")
+PDF_OPTIONS = {
+    "page-size": "Legal",
+    "margin-top": "0mm",  # Minimize margins to maximize content area
+    "margin-right": "0mm",
+    "margin-bottom": "0mm",
+    "margin-left": "0mm",
+    "encoding": "UTF-8",
+}
+
+# Chunks of rendered HTML are batched up to this size before each pipe write
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+@functools.cache
+def get_logo_image() -> str:
+    """Return the logo as a data URI, encoded once per process."""
+    with open("static/images/logo.png", "rb") as img_file:
+        logo_b64 = base64.b64encode(img_file.read()).decode("utf-8")
+    return f"data:image/png;base64,{logo_b64}"
+
+
+def get_image_data_uri(image: bytes) -> Markup:
+    # Base64 never needs escaping, marking it safe spares autoescape a full scan
+    return Markup(f"data:image/png;base64,{base64.b64encode(image).decode('ascii')}")
+
+
+@functools.cache
+def get_template_environment() -> Environment:
+    """Jinja environment whose compiled templates persist across restarts."""
+    cache_dir = Path(config.TEMPLATE_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    environment = Environment(
+        loader=FileSystemLoader("static/templates"),
+        bytecode_cache=FileSystemBytecodeCache(str(cache_dir)),
+        autoescape=True,
+        auto_reload=config.DEBUG,
+    )
+    # Static fragments are rendered once and shared by every request
+    environment.globals["logo_image"] = Markup(get_logo_image())
+    return environment
+
+
+def get_template():
+    return get_template_environment().get_template("template_v1.html.j2")
+
+
+@functools.cache
+def get_pdfkit_configuration() -> pdfkit.configuration:
+    return pdfkit.configuration()
+
+
+def write_rendered_html(chunks, stdin, errors: list):
+    """Feed the rendered template into wkhtmltopdf, as it is being rendered."""
+    try:
+        buffer = []
+        buffered = 0
+        for chunk in chunks:
+            data = chunk.encode("utf-8")
+            buffer.append(data)
+            buffered += len(data)
+            if buffered >= WRITE_BUFFER_SIZE:
+                stdin.write(b"".join(buffer))
+                buffer.clear()
+                buffered = 0
+        stdin.write(b"".join(buffer))
+    except BrokenPipeError:
+        # wkhtmltopdf exited early, its exit code and stderr tell why
+        pass
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def render_pdf(chunks, timeout: Optional[float] = None) -> bytes:
+    """Run wkhtmltopdf on streamed HTML chunks and return the PDF bytes.
+
+    wkhtmltopdf is killed if it runs for longer than `timeout` seconds.
+    """
+    command = pdfkit.PDFKit(
+        "", "string", options=PDF_OPTIONS, configuration=get_pdfkit_configuration()
+    ).command()
+    # stderr goes to a file, so only stdout has to be drained while writing
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            # Its own process group, so a timeout kills anything it spawned too
+            start_new_session=True,
+        )
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        killer = threading.Timer(timeout, kill) if timeout else None
+        if killer:
+            killer.daemon = True
+            killer.start()
+        errors = []
+        writer = threading.Thread(
+            target=write_rendered_html,
+            args=(chunks, process.stdin, errors),
+            name="wkhtmltopdf-writer",
+            daemon=True,
+        )
+        writer.start()
+        pdf = process.stdout.read()
+        process.stdout.close()
+        exit_code = process.wait()
+        writer.join()
+        if killer:
+            killer.cancel()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode("utf-8", errors="replace")
+
+    if timed_out.is_set():
+        raise PDFGenerationError(f"wkhtmltopdf timed out after {timeout}s")
+    if errors:
+        raise PDFGenerationError(f"Failed to render template: {errors[0]}")
+    try:
+        pdfkit.PDFKit.handle_error(exit_code, stderr)
+    except IOError as e:
+        raise PDFGenerationError(str(e)) from e
+    return pdf
 
 
 class PDFKitPerjanjianJasaPemasaranPropertiPDFGenerator(
     PerjanjianJasaPemasaranPropertiPDFGenerator
 ):
+    engine = "pdfkit"
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+
     def generate(self, data):
         template_data = data.model_dump()
         owner_signature = data.owner_signature_file
         if owner_signature:
-            owner_signature = base64.b64encode(owner_signature).decode("utf-8")
-            template_data["owner_signature"] = (
-                f"data:image/png;base64,{owner_signature}"
-            )
+            template_data["owner_signature"] = get_image_data_uri(owner_signature)
         agent_signature = data.agent_signature_file
         if agent_signature:
-            agent_signature = base64.b64encode(agent_signature).decode("utf-8")
-            template_data["agent_signature"] = (
-                f"data:image/png;base64,{agent_signature}"
-            )
-        with open("static/images/logo.png", "rb") as img_file:
-            logo_b64 = base64.b64encode(img_file.read()).decode("utf-8")
-            template_data["logo_image"] = f"data:image/png;base64,{logo_b64}"
-
-        rendered = template.render(template_data)
-        options = {
-            "page-size": "Legal",
-            "margin-top": "0mm",  # Minimize margins to maximize content area
-            "margin-right": "0mm",
-            "margin-bottom": "0mm",
-            "margin-left": "0mm",
-            "encoding": "UTF-8",
-        }
-
-        return pdfkit.from_string(rendered, options=options)
+            template_data["agent_signature"] = get_image_data_uri(agent_signature)
+
+        chunks = get_template().generate(template_data)
+        return memoryview(render_pdf(chunks, self.timeout))
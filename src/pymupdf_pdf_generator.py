@@ -7,6 +7,8 @@ from src.pdf_generator import PerjanjianJasaPemasaranPropertiPDFGenerator
 class PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator(
     PerjanjianJasaPemasaranPropertiPDFGenerator
 ):
+    engine = "pymupdf"
+
     def __init__(self):
         self.font_size = 10
         self.title_font_size = 14
@@ -17,8 +19,17 @@ class PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator(
 
     def generate(self, data: DataPerjanjianPemasaranProperti) -> bytes:
         doc = pymupdf.open()
-        page = doc.new_page()
-
+        try:
+            self._draw_agreement(doc.new_page(), data)
+            # Save the PDF, and hand over a view of the stream's buffer, not a copy
+            pdf_stream = io.BytesIO()
+            doc.save(pdf_stream)
+        finally:
+            # Also on failures, e.g. an unreadable signature, or MuPDF leaks it
+            doc.close()
+        return pdf_stream.getbuffer()
+
+    def _draw_agreement(self, page, data: DataPerjanjianPemasaranProperti):
         self._draw_header(page, "PERJANJIAN JASA PEMASARAN PROPERTI")
         self.current_y += 20
 
@@ -159,7 +170,7 @@ class PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator(
             x=self.margin + 300,
             font_size=self.header_font_size,
         )
-        self._draw_image(page, data.signature_file, x=self.margin, width=180)
+        self._draw_image(page, data.owner_signature_file, x=self.margin, width=180)
         self._draw_text(page, data.owner_name, x=self.margin)
         self.current_y += 30
         self._draw_text(
@@ -169,14 +180,6 @@ class PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator(
             font_size=self.header_font_size,
         )
 
-        # Save the PDF
-        pdf_stream = io.BytesIO()
-        doc.save(pdf_stream)
-        doc.close()
-        pdf_stream.seek(0)
-
-        return pdf_stream.read()
-
     def _draw_header(self, page, text):
         page.insert_text(
             point=(self.margin, self.current_y),
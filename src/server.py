@@ -0,0 +1,107 @@
+import gc
+import os
+import signal
+import socket
+from typing import Dict
+import uvicorn
+from uvicorn.importer import import_from_string
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.readiness import readiness
+from src.utils.resources import get_available_memory, get_cpu_count
+from src.utils.warmup import warm_up
+
+
+def get_worker_count() -> int:
+    if config.WEB_CONCURRENCY:
+        return config.WEB_CONCURRENCY
+    workers = get_cpu_count()
+    memory = get_available_memory()
+    if memory is not None:
+        workers = min(workers, memory // (config.WORKER_MEMORY_MB * 1024 * 1024))
+    return max(workers, 1)
+
+
+class PreforkServer:
+    """Pre-fork server entrypoint, run with `python -m src.server`.
+
+    The parent process imports the app and warms up the expensive state, then
+    forks the workers so they share it copy-on-write. Dead workers are respawned.
+    """
+
+    def __init__(self, app: str, host: str, port: int, workers: int):
+        self.app_path = app
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.workers: Dict[int, int] = {}
+        self.stopping = False
+
+    def run(self):
+        logger.info("Starting pre-fork server with %s workers", self.worker_count)
+        self.app = import_from_string(self.app_path)
+        warm_up()
+        readiness.configure(self.worker_count)
+
+        self.socket = socket.create_server((self.host, self.port), backlog=2048)
+        self.socket.set_inheritable(True)
+
+        # Keep the warm objects out of the collector, so it does not touch
+        # (and un-share) their pages in the workers
+        gc.freeze()
+        for worker_index in range(self.worker_count):
+            self._spawn(worker_index)
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self._supervise()
+
+    def _spawn(self, worker_index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            readiness.worker_index = worker_index
+            server = uvicorn.Server(
+                uvicorn.Config(self.app, log_config=None, lifespan="on")
+            )
+            server.run(sockets=[self.socket])
+            os._exit(0)
+        logger.info("Started worker %s with pid %s", worker_index, pid)
+        self.workers[pid] = worker_index
+
+    def _supervise(self):
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            worker_index = self.workers.pop(pid, None)
+            if worker_index is None:
+                continue
+            readiness.mark_not_ready(worker_index)
+            if not self.stopping:
+                logger.warning(
+                    "Worker %s (pid %s) exited with status %s, respawning",
+                    worker_index,
+                    pid,
+                    status,
+                )
+                self._spawn(worker_index)
+        self.socket.close()
+        logger.info("Pre-fork server stopped")
+
+    def _stop(self, signum, frame):
+        logger.info("Received signal %s, stopping workers", signum)
+        self.stopping = True
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+if __name__ == "__main__":
+    PreforkServer("main:app", "0.0.0.0", config.PORT, get_worker_count()).run()
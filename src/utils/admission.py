@@ -0,0 +1,109 @@
+import asyncio
+import collections
+from contextlib import asynccontextmanager
+from src.utils.config import config
+from src.utils.exceptions import ServiceOverloadedError
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.utils.resources import get_available_memory
+
+
+class AdmissionController:
+    """Bounds the number of requests of one kind running at once in this worker.
+
+    Up to `max_concurrency` requests run at a time, further ones wait in a
+    FIFO queue of at most `max_queue` entries for up to `queue_timeout`
+    seconds. The limit is lowered further when the memory left would not fit
+    another `request_memory_mb`. Anything past these limits is rejected
+    immediately with ServiceOverloadedError, rather than slowing every
+    request down until the worker runs out of memory.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        request_memory_mb: int,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_memory = request_memory_mb * 1024 * 1024
+        self.in_flight = 0
+        self._waiters = collections.deque()
+
+    def _limit(self) -> int:
+        memory = get_available_memory()
+        if memory is None or not self.request_memory:
+            return self.max_concurrency
+        # Always let one request through, or an idle worker could never recover
+        fits = self.in_flight + memory // self.request_memory
+        return max(1, min(self.max_concurrency, fits))
+
+    def _update_gauges(self):
+        metrics.set_gauge(f"{self.name}_in_flight", self.in_flight)
+        metrics.set_gauge(f"{self.name}_queue_depth", len(self._waiters))
+
+    def _shed(self, reason: str):
+        metrics.increment(f"{self.name}_shed")
+        logger.warning("Shedding %s request: %s", self.name, reason)
+        raise ServiceOverloadedError(reason)
+
+    async def acquire(self):
+        if not self._waiters and self.in_flight < self._limit():
+            self.in_flight += 1
+            metrics.increment(f"{self.name}_admitted")
+            self._update_gauges()
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed("queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        metrics.increment(f"{self.name}_queued")
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._shed("timed out in the queue")
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            self._update_gauges()
+        metrics.increment(f"{self.name}_admitted")
+
+    def release(self):
+        self.in_flight -= 1
+        # Hand the freed slots over to the oldest waiters
+        while self._waiters and self.in_flight < self._limit():
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+        self._update_gauges()
+
+    @asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# Singleton instance of AdmissionController, guarding /submit/
+submit_admission = AdmissionController(
+    "submit_admission",
+    config.SUBMIT_MAX_CONCURRENCY,
+    config.SUBMIT_MAX_QUEUE,
+    config.SUBMIT_QUEUE_TIMEOUT,
+    config.SUBMIT_REQUEST_MEMORY_MB,
+)
@@ -0,0 +1,455 @@
+import argparse
+import asyncio
+import fcntl
+import importlib.util
+import io
+import json
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# pyarrow is optional, and only imported when a Parquet export is asked for
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Columns taken from the custom properties set by get_form_properties
+PROPERTY_COLUMNS = [
+    "response_id",
+    "filename",
+    "agent_name",
+    "owner_name",
+    "owner_email",
+    "cp_name",
+    "cp_email",
+    "transaction_type",
+    "property_type",
+    "property_address",
+    "created_at",
+]
+COLUMNS = ["file_id", *PROPERTY_COLUMNS, "folder_id", "web_view_link", "indexed_at"]
+
+# Filters matching a column exactly, and the ones matching part of it
+EXACT_FILTERS = {"agent_name", "transaction_type", "property_type", "response_id"}
+CONTAINS_FILTERS = {"owner_name", "cp_name", "property_address"}
+SORT_COLUMNS = {"created_at", "agent_name", "owner_name", "property_type"}
+
+DRIVE_FILE_FIELDS = "id, parents, webViewLink, createdTime, properties"
+DRIVE_CHANGE_FIELDS = f"fileId, removed, file(trashed, {DRIVE_FILE_FIELDS})"
+
+
+class AgreementIndex:
+    """Local SQLite index of the metadata of every generated agreement.
+
+    Filled from the storage backend by `backfill`, and kept current by the
+    submit endpoint and the Drive changes feed, so reporting queries never hit
+    Drive. The database is created on first use.
+    """
+
+    _initialized = set()
+    _init_lock = threading.Lock()
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or config.AGREEMENT_INDEX_PATH)
+
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.path not in AgreementIndex._initialized:
+            with AgreementIndex._init_lock:
+                if self.path not in AgreementIndex._initialized:
+                    self._init_index()
+                    AgreementIndex._initialized.add(self.path)
+        return self._open()
+
+    @contextmanager
+    def sync_lock(self):
+        """Hold the Drive sync exclusively across workers, yielding False if busy."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{self.path}.sync.lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _init_index(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._open()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                f"""
+                CREATE TABLE IF NOT EXISTS agreements (
+                    file_id TEXT PRIMARY KEY,
+                    {", ".join(f"{column} TEXT" for column in COLUMNS[1:])}
+                );
+                CREATE INDEX IF NOT EXISTS agreements_agent_name
+                    ON agreements (agent_name, created_at);
+                CREATE INDEX IF NOT EXISTS agreements_owner_name
+                    ON agreements (owner_name);
+                CREATE INDEX IF NOT EXISTS agreements_type
+                    ON agreements (transaction_type, property_type, created_at);
+                CREATE INDEX IF NOT EXISTS agreements_created_at
+                    ON agreements (created_at);
+                CREATE INDEX IF NOT EXISTS agreements_response_id
+                    ON agreements (response_id);
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                """
+            )
+            # Rows indexed before created_at was normalized, e.g. with a Z suffix
+            connection.create_function("normalize_timestamp", 1, normalize_timestamp)
+            connection.execute(
+                "UPDATE agreements SET created_at = normalize_timestamp(created_at)"
+                " WHERE created_at NOT LIKE '____-__-__T__:__:__.___+00:00'"
+            )
+
+    def upsert_many(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Insert or update agreements, given their file id and properties."""
+        indexed_at = datetime.now(timezone.utc).isoformat()
+        values = []
+        for row in rows:
+            row = {**row, "created_at": normalize_timestamp(row.get("created_at"))}
+            values.append(
+                tuple(
+                    indexed_at if column == "indexed_at" else row.get(column)
+                    for column in COLUMNS
+                )
+            )
+        with closing(self._connect()) as connection, connection:
+            placeholders = ", ".join("?" * len(COLUMNS))
+            connection.executemany(
+                f"INSERT OR REPLACE INTO agreements VALUES ({placeholders})", values
+            )
+        return len(values)
+
+    def upsert(
+        self,
+        file_id: str,
+        properties: Dict[str, str],
+        folder_id: Optional[str] = None,
+        web_view_link: Optional[str] = None,
+    ):
+        self.upsert_many(
+            [
+                {
+                    **properties,
+                    "file_id": file_id,
+                    "folder_id": folder_id,
+                    "web_view_link": web_view_link,
+                }
+            ]
+        )
+
+    def delete_many(self, file_ids: Iterable[str]) -> int:
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.executemany(
+                "DELETE FROM agreements WHERE file_id = ?",
+                [(file_id,) for file_id in file_ids],
+            )
+        return cursor.rowcount
+
+    def get_by_response_id(self, response_id: str) -> Optional[Dict[str, Any]]:
+        """The first agreement indexed for a response_id, if any."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT * FROM agreements WHERE response_id = ?"
+                " ORDER BY created_at LIMIT 1",
+                (response_id,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_sync_token(self) -> Optional[str]:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT value FROM sync_state WHERE key = 'page_token'"
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_sync_token(self, page_token: str):
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES ('page_token', ?)",
+                (page_token,),
+            )
+
+    def query(
+        self,
+        filters: Dict[str, str],
+        created_from: Optional[str] = None,
+        created_to: Optional[str] = None,
+        sort: str = "created_at",
+        descending: bool = True,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Return a page of matching agreements, and the total number of matches."""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort}")
+        conditions = []
+        params = []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name in EXACT_FILTERS:
+                conditions.append(f"{name} = ?")
+                params.append(value)
+            elif name in CONTAINS_FILTERS:
+                conditions.append(f"{name} LIKE ? ESCAPE '\\'")
+                params.append(f"%{escape_like(value)}%")
+            else:
+                raise ValueError(f"Cannot filter by {name}")
+        if created_from:
+            conditions.append("created_at >= ?")
+            params.append(normalize_timestamp(created_from))
+        if created_to:
+            conditions.append("created_at < ?")
+            params.append(normalize_timestamp(created_to))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = f"ORDER BY {sort} {'DESC' if descending else 'ASC'}, file_id"
+
+        with closing(self._connect()) as connection:
+            total = connection.execute(
+                f"SELECT COUNT(*) FROM agreements {where}", params
+            ).fetchone()[0]
+            rows = connection.execute(
+                f"SELECT * FROM agreements {where} {order} LIMIT ? OFFSET ?",
+                [*params, limit, offset],
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def export_columns(self) -> Dict[str, List[Any]]:
+        """Every agreement, as one list of values per column."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM agreements ORDER BY created_at"
+            ).fetchall()
+        return {column: [row[i] for row in rows] for i, column in enumerate(COLUMNS)}
+
+    def export_parquet(self) -> bytes:
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.table(self.export_columns())
+        buffer = io.BytesIO()
+        pyarrow.parquet.write_table(table, buffer, compression="zstd")
+        return buffer.getvalue()
+
+
+def normalize_timestamp(value: Optional[str]) -> Optional[str]:
+    """A timestamp as UTC ISO 8601 with milliseconds, so they compare as strings.
+
+    Tally sends an offset and Drive a Z suffix. Naive timestamps are taken
+    as UTC, and anything unparseable is kept as is.
+    """
+    if not value:
+        return value
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc).isoformat(timespec="milliseconds")
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def get_drive_partitions(
+    since: datetime, until: datetime, partitions: int
+) -> List[Tuple[str, str]]:
+    """Split a creation time range into windows that can be listed in parallel."""
+    step = (until - since) / partitions
+    bounds = [since + step * i for i in range(partitions)] + [until]
+    return [
+        (start.strftime("%Y-%m-%dT%H:%M:%S"), end.strftime("%Y-%m-%dT%H:%M:%S"))
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def get_drive_row(file: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    properties = file.get("properties") or {}
+    # Supplementary documents are uploaded without the form properties
+    if not properties.get("response_id"):
+        return None
+    return {
+        **properties,
+        "created_at": properties.get("created_at") or file.get("createdTime"),
+        "file_id": file["id"],
+        "folder_id": (file.get("parents") or [None])[0],
+        "web_view_link": file.get("webViewLink"),
+    }
+
+
+async def backfill_from_drive(
+    index: AgreementIndex, since: datetime, partitions: int
+) -> int:
+    """Index every agreement on Drive, listing creation time windows in parallel."""
+    from src.utils.async_google_drive import AsyncGoogleDriveClient
+    from src.utils.scheduler import Priority
+
+    client = AsyncGoogleDriveClient(priority=Priority.BACKFILL)
+    base_query = "trashed = false and mimeType = 'application/pdf'"
+    # Sharded agreements are in subfolders, which a parents query cannot reach
+    if config.HEPI_PDF_RESULT_DRIVE_ID and not config.HEPI_FF_DRIVE_SHARDING:
+        base_query += f" and '{config.HEPI_PDF_RESULT_DRIVE_ID}' in parents"
+
+    async def list_partition(start: str, end: str) -> int:
+        query = f"{base_query} and createdTime >= '{start}' and createdTime < '{end}'"
+        indexed = 0
+        async for files in client.list_files(query, DRIVE_FILE_FIELDS):
+            rows = [row for row in map(get_drive_row, files) if row]
+            indexed += await asyncio.to_thread(index.upsert_many, rows)
+        logger.info("Indexed %s agreements created in [%s, %s)", indexed, start, end)
+        return indexed
+
+    now = datetime.now(timezone.utc) + timedelta(minutes=1)
+    try:
+        counts = await asyncio.gather(
+            *[
+                list_partition(start, end)
+                for start, end in get_drive_partitions(since, now, partitions)
+            ]
+        )
+    finally:
+        await AsyncGoogleDriveClient.aclose()
+    return sum(counts)
+
+
+def apply_drive_changes(index: AgreementIndex, changes: List[Dict[str, Any]]):
+    """Index the new and changed agreements, and drop the trashed or removed ones."""
+    rows = []
+    deleted = []
+    for change in changes:
+        file = change.get("file") or {}
+        row = None
+        if not change.get("removed") and not file.get("trashed"):
+            row = get_drive_row(file)
+        if row:
+            rows.append(row)
+        else:
+            deleted.append(change["fileId"])
+    index.upsert_many(rows)
+    index.delete_many(deleted)
+    return len(rows), len(deleted)
+
+
+async def sync_from_drive(index: AgreementIndex, client=None) -> int:
+    """Apply the Drive changes since the last sync, returning how many there were.
+
+    The first sync only records where the feed starts, what came before is
+    left to `backfill`.
+    """
+    from src.utils.async_google_drive import AsyncGoogleDriveClient
+    from src.utils.scheduler import Priority
+
+    client = client or AsyncGoogleDriveClient(priority=Priority.BACKFILL)
+    page_token = await asyncio.to_thread(index.get_sync_token)
+    if page_token is None:
+        page_token = await client.get_changes_start_token()
+        await asyncio.to_thread(index.set_sync_token, page_token)
+        logger.info("Started following the Drive changes feed at %s", page_token)
+        return 0
+
+    count = 0
+    async for changes, page_token in client.list_changes(
+        page_token, DRIVE_CHANGE_FIELDS
+    ):
+        upserted, deleted = await asyncio.to_thread(
+            apply_drive_changes, index, changes
+        )
+        # Saved after every page, so an interrupted sync resumes where it was
+        await asyncio.to_thread(index.set_sync_token, page_token)
+        count += len(changes)
+        metrics.increment("agreement_index_synced_changes", len(changes))
+        logger.debug("Synced %s upserts and %s deletes", upserted, deleted)
+    if count:
+        logger.info("Synced %s Drive changes into the agreement index", count)
+    return count
+
+
+def backfill_from_local_storage(index: AgreementIndex) -> int:
+    from src.utils.storage import LocalStorageClient
+
+    storage = LocalStorageClient()
+    with closing(storage._connect()) as connection:
+        files = connection.execute(
+            "SELECT file_id, folder_id, properties FROM files"
+            " WHERE response_id IS NOT NULL"
+        ).fetchall()
+    rows = [
+        {
+            **json.loads(file["properties"] or "{}"),
+            "file_id": file["file_id"],
+            "folder_id": file["folder_id"],
+        }
+        for file in files
+    ]
+    return index.upsert_many(rows)
+
+
+async def sync_once(index: AgreementIndex) -> int:
+    from src.utils.async_google_drive import AsyncGoogleDriveClient
+
+    try:
+        return await sync_from_drive(index)
+    finally:
+        await AsyncGoogleDriveClient.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local agreement index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser(
+        "backfill", help="Index every agreement of the storage backend"
+    )
+    backfill.add_argument("--since", default="2020-01-01")
+    backfill.add_argument("--partitions", type=int, default=8)
+    export = commands.add_parser("export", help="Export the index for bulk analysis")
+    export.add_argument("--format", choices=["json", "parquet"], default="json")
+    export.add_argument("--output", required=True)
+    commands.add_parser("sync", help="Apply the Drive changes since the last sync")
+    args = parser.parse_args()
+
+    index = AgreementIndex()
+    if args.command == "backfill":
+        if config.HEPI_FF_UPLOAD_TO_DRIVE:
+            since = datetime.fromisoformat(args.since).replace(tzinfo=timezone.utc)
+            count = asyncio.run(backfill_from_drive(index, since, args.partitions))
+        else:
+            count = backfill_from_local_storage(index)
+        print(f"Indexed {count} agreements")
+    elif args.command == "sync":
+        with index.sync_lock() as acquired:
+            if not acquired:
+                print("Another process is syncing the index")
+                return
+            count = asyncio.run(sync_once(index))
+        print(f"Applied {count} changes")
+    elif args.format == "parquet":
+        Path(args.output).write_bytes(index.export_parquet())
+    else:
+        Path(args.output).write_text(json.dumps(index.export_columns()))
+
+
+# Singleton instance of AgreementIndex
+agreement_index = AgreementIndex()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,585 @@
+import asyncio
+import io
+import json
+import uuid
+import httpx
+from google.auth import default
+from google.auth.transport.requests import Request as AuthRequest
+from src.utils.agreement_index import agreement_index
+from src.utils.async_storage import AsyncStorageClient
+from src.utils.buffers import Buffer, BufferStream, as_buffer
+from src.utils.config import config
+from src.utils.content_index import content_index, get_content_key, get_md5
+from src.utils.exceptions import FileNotFoundError
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.utils.retry import (
+    backoff_delay,
+    get_error_reason,
+    is_rate_limited_status,
+    is_retryable_status,
+)
+from src.utils.scheduler import Priority, drive_scheduler
+from src.utils.storage import FileRole
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+try:
+    import h2  # noqa: F401 (only probed, httpx imports it for HTTP/2)
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DRIVE_API_URL = "https://www.googleapis.com/drive/v3"
+DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+
+def escape_query_value(value: str) -> str:
+    """Escape a string for a quoted value of a files.list query."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+class AsyncGoogleDriveClient(AsyncStorageClient):
+    """Google Drive client talking to the REST API over a shared connection pool.
+
+    The pool and the credentials are class-level, so every request handler
+    reuses the same keep-alive (or HTTP/2) connections and access token.
+    """
+
+    _http_client: Optional[httpx.AsyncClient] = None
+    _credentials = None
+    _refresh_lock: Optional[asyncio.Lock] = None
+
+    def __init__(self, scopes=None, priority: Priority = Priority.SUBMISSION):
+        if scopes is None:
+            scopes = ["https://www.googleapis.com/auth/drive"]
+        self.scopes = scopes
+        self.priority = priority
+        if AsyncGoogleDriveClient._credentials is None:
+            AsyncGoogleDriveClient._credentials = self._authenticate()
+        self.credentials = AsyncGoogleDriveClient._credentials
+
+    def _authenticate(self):
+        """Load the service account credentials."""
+        creds, _ = default(scopes=self.scopes)
+        if creds is None:
+            raise ValueError("No valid credentials found")
+        return creds
+
+    @property
+    def read_priority(self) -> Priority:
+        """Reads never outrank live submission writes."""
+        return max(self.priority, Priority.LOOKUP)
+
+    @classmethod
+    def get_http_client(cls) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it on first use."""
+        if cls._http_client is None or cls._http_client.is_closed:
+            cls._http_client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=config.DRIVE_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.DRIVE_HTTP_MAX_KEEPALIVE,
+                ),
+                timeout=httpx.Timeout(config.DRIVE_HTTP_TIMEOUT),
+            )
+        return cls._http_client
+
+    @classmethod
+    def warm_up(cls):
+        """Load the credentials, fetch a token and create the HTTP client.
+
+        Done at startup, so the first upload does not pay for them.
+        """
+        client = cls()
+        if not client.credentials.valid:
+            client.credentials.refresh(AuthRequest())
+        cls.get_http_client()
+
+    @classmethod
+    async def aclose(cls):
+        """Close the shared HTTP client."""
+        if cls._http_client is not None:
+            await cls._http_client.aclose()
+            cls._http_client = None
+
+    async def _get_auth_headers(self) -> Dict[str, str]:
+        if AsyncGoogleDriveClient._refresh_lock is None:
+            AsyncGoogleDriveClient._refresh_lock = asyncio.Lock()
+        async with AsyncGoogleDriveClient._refresh_lock:
+            if not self.credentials.valid:
+                logger.debug("Refreshing Google Drive access token")
+                await asyncio.to_thread(self.credentials.refresh, AuthRequest())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        headers = await self._get_auth_headers()
+        headers.update(kwargs.pop("headers", {}))
+        return await self.get_http_client().request(
+            method, url, headers=headers, **kwargs
+        )
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        priority: Priority,
+        coalesce: bool = False,
+        **kwargs,
+    ) -> httpx.Response:
+        """Send a request through the shared Drive scheduler.
+
+        Identical reads in flight are coalesced when `coalesce` is set.
+        """
+        key = None
+        if coalesce:
+            key = (method, url, tuple(sorted(kwargs.get("params", {}).items())))
+        return await drive_scheduler.run_async(
+            lambda: self._request_with_retry(method, url, priority, **kwargs), key
+        )
+
+    async def _request_with_retry(
+        self, method: str, url: str, priority: Priority, **kwargs
+    ) -> httpx.Response:
+        """Send a request, retrying transient errors with exponential backoff."""
+        attempt = 0
+        while True:
+            await drive_scheduler.acquire_async(priority)
+            response = None
+            try:
+                response = await self._send(method, url, **kwargs)
+                if not _is_retryable_response(response):
+                    response.raise_for_status()
+                    drive_scheduler.reset_throttle()
+                    return response
+                error = httpx.HTTPStatusError(
+                    f"Retryable status {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as e:
+                error = e
+            if attempt >= config.DRIVE_MAX_RETRIES:
+                raise error
+            attempt += 1
+            metrics.increment("drive_request_retries")
+            logger.warning(
+                "Drive request %s %s failed (%s), retry %s", method, url, error, attempt
+            )
+            await _wait_before_retry(response, attempt)
+
+    async def upload(
+        self,
+        file_stream: Buffer,
+        filename: str,
+        file_mimetype: str = "application/pdf",
+        folder_id=None,
+        custom_property=None,
+    ) -> str:
+        """Upload a file together with its custom properties.
+
+        Files larger than one chunk go through a resumable session, smaller
+        ones are sent as a single multipart request. With deduplication on,
+        a file already uploaded with the same content and metadata is reused.
+        """
+        logger.info("Uploading file: %s", filename)
+        logger.debug("File stream size: %s bytes", len(file_stream))
+        file_metadata = {"name": filename}
+        if folder_id:
+            file_metadata["parents"] = [folder_id]
+        if custom_property:
+            file_metadata["properties"] = custom_property
+
+        if not config.HEPI_FF_UPLOAD_DEDUP:
+            return await self._upload(file_stream, file_mimetype, file_metadata)
+
+        md5 = await asyncio.to_thread(get_md5, file_stream)
+        key = get_content_key(md5, len(file_stream), file_metadata)
+        file_id = await asyncio.to_thread(content_index.get, key)
+        if file_id is None:
+            file_id = await self._find_uploaded(md5, len(file_stream), file_metadata)
+        if file_id is not None:
+            logger.info("File already uploaded, reusing %s: %s", file_id, filename)
+            metrics.increment("upload_dedup_hits")
+            metrics.increment("upload_dedup_bytes_saved", len(file_stream))
+        else:
+            file_id = await self._upload(file_stream, file_mimetype, file_metadata)
+        await asyncio.to_thread(content_index.put, key, file_id)
+        return file_id
+
+    async def _find_uploaded(
+        self, md5: str, size: int, file_metadata: Dict
+    ) -> Optional[str]:
+        """Look for a file on Drive with the same content and metadata."""
+        query = f"name = '{escape_query_value(file_metadata['name'])}'"
+        query += " and trashed = false"
+        for parent_id in file_metadata.get("parents", []):
+            query += f" and '{parent_id}' in parents"
+        response = await self._request(
+            "GET",
+            f"{DRIVE_API_URL}/files",
+            self.read_priority,
+            params={"q": query, "fields": "files(id, md5Checksum, size, properties)"},
+        )
+        # Drive does not keep properties set to null
+        properties = {
+            key: value
+            for key, value in file_metadata.get("properties", {}).items()
+            if value is not None
+        }
+        for file in response.json().get("files", []):
+            if (
+                file.get("md5Checksum") == md5
+                and int(file.get("size", -1)) == size
+                and (file.get("properties") or {}) == properties
+            ):
+                return file["id"]
+        return None
+
+    async def _upload(
+        self, file_stream: Buffer, file_mimetype: str, file_metadata: Dict
+    ) -> str:
+        if len(file_stream) > config.DRIVE_UPLOAD_CHUNK_SIZE:
+            return await self._upload_resumable(
+                file_stream, file_mimetype, file_metadata
+            )
+        return await self._upload_multipart(file_stream, file_mimetype, file_metadata)
+
+    async def _upload_multipart(
+        self, file_stream: Buffer, file_mimetype: str, file_metadata: Dict
+    ) -> str:
+        boundary = uuid.uuid4().hex
+        # Only the small envelope is built, the document is streamed from its
+        # buffer rather than joined with it into a copy
+        body = BufferStream(
+            f"--{boundary}\r\n".encode(),
+            b"Content-Type: application/json; charset=UTF-8\r\n\r\n",
+            json.dumps(file_metadata).encode("utf-8"),
+            f"\r\n--{boundary}\r\nContent-Type: {file_mimetype}\r\n\r\n".encode(),
+            file_stream,
+            f"\r\n--{boundary}--".encode(),
+        )
+        response = await self._request(
+            "POST",
+            f"{DRIVE_UPLOAD_URL}/files",
+            self.priority,
+            params={"uploadType": "multipart", "fields": "id"},
+            headers={
+                "Content-Type": f"multipart/related; boundary={boundary}",
+                "Content-Length": str(len(body)),
+            },
+            content=body,
+        )
+        return response.json().get("id")
+
+    async def _upload_resumable(
+        self, file_stream: Buffer, file_mimetype: str, file_metadata: Dict
+    ) -> str:
+        # Slicing the view is free, and each chunk is streamed from the view
+        file_stream = as_buffer(file_stream)
+        total = len(file_stream)
+        response = await self._request(
+            "POST",
+            f"{DRIVE_UPLOAD_URL}/files",
+            self.priority,
+            params={"uploadType": "resumable", "fields": "id"},
+            headers={
+                "X-Upload-Content-Type": file_mimetype,
+                "X-Upload-Content-Length": str(total),
+            },
+            json=file_metadata,
+        )
+        session_url = response.headers["Location"]
+
+        offset = 0
+        attempt = 0
+        while True:
+            end = min(offset + config.DRIVE_UPLOAD_CHUNK_SIZE, total)
+            await drive_scheduler.acquire_async(self.priority)
+            response = None
+            try:
+                response = await self._send(
+                    "PUT",
+                    session_url,
+                    headers={
+                        "Content-Range": f"bytes {offset}-{end - 1}/{total}",
+                        "Content-Length": str(end - offset),
+                    },
+                    content=BufferStream(file_stream[offset:end]),
+                )
+                if response.status_code in (200, 201):
+                    return response.json().get("id")
+                if response.status_code == 308:
+                    offset = _get_committed_offset(response)
+                    attempt = 0
+                    drive_scheduler.reset_throttle()
+                    continue
+                if not _is_retryable_response(response):
+                    response.raise_for_status()
+                error = httpx.HTTPStatusError(
+                    f"Retryable status {response.status_code} at offset {offset}",
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as e:
+                error = e
+            if attempt >= config.DRIVE_MAX_RETRIES:
+                raise error
+            attempt += 1
+            logger.warning(
+                "Upload chunk at offset %s failed (%s), retry %s",
+                offset,
+                error,
+                attempt,
+            )
+            await _wait_before_retry(response, attempt)
+
+            # Resume from whatever Drive has committed so far
+            committed = await self._query_committed_offset(session_url, total)
+            if committed is None:
+                continue
+            if committed >= total:
+                return await self._query_uploaded_file_id(session_url, total)
+            metrics.increment("drive_upload_retries")
+            metrics.increment("drive_upload_bytes_resent", end - committed)
+            offset = committed
+
+    async def _query_committed_offset(
+        self, session_url: str, total: int
+    ) -> Optional[int]:
+        """Ask Drive how many bytes of a resumable session it has stored."""
+        await drive_scheduler.acquire_async(self.priority)
+        try:
+            response = await self._send(
+                "PUT", session_url, headers={"Content-Range": f"bytes */{total}"}
+            )
+        except httpx.TransportError:
+            return None
+        if response.status_code in (200, 201):
+            return total
+        if response.status_code == 308:
+            return _get_committed_offset(response)
+        return None
+
+    async def _query_uploaded_file_id(self, session_url: str, total: int) -> str:
+        response = await self._request(
+            "PUT",
+            session_url,
+            self.priority,
+            headers={"Content-Range": f"bytes */{total}"},
+        )
+        return response.json().get("id")
+
+    async def share(self, file_id, email, role=FileRole.READER):
+        """Share a file with a specific email."""
+        logger.info("Sharing file ID: %s with email: %s", file_id, email)
+        if not email:
+            raise ValueError("Email address is required")
+
+        permission = {
+            "type": "user",
+            "role": role.value,
+            "emailAddress": email,
+        }
+        await self._request(
+            "POST",
+            f"{DRIVE_API_URL}/files/{file_id}/permissions",
+            self.priority,
+            params={"fields": "id"},
+            json=permission,
+        )
+
+    async def _get_file_by_response_id(self, response_id: str):
+        """Get a file's id and link by its response_id.
+
+        With the Drive changes feed followed, the agreement index knows the
+        files, and Drive is only searched for those it has not seen yet.
+        """
+        if config.HEPI_FF_DRIVE_SYNC:
+            file_info = await self._get_indexed_file(response_id)
+            if file_info:
+                return file_info
+        logger.info("Searching for file with response_id: %s", response_id)
+        value = escape_query_value(response_id)
+        query = f"properties has {{ key='response_id' and value='{value}' }}"
+        response = await self._request(
+            "GET",
+            f"{DRIVE_API_URL}/files",
+            self.read_priority,
+            coalesce=True,
+            params={"q": query, "fields": "files(id, name, webViewLink)"},
+        )
+        files = response.json().get("files", [])
+        logger.debug("Found %s files for response_id: %s", len(files), response_id)
+        if files:
+            return files[0]  # Return the first match
+        logger.warning("File not found for response_id: %s", response_id)
+        return None
+
+    async def _get_indexed_file(self, response_id: str) -> Optional[Dict]:
+        try:
+            row = await asyncio.to_thread(
+                agreement_index.get_by_response_id, response_id
+            )
+        except Exception as e:
+            logger.warning("Failed to read the agreement index: %s", e)
+            return None
+        # Agreements indexed by submit get their link once the feed reports them
+        if not row or not row["web_view_link"]:
+            metrics.increment("agreement_index_lookup_misses")
+            return None
+        metrics.increment("agreement_index_lookup_hits")
+        return {
+            "id": row["file_id"],
+            "name": row["filename"],
+            "webViewLink": row["web_view_link"],
+        }
+
+    async def list_files(
+        self, query: str, fields: str, page_size: int = 1000
+    ) -> AsyncIterator[List[Dict]]:
+        """Yield the files matching a query, one page at a time."""
+        params = {
+            "q": query,
+            "fields": f"nextPageToken, files({fields})",
+            "pageSize": page_size,
+        }
+        while True:
+            response = await self._request(
+                "GET", f"{DRIVE_API_URL}/files", self.read_priority, params=params
+            )
+            page = response.json()
+            yield page.get("files", [])
+            if not page.get("nextPageToken"):
+                return
+            params = {**params, "pageToken": page["nextPageToken"]}
+
+    async def get_changes_start_token(self) -> str:
+        """The page token the changes feed starts from, as of now."""
+        response = await self._request(
+            "GET", f"{DRIVE_API_URL}/changes/startPageToken", self.read_priority
+        )
+        return response.json()["startPageToken"]
+
+    async def list_changes(
+        self, page_token: str, fields: str, page_size: int = 1000
+    ) -> AsyncIterator[Tuple[List[Dict], str]]:
+        """Yield the changes since a page token, one page at a time.
+
+        Each page comes with the token to resume after it, the last one with
+        the token to poll for the next changes.
+        """
+        params = {
+            "fields": f"nextPageToken, newStartPageToken, changes({fields})",
+            "pageSize": page_size,
+            "spaces": "drive",
+        }
+        while True:
+            response = await self._request(
+                "GET",
+                f"{DRIVE_API_URL}/changes",
+                self.read_priority,
+                params={**params, "pageToken": page_token},
+            )
+            page = response.json()
+            page_token = page.get("nextPageToken") or page["newStartPageToken"]
+            yield page.get("changes", []), page_token
+            if not page.get("nextPageToken"):
+                return
+
+    async def find_folder(self, name: str, parent_id: str) -> Optional[str]:
+        """Return the id of the oldest folder of that name in a parent, if any."""
+        query = (
+            f"name = '{escape_query_value(name)}' and '{parent_id}' in parents"
+            f" and mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+        )
+        response = await self._request(
+            "GET",
+            f"{DRIVE_API_URL}/files",
+            self.read_priority,
+            coalesce=True,
+            params={"q": query, "fields": "files(id)", "orderBy": "createdTime"},
+        )
+        files = response.json().get("files", [])
+        return files[0]["id"] if files else None
+
+    async def create_folder(self, name: str, parent_id: str) -> str:
+        logger.info("Creating folder %s in %s", name, parent_id)
+        response = await self._request(
+            "POST",
+            f"{DRIVE_API_URL}/files",
+            self.priority,
+            params={"fields": "id"},
+            json={"name": name, "mimeType": FOLDER_MIME_TYPE, "parents": [parent_id]},
+        )
+        return response.json().get("id")
+
+    async def move_file(self, file_id: str, folder_id: str, from_folder_id: str):
+        """Move a file from one folder into another."""
+        await self._request(
+            "PATCH",
+            f"{DRIVE_API_URL}/files/{file_id}",
+            self.priority,
+            params={
+                "addParents": folder_id,
+                "removeParents": from_folder_id,
+                "fields": "id",
+            },
+            json={},
+        )
+
+    async def get_file_url(self, response_id):
+        """Generate a sharable link for the file."""
+        logger.info("Generating file URL for response_id: %s", response_id)
+        file_info = await self._get_file_by_response_id(response_id)
+        if not file_info:
+            return ""
+        return file_info.get("webViewLink")
+
+    async def download(self, response_id):
+        """Download a file by its response_id."""
+        logger.info("Downloading file with response_id: %s", response_id)
+        file_info = await self._get_file_by_response_id(response_id)
+        if not file_info:
+            raise FileNotFoundError(f"File not found: {response_id}")
+
+        response = await self._request(
+            "GET",
+            f"{DRIVE_API_URL}/files/{file_info['id']}",
+            self.read_priority,
+            coalesce=True,
+            params={"alt": "media"},
+        )
+        return io.BytesIO(response.content)
+
+
+def _get_response_reason(response: httpx.Response) -> Optional[str]:
+    if response.status_code != 403:
+        return None
+    try:
+        return get_error_reason(response.json()["error"]["errors"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _is_retryable_response(response: httpx.Response) -> bool:
+    return is_retryable_status(response.status_code, _get_response_reason(response))
+
+
+async def _wait_before_retry(response: Optional[httpx.Response], attempt: int):
+    if response is not None and is_rate_limited_status(
+        response.status_code, _get_response_reason(response)
+    ):
+        # The scheduler holds back every caller, not just this one
+        drive_scheduler.throttle()
+    else:
+        await asyncio.sleep(backoff_delay(attempt))
+
+
+def _get_committed_offset(response: httpx.Response) -> int:
+    # Range header looks like "bytes=0-1048575", absent when nothing is stored
+    committed = response.headers.get("Range")
+    if not committed:
+        return 0
+    return int(committed.rsplit("-", 1)[1]) + 1
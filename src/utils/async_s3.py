@@ -0,0 +1,437 @@
+import asyncio
+import hashlib
+import hmac
+import io
+import json
+import uuid
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+import httpx
+from src.utils.async_storage import AsyncStorageClient
+from src.utils.buffers import Buffer, BufferStream, as_buffer
+from src.utils.config import config
+from src.utils.content_index import content_index, get_content_key, get_md5
+from src.utils.exceptions import FileNotFoundError
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.utils.retry import RETRYABLE_STATUS_CODES, backoff_delay
+from src.utils.storage import FileRole
+
+SIGNING_ALGORITHM = "AWS4-HMAC-SHA256"
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+# The longest a SigV4 presigned URL can be valid for
+MAX_URL_EXPIRY = 7 * 24 * 60 * 60
+# S3 rejects multipart parts under 5 MiB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def get_signing_key(secret_key: str, date: str, region: str) -> bytes:
+    key = f"AWS4{secret_key}".encode("utf-8")
+    for message in (date, region, "s3", "aws4_request"):
+        key = hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+    return key
+
+
+def get_canonical_query(params: Dict[str, str]) -> str:
+    return "&".join(
+        f"{quote(key, safe='-_.~')}={quote(str(value), safe='-_.~')}"
+        for key, value in sorted(params.items())
+    )
+
+
+def get_signature(
+    method: str,
+    path: str,
+    params: Dict[str, str],
+    headers: Dict[str, str],
+    payload_hash: str,
+    amz_date: str,
+    region: str,
+    secret_key: str,
+) -> Tuple[str, str, str]:
+    """Sign a request with AWS Signature Version 4.
+
+    Every header given is signed, and must include host. Returns the
+    signature, the signed header names and the credential scope.
+    """
+    canonical_headers = {
+        name.lower(): " ".join(str(value).split()) for name, value in headers.items()
+    }
+    signed_headers = ";".join(sorted(canonical_headers))
+    canonical_request = "\n".join(
+        [
+            method,
+            quote(path, safe="/-_.~"),
+            get_canonical_query(params),
+            "".join(
+                f"{name}:{canonical_headers[name]}\n"
+                for name in sorted(canonical_headers)
+            ),
+            signed_headers,
+            payload_hash,
+        ]
+    )
+    scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            SIGNING_ALGORITHM,
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ]
+    )
+    signature = hmac.new(
+        get_signing_key(secret_key, amz_date[:8], region),
+        string_to_sign.encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return signature, signed_headers, scope
+
+
+def get_amz_date(now: Optional[datetime] = None) -> str:
+    return (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+
+
+class AsyncS3StorageClient(AsyncStorageClient):
+    """Storage on an S3-compatible bucket (AWS S3, MinIO, R2...), over plain HTTP.
+
+    Objects are stored under `<prefix>objects/<file_id>`, with their name and
+    custom properties as user metadata. Agreements are also recorded in a
+    small JSON sidecar under `<prefix>responses/<response_id>.json`, which is
+    how they are found again by response_id. Large files are sent as
+    multipart uploads, several parts at a time. Sharing hands out expiring
+    presigned URLs, there are no per-user permissions. Drive folders have no
+    equivalent, so `folder_id` is ignored.
+
+    Requests are signed with SigV4 and sent through a shared connection pool,
+    with path-style URLs, which every S3-compatible server accepts.
+    """
+
+    _http_client: Optional[httpx.AsyncClient] = None
+    url_grants_access = True
+
+    def __init__(self):
+        if not config.S3_BUCKET:
+            raise ValueError("S3_BUCKET is not set")
+        endpoint = urlsplit(config.S3_ENDPOINT_URL)
+        self.scheme = endpoint.scheme
+        self.host = endpoint.netloc
+        self.bucket = config.S3_BUCKET
+        self.prefix = config.S3_PREFIX
+        self.region = config.S3_REGION
+        self.access_key = config.S3_ACCESS_KEY_ID
+        self.secret_key = config.S3_SECRET_ACCESS_KEY
+        self.part_size = max(config.S3_PART_SIZE, MIN_PART_SIZE)
+
+    @classmethod
+    def get_http_client(cls) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it on first use."""
+        if cls._http_client is None or cls._http_client.is_closed:
+            cls._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=config.S3_HTTP_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(config.S3_HTTP_TIMEOUT),
+            )
+        return cls._http_client
+
+    @classmethod
+    async def aclose(cls):
+        """Close the shared HTTP client."""
+        if cls._http_client is not None:
+            await cls._http_client.aclose()
+            cls._http_client = None
+
+    def _object_key(self, file_id: str) -> str:
+        return f"{self.prefix}objects/{file_id}"
+
+    def _index_key(self, response_id: str) -> str:
+        return f"{self.prefix}responses/{response_id}.json"
+
+    def _path(self, key: str) -> str:
+        return f"/{self.bucket}/{key}"
+
+    def presign_url(self, key: str, expires: int, method: str = "GET") -> str:
+        """A URL granting `method` on an object for `expires` seconds."""
+        amz_date = get_amz_date()
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        params = {
+            "X-Amz-Algorithm": SIGNING_ALGORITHM,
+            "X-Amz-Credential": f"{self.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(min(expires, MAX_URL_EXPIRY)),
+            "X-Amz-SignedHeaders": "host",
+        }
+        path = self._path(key)
+        signature, _, _ = get_signature(
+            method,
+            path,
+            params,
+            {"host": self.host},
+            UNSIGNED_PAYLOAD,
+            amz_date,
+            self.region,
+            self.secret_key,
+        )
+        return self._url(path, {**params, "X-Amz-Signature": signature})
+
+    def _url(self, path: str, params: Dict[str, str]) -> str:
+        # Encoded here rather than by httpx, exactly as it was signed
+        url = f"{self.scheme}://{self.host}{quote(path, safe='/-_.~')}"
+        return f"{url}?{get_canonical_query(params)}" if params else url
+
+    async def _request(
+        self,
+        method: str,
+        key: str,
+        params: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        content: Buffer = b"",
+    ) -> httpx.Response:
+        """Send a signed request, retrying transient errors with backoff."""
+        params = params or {}
+        path = self._path(key)
+        payload_hash = EMPTY_PAYLOAD_HASH
+        if len(content):
+            payload_hash = await asyncio.to_thread(
+                lambda: hashlib.sha256(content).hexdigest()
+            )
+        attempt = 0
+        while True:
+            amz_date = get_amz_date()
+            signed = {
+                **(headers or {}),
+                "host": self.host,
+                "x-amz-content-sha256": payload_hash,
+                "x-amz-date": amz_date,
+            }
+            signature, signed_headers, scope = get_signature(
+                method,
+                path,
+                params,
+                signed,
+                payload_hash,
+                amz_date,
+                self.region,
+                self.secret_key,
+            )
+            signed["Authorization"] = (
+                f"{SIGNING_ALGORITHM} Credential={self.access_key}/{scope},"
+                f" SignedHeaders={signed_headers}, Signature={signature}"
+            )
+            del signed["host"]
+            body = None
+            if len(content):
+                # Streamed from the buffer, a retry iterates over it again
+                signed["content-length"] = str(len(content))
+                body = BufferStream(content)
+            try:
+                response = await self.get_http_client().request(
+                    method, self._url(path, params), headers=signed, content=body
+                )
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                error = httpx.HTTPStatusError(
+                    f"Retryable status {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as e:
+                error = e
+            if attempt >= config.S3_MAX_RETRIES:
+                raise error
+            attempt += 1
+            metrics.increment("s3_request_retries")
+            logger.warning(
+                "S3 request %s %s failed (%s), retry %s", method, key, error, attempt
+            )
+            await asyncio.sleep(backoff_delay(attempt))
+
+    async def upload(
+        self,
+        file_stream: Buffer,
+        filename: str,
+        file_mimetype: str = "application/pdf",
+        folder_id=None,
+        custom_property=None,
+    ) -> str:
+        """Store a file with its custom properties, indexing it by response_id.
+
+        Files larger than one part go through a multipart upload, smaller
+        ones are sent as a single request. With deduplication on, a file
+        already stored in the bucket with the same content and metadata is
+        reused.
+        """
+        logger.info("Uploading file to S3: %s", filename)
+        logger.debug("File stream size: %s bytes", len(file_stream))
+        if not config.HEPI_FF_UPLOAD_DEDUP:
+            return await self._upload(
+                file_stream, filename, file_mimetype, custom_property
+            )
+
+        md5 = await asyncio.to_thread(get_md5, file_stream)
+        # The bucket is part of the key, ids of Drive or another bucket differ
+        metadata = {
+            "bucket": f"{self.host}/{self.bucket}/{self.prefix}",
+            "name": filename,
+            "mimetype": file_mimetype,
+            "properties": custom_property,
+        }
+        key = get_content_key(md5, len(file_stream), metadata)
+        file_id = await asyncio.to_thread(content_index.get, key)
+        if file_id is not None:
+            logger.info("File already uploaded, reusing %s: %s", file_id, filename)
+            metrics.increment("upload_dedup_hits")
+            metrics.increment("upload_dedup_bytes_saved", len(file_stream))
+            return file_id
+        file_id = await self._upload(
+            file_stream, filename, file_mimetype, custom_property
+        )
+        await asyncio.to_thread(content_index.put, key, file_id)
+        return file_id
+
+    async def _upload(
+        self,
+        file_stream: Buffer,
+        filename: str,
+        file_mimetype: str,
+        custom_property: Optional[Dict],
+    ) -> str:
+        file_id = uuid.uuid4().hex
+        key = self._object_key(file_id)
+        headers = {
+            "content-type": file_mimetype,
+            "content-disposition": f"inline; filename*=UTF-8''{quote(filename)}",
+            "x-amz-meta-filename": quote(filename),
+        }
+        # User metadata travels as headers, so it is kept to ASCII
+        for name, value in (custom_property or {}).items():
+            if value is not None:
+                headers[f"x-amz-meta-{name.replace('_', '-')}"] = quote(str(value))
+
+        if len(file_stream) > self.part_size:
+            await self._upload_multipart(key, as_buffer(file_stream), headers)
+        else:
+            await self._request("PUT", key, headers=headers, content=file_stream)
+
+        response_id = (custom_property or {}).get("response_id")
+        if response_id:
+            entry = {
+                "file_id": file_id,
+                "filename": filename,
+                "mimetype": file_mimetype,
+                "size": len(file_stream),
+                "properties": custom_property,
+            }
+            await self._request(
+                "PUT",
+                self._index_key(response_id),
+                headers={"content-type": "application/json"},
+                content=json.dumps(entry).encode("utf-8"),
+            )
+        return file_id
+
+    async def _upload_multipart(
+        self, key: str, file_stream: memoryview, headers: Dict[str, str]
+    ):
+        response = await self._request(
+            "POST", key, params={"uploads": ""}, headers=headers
+        )
+        upload_id = _find_xml_text(response.content, "UploadId")
+        offsets = range(0, len(file_stream), self.part_size)
+        semaphore = asyncio.Semaphore(config.S3_UPLOAD_CONCURRENCY)
+
+        async def upload_part(number: int, offset: int) -> str:
+            async with semaphore:
+                # Slicing the view is free, the part is copied once when sent
+                part = file_stream[offset : offset + self.part_size]
+                response = await self._request(
+                    "PUT",
+                    key,
+                    params={"partNumber": str(number), "uploadId": upload_id},
+                    content=part,
+                )
+                metrics.increment("s3_parts_uploaded")
+                return response.headers["ETag"]
+
+        try:
+            etags = await asyncio.gather(
+                *[
+                    upload_part(number, offset)
+                    for number, offset in enumerate(offsets, start=1)
+                ]
+            )
+            await self._request(
+                "POST",
+                key,
+                params={"uploadId": upload_id},
+                headers={"content-type": "application/xml"},
+                content=_get_complete_multipart_body(etags),
+            )
+        except BaseException:
+            # Stored parts are billed until the upload is aborted
+            logger.warning("Aborting multipart upload of %s", key)
+            try:
+                await self._request("DELETE", key, params={"uploadId": upload_id})
+            except Exception as e:
+                logger.warning("Failed to abort multipart upload %s: %s", key, e)
+            raise
+
+    async def _get_index_entry(self, response_id: str) -> Optional[Dict]:
+        try:
+            response = await self._request("GET", self._index_key(response_id))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
+        return response.json()
+
+    async def share(self, file_id, email, role=FileRole.READER) -> str:
+        """Hand out a presigned URL of the file, valid for S3_URL_EXPIRY seconds.
+
+        S3 has no per-user permissions, so anyone holding the URL can read
+        the file until it expires. Only reading can be shared.
+        """
+        logger.info("Sharing file ID: %s with email: %s", file_id, email)
+        if not email:
+            raise ValueError("Email address is required")
+        if role != FileRole.READER:
+            raise ValueError(f"Cannot share S3 objects as {role.value}")
+        return self.presign_url(self._object_key(file_id), config.S3_URL_EXPIRY)
+
+    async def get_file_url(self, response_id):
+        """Return an expiring link to the agreement of a response, "" if none."""
+        entry = await self._get_index_entry(response_id)
+        if entry is None:
+            logger.warning("File not found for response_id: %s", response_id)
+            return ""
+        return self.presign_url(
+            self._object_key(entry["file_id"]), config.S3_URL_EXPIRY
+        )
+
+    async def download(self, response_id):
+        entry = await self._get_index_entry(response_id)
+        if entry is None:
+            raise FileNotFoundError(f"File not found: {response_id}")
+        response = await self._request("GET", self._object_key(entry["file_id"]))
+        return io.BytesIO(response.content)
+
+
+def _find_xml_text(content: bytes, tag: str) -> str:
+    # S3 responses are namespaced, match the tag whatever the namespace
+    for element in ElementTree.fromstring(content).iter():
+        if element.tag.rsplit("}", 1)[-1] == tag:
+            return element.text
+    raise ValueError(f"No {tag} in S3 response")
+
+
+def _get_complete_multipart_body(etags: List[str]) -> bytes:
+    parts = "".join(
+        f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+        for number, etag in enumerate(etags, start=1)
+    )
+    return (
+        f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+    )
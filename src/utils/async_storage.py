@@ -0,0 +1,94 @@
+import abc
+import asyncio
+import io
+from typing import Optional
+from src.utils.buffers import Buffer
+from src.utils.storage import FileRole, LocalStorageClient
+
+
+class AsyncStorageClient(abc.ABC):
+    # Whether a file URL lets anyone holding it read the file, as presigned
+    # URLs do, so that it is only handed to authenticated callers
+    url_grants_access = False
+    # Whether file URLs point back at /pdf, which then streams the file itself
+    # rather than redirecting to it
+    url_is_app_route = False
+
+    @abc.abstractmethod
+    async def upload(
+        self,
+        file_stream: Buffer,
+        filename: str,
+        file_mimetype: str = "application/pdf",
+        folder_id=None,
+        custom_property=None,
+    ) -> str:
+        pass
+
+    @abc.abstractmethod
+    async def share(
+        self, file_id: str, email: str, role: FileRole = FileRole.READER
+    ) -> Optional[str]:
+        """Grant access to a file.
+
+        Returns a link to hand to the recipient when the backend cannot
+        notify them itself, None otherwise.
+        """
+        pass
+
+    @abc.abstractmethod
+    async def download(self, file_id: str) -> io.BytesIO:
+        pass
+
+    @abc.abstractmethod
+    async def get_file_url(self, file_id: str) -> str:
+        pass
+
+
+class AsyncLocalStorageClient(AsyncStorageClient):
+    """Async counterpart of LocalStorageClient, running file I/O off the event loop."""
+
+    url_is_app_route = True
+
+    def __init__(self):
+        self.client = LocalStorageClient()
+
+    async def upload(
+        self,
+        file_stream: Buffer,
+        filename: str,
+        file_mimetype: str = "application/pdf",
+        folder_id=None,
+        custom_property=None,
+    ) -> str:
+        return await asyncio.to_thread(
+            self.client.upload,
+            file_stream,
+            filename,
+            file_mimetype,
+            folder_id,
+            custom_property,
+        )
+
+    async def share(self, file_id, email, role=FileRole.READER):
+        return await asyncio.to_thread(self.client.share, file_id, email, role)
+
+    async def download(self, response_id):
+        return await asyncio.to_thread(self.client.download, response_id)
+
+    async def get_file_url(self, response_id):
+        return await asyncio.to_thread(self.client.get_file_url, response_id)
+
+
+def __getattr__(name):
+    # The remote clients pull in httpx (and google.auth for Drive), so they
+    # are only imported when actually used
+    if name == "AsyncGoogleDriveClient":
+        from src.utils.async_google_drive import AsyncGoogleDriveClient
+
+        return AsyncGoogleDriveClient
+    if name == "AsyncS3StorageClient":
+        from src.utils.async_s3 import AsyncS3StorageClient
+
+        return AsyncS3StorageClient
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,40 @@
+import io
+from typing import AsyncIterator, Union
+
+# What PDF generators hand over to storage clients: the generated document in
+# a single buffer, which is passed around by reference and never copied whole
+Buffer = Union[bytes, bytearray, memoryview]
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def as_buffer(data: Union[Buffer, io.BytesIO]) -> memoryview:
+    """Return a flat byte view of `data` without copying it."""
+    if isinstance(data, io.BytesIO):
+        view = data.getbuffer()
+    else:
+        view = memoryview(data)
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    return view
+
+
+class BufferStream:
+    """Async request body over buffers, sent as views rather than copies.
+
+    httpx writes each chunk out as it goes, so the body is never joined into
+    a new bytes object. It can be iterated again, which lets a retried
+    request send the whole body anew.
+    """
+
+    def __init__(self, *parts: Buffer, chunk_size: int = STREAM_CHUNK_SIZE):
+        self._parts = [as_buffer(part) for part in parts]
+        self._chunk_size = chunk_size
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self._parts)
+
+    async def __aiter__(self) -> AsyncIterator[memoryview]:
+        for part in self._parts:
+            for offset in range(0, len(part), self._chunk_size):
+                yield part[offset : offset + self._chunk_size]
@@ -0,0 +1,182 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from src.utils.buffers import Buffer
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+STATE_FILENAME = "state.json"
+PDF_FILENAME = "agreement.pdf"
+LOCK_FILENAME = ".lock"
+
+
+@dataclass
+class Submission:
+    """A rendered agreement, and how far its upload has got."""
+
+    response_id: str
+    filename: str
+    email: Optional[str]
+    properties: Dict[str, str]
+    pdf: Buffer
+    # Supplementary documents left to upload: name, content and mimetype
+    documents: List[Tuple[str, Buffer, Optional[str]]]
+    # Ids of the files uploaded so far, "agreement" or the document name
+    uploads: Dict[str, str] = field(default_factory=dict)
+    shared: bool = False
+    # Link returned by sharing, for backends that cannot notify the recipient
+    file_url: Optional[str] = None
+    # Folder the files are uploaded to, resolved when the upload starts
+    folder_id: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+
+
+def write_atomic(path: Path, data: Buffer):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class SubmissionCheckpoints:
+    """Rendered submissions persisted until they are fully uploaded.
+
+    Each submission gets a directory named after its responseId, holding the
+    PDF, the supplementary documents and a state file written last, so a
+    checkpoint only exists once everything it needs is on disk. The ids of
+    uploaded files are added to the state as uploads succeed, so a retry or
+    the sweeper only does what is left. Checkpoints older than `ttl`
+    seconds are dropped.
+    """
+
+    def __init__(self, directory: str, ttl: float):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _path(self, response_id: str) -> Path:
+        return self.directory / re.sub(r"[^\w-]", "_", response_id)
+
+    def save(self, submission: Submission):
+        path = self._path(submission.response_id)
+        path.mkdir(parents=True, exist_ok=True)
+        write_atomic(path / PDF_FILENAME, submission.pdf)
+        for i, (_, content, _) in enumerate(submission.documents):
+            write_atomic(path / f"document-{i}", content)
+        self.record(submission)
+        metrics.increment("checkpoints_saved")
+
+    def record(self, submission: Submission):
+        """Persist the progress of the uploads of a saved submission.
+
+        The state is read under the lock, so when concurrent uploads record
+        from worker threads the last write holds every upload made so far.
+        """
+        path = self._path(submission.response_id) / STATE_FILENAME
+        with self._lock:
+            state = {
+                "response_id": submission.response_id,
+                "filename": submission.filename,
+                "email": submission.email,
+                "properties": submission.properties,
+                "documents": [[name, mime] for name, _, mime in submission.documents],
+                "uploads": dict(submission.uploads),
+                "shared": submission.shared,
+                "file_url": submission.file_url,
+                "folder_id": submission.folder_id,
+                "created_at": submission.created_at,
+            }
+            write_atomic(path, json.dumps(state).encode("utf-8"))
+
+    def load(self, response_id: str) -> Optional[Submission]:
+        path = self._path(response_id)
+        try:
+            state = json.loads((path / STATE_FILENAME).read_text(encoding="utf-8"))
+            if time.time() - state["created_at"] > self.ttl:
+                logger.warning("Dropping expired checkpoint: %s", response_id)
+                self.remove(response_id)
+                return None
+            pdf = (path / PDF_FILENAME).read_bytes()
+            documents = [
+                (name, (path / f"document-{i}").read_bytes(), mimetype)
+                for i, (name, mimetype) in enumerate(state["documents"])
+            ]
+        except FileNotFoundError:
+            return None
+        return Submission(
+            response_id=state["response_id"],
+            filename=state["filename"],
+            email=state["email"],
+            properties=state["properties"],
+            pdf=pdf,
+            documents=documents,
+            uploads=state["uploads"],
+            shared=state["shared"],
+            file_url=state.get("file_url"),
+            folder_id=state.get("folder_id"),
+            created_at=state["created_at"],
+        )
+
+    def remove(self, response_id: str):
+        shutil.rmtree(self._path(response_id), ignore_errors=True)
+
+    @contextmanager
+    def lock(self, response_id: str):
+        """Hold the checkpoint exclusively across workers, yielding False if busy."""
+        path = self._path(response_id) / LOCK_FILENAME
+        try:
+            lock_file = open(path, "a")
+        except FileNotFoundError:
+            # Finished and removed by whoever held it last
+            yield False
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_stale(self, idle_for: float) -> List[str]:
+        """Response ids whose checkpoint has not progressed for `idle_for` seconds.
+
+        Expired checkpoints are removed along the way.
+        """
+        now = time.time()
+        stale = []
+        for path in self.directory.glob(f"*/{STATE_FILENAME}"):
+            try:
+                state = json.loads(path.read_text(encoding="utf-8"))
+                updated_at = path.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            if now - state["created_at"] > self.ttl:
+                logger.warning("Dropping expired checkpoint: %s", state["response_id"])
+                self.remove(state["response_id"])
+            elif now - updated_at > idle_for:
+                stale.append(state["response_id"])
+        return stale
+
+
+# Singleton instance of SubmissionCheckpoints
+submission_checkpoints = SubmissionCheckpoints(
+    config.CHECKPOINT_DIR, config.CHECKPOINT_TTL
+)
@@ -9,6 +9,47 @@ class Config:
     def __init__(self):
         # Google Drive configuration
         self.HEPI_PDF_RESULT_DRIVE_ID = os.getenv("HEPI_PDF_RESULT_DRIVE_ID")
+        self.DRIVE_HTTP_MAX_CONNECTIONS = int(
+            os.getenv("DRIVE_HTTP_MAX_CONNECTIONS", 20)
+        )
+        self.DRIVE_HTTP_MAX_KEEPALIVE = int(os.getenv("DRIVE_HTTP_MAX_KEEPALIVE", 10))
+        self.DRIVE_HTTP_TIMEOUT = float(os.getenv("DRIVE_HTTP_TIMEOUT", 60))
+        # Must be a multiple of 256 KiB, as required by the Drive resumable protocol
+        self.DRIVE_UPLOAD_CHUNK_SIZE = int(
+            os.getenv("DRIVE_UPLOAD_CHUNK_SIZE", 5 * 1024 * 1024)
+        )
+        self.DRIVE_MAX_RETRIES = int(os.getenv("DRIVE_MAX_RETRIES", 5))
+        self.DRIVE_RETRY_BASE_DELAY = float(os.getenv("DRIVE_RETRY_BASE_DELAY", 0.5))
+        self.DRIVE_RETRY_MAX_DELAY = float(os.getenv("DRIVE_RETRY_MAX_DELAY", 32))
+        # Token bucket shared by every Drive request of all the worker processes
+        self.DRIVE_RATE_LIMIT = float(os.getenv("DRIVE_RATE_LIMIT", 10))
+        self.DRIVE_RATE_BURST = float(os.getenv("DRIVE_RATE_BURST", 20))
+        self.DRIVE_RATE_STATE_PATH = os.getenv(
+            "DRIVE_RATE_STATE_PATH", "cache/drive_rate.sqlite3"
+        )
+        # Result subfolders: strftime of the submission date, "/" nests folders
+        self.DRIVE_SHARD_DATE_FORMAT = os.getenv("DRIVE_SHARD_DATE_FORMAT", "%Y/%m")
+        self.DRIVE_FOLDER_CACHE_PATH = os.getenv(
+            "DRIVE_FOLDER_CACHE_PATH", "cache/drive_folders.sqlite3"
+        )
+        # Seconds between two polls of the Drive changes feed
+        self.DRIVE_SYNC_INTERVAL = float(os.getenv("DRIVE_SYNC_INTERVAL", 30))
+
+        # S3-compatible storage, path-style URLs so MinIO and the like work too
+        self.S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "https://s3.amazonaws.com")
+        self.S3_REGION = os.getenv("S3_REGION", "us-east-1")
+        self.S3_BUCKET = os.getenv("S3_BUCKET")
+        self.S3_PREFIX = os.getenv("S3_PREFIX", "")
+        self.S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+        self.S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+        self.S3_HTTP_MAX_CONNECTIONS = int(os.getenv("S3_HTTP_MAX_CONNECTIONS", 20))
+        self.S3_HTTP_TIMEOUT = float(os.getenv("S3_HTTP_TIMEOUT", 60))
+        self.S3_MAX_RETRIES = int(os.getenv("S3_MAX_RETRIES", 5))
+        # Files larger than one part are uploaded in parts, several at a time
+        self.S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", 8 * 1024 * 1024))
+        self.S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", 4))
+        # Lifetime of the presigned URLs handed out, at most 7 days
+        self.S3_URL_EXPIRY = int(os.getenv("S3_URL_EXPIRY", 7 * 24 * 60 * 60))
 
         # Feature flag
         self.HEPI_FF_DOWNLOAD_PDF = (
@@ -20,15 +61,159 @@ class Config:
         self.HEPI_FF_UPLOAD_TO_DRIVE = (
             os.getenv("HEPI_FF_UPLOAD_TO_DRIVE", "False").lower() == "true"
         )
+        self.HEPI_FF_UPLOAD_TO_S3 = (
+            os.getenv("HEPI_FF_UPLOAD_TO_S3", "False").lower() == "true"
+        )
+        self.HEPI_FF_BUNDLE_DOCUMENTS = (
+            os.getenv("HEPI_FF_BUNDLE_DOCUMENTS", "False").lower() == "true"
+        )
+        self.HEPI_FF_STREAM_PDF = (
+            os.getenv("HEPI_FF_STREAM_PDF", "False").lower() == "true"
+        )
+        self.HEPI_FF_FAST_DEDUP = (
+            os.getenv("HEPI_FF_FAST_DEDUP", "False").lower() == "true"
+        )
+        self.HEPI_FF_AGREEMENTS_API = (
+            os.getenv("HEPI_FF_AGREEMENTS_API", "False").lower() == "true"
+        )
+        self.HEPI_FF_PDF_PREVIEW = (
+            os.getenv("HEPI_FF_PDF_PREVIEW", "False").lower() == "true"
+        )
+        self.HEPI_FF_PDF_ENGINE_ROUTER = (
+            os.getenv("HEPI_FF_PDF_ENGINE_ROUTER", "False").lower() == "true"
+        )
+        self.HEPI_FF_MEDIA_CACHE = (
+            os.getenv("HEPI_FF_MEDIA_CACHE", "False").lower() == "true"
+        )
+        self.HEPI_FF_PROFILING = (
+            os.getenv("HEPI_FF_PROFILING", "False").lower() == "true"
+        )
+        self.HEPI_FF_CHECKPOINTS = (
+            os.getenv("HEPI_FF_CHECKPOINTS", "False").lower() == "true"
+        )
+        self.HEPI_FF_DRIVE_SHARDING = (
+            os.getenv("HEPI_FF_DRIVE_SHARDING", "False").lower() == "true"
+        )
+        self.HEPI_FF_DRIVE_SYNC = (
+            os.getenv("HEPI_FF_DRIVE_SYNC", "False").lower() == "true"
+        )
+        self.HEPI_FF_NORMALIZE_IMAGES = (
+            os.getenv("HEPI_FF_NORMALIZE_IMAGES", "False").lower() == "true"
+        )
+        self.HEPI_FF_UPLOAD_DEDUP = (
+            os.getenv("HEPI_FF_UPLOAD_DEDUP", "False").lower() == "true"
+        )
+        self.HEPI_FF_LOOP_MONITOR = (
+            os.getenv("HEPI_FF_LOOP_MONITOR", "False").lower() == "true"
+        )
         self.USE_HTML_PDF_GENERATOR = (
             os.getenv("USE_HTML_PDF_GENERATOR", "True").lower() == "true"
         )
 
+        # PDF engine router: render time budgets in seconds, and circuit breakers
+        self.PDF_ENGINE_BUDGET_PDFKIT = float(os.getenv("PDF_ENGINE_BUDGET_PDFKIT", 30))
+        self.PDF_ENGINE_BUDGET_PYMUPDF = float(
+            os.getenv("PDF_ENGINE_BUDGET_PYMUPDF", 5)
+        )
+        self.PDF_ENGINE_WINDOW = int(os.getenv("PDF_ENGINE_WINDOW", 20))
+        self.PDF_ENGINE_MAX_FAILURES = int(os.getenv("PDF_ENGINE_MAX_FAILURES", 3))
+        self.PDF_ENGINE_MAX_ERROR_RATE = float(
+            os.getenv("PDF_ENGINE_MAX_ERROR_RATE", 0.5)
+        )
+        self.PDF_ENGINE_COOLDOWN = float(os.getenv("PDF_ENGINE_COOLDOWN", 60))
+
+        # Local storage
+        self.LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "storage")
+
+        # Cache
+        self.PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "cache/pdf")
+        self.PDF_CACHE_MAX_BYTES = int(
+            os.getenv("PDF_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+        )
+        self.MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "cache/media")
+        self.MEDIA_CACHE_MAX_BYTES = int(
+            os.getenv("MEDIA_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+        )
+        self.MEDIA_CACHE_TTL = float(os.getenv("MEDIA_CACHE_TTL", 7 * 24 * 60 * 60))
+        self.PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", "cache/preview")
+        self.PREVIEW_CACHE_MAX_BYTES = int(
+            os.getenv("PREVIEW_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        )
+
+        # First page thumbnails, in pixels wide
+        self.PREVIEW_WIDTH = int(os.getenv("PREVIEW_WIDTH", 400))
+        self.PREVIEW_MAX_WIDTH = int(os.getenv("PREVIEW_MAX_WIDTH", 1200))
+
+        # Supplementary photos, shrunk before upload when over IMAGE_MIN_BYTES
+        self.IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", 2000))
+        self.IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 80))
+        self.IMAGE_MIN_BYTES = int(os.getenv("IMAGE_MIN_BYTES", 500 * 1024))
+        self.IMAGE_TO_PDF = os.getenv("IMAGE_TO_PDF", "False").lower() == "true"
+        self.IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+        # Agreement metadata index, and the token of the reporting API, which also
+        # lets API clients have the PDFs streamed (HEPI_FF_STREAM_PDF)
+        self.AGREEMENT_INDEX_PATH = os.getenv(
+            "AGREEMENT_INDEX_PATH", "cache/agreements.sqlite3"
+        )
+        self.AGREEMENTS_API_TOKEN = os.getenv("AGREEMENTS_API_TOKEN")
+
+        # Ids of the uploaded files by content, reused for identical uploads
+        self.CONTENT_INDEX_PATH = os.getenv(
+            "CONTENT_INDEX_PATH", "cache/content_index.sqlite3"
+        )
+        self.CONTENT_INDEX_TTL = float(os.getenv("CONTENT_INDEX_TTL", 24 * 60 * 60))
+
+        # Compiled Jinja templates
+        self.TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "cache/templates")
+
+        # Completed responses, used to answer redelivered webhooks early
+        self.DEDUP_STATE_DIR = os.getenv("DEDUP_STATE_DIR", "cache/dedup")
+        self.DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", 10000))
+        self.DEDUP_BLOOM_CAPACITY = int(os.getenv("DEDUP_BLOOM_CAPACITY", 1000000))
+        self.DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", 0.001))
+
+        # Rendered submissions kept until uploaded, and the sweeper finishing them
+        self.CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "cache/checkpoints")
+        self.CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", 24 * 60 * 60))
+        self.CHECKPOINT_SWEEP_INTERVAL = float(
+            os.getenv("CHECKPOINT_SWEEP_INTERVAL", 60)
+        )
+        # Idle time after which an unfinished submission is taken over
+        self.CHECKPOINT_SWEEP_AFTER = float(os.getenv("CHECKPOINT_SWEEP_AFTER", 300))
+
+        # Admission control of /submit/, per worker
+        self.SUBMIT_MAX_CONCURRENCY = int(os.getenv("SUBMIT_MAX_CONCURRENCY", 4))
+        self.SUBMIT_MAX_QUEUE = int(os.getenv("SUBMIT_MAX_QUEUE", 16))
+        self.SUBMIT_QUEUE_TIMEOUT = float(os.getenv("SUBMIT_QUEUE_TIMEOUT", 10))
+        # Memory a submission may need, 0 disables the memory-aware limit
+        self.SUBMIT_REQUEST_MEMORY_MB = int(os.getenv("SUBMIT_REQUEST_MEMORY_MB", 200))
+        self.SUBMIT_RETRY_AFTER = int(os.getenv("SUBMIT_RETRY_AFTER", 30))
+
+        # Profiling of submissions, requested by a signed header or sampled
+        self.PROFILE_SIGNING_SECRET = os.getenv("PROFILE_SIGNING_SECRET")
+        self.PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+        self.PROFILE_DIR = os.getenv("PROFILE_DIR", "logs/profiles")
+        self.PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 100))
+
+        # Event loop lag sampling, and the stall reported as a blocking call
+        self.LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+        self.LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", 0.25))
+
+        # Server
+        self.WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 0))
+        self.WORKER_MEMORY_MB = int(os.getenv("WORKER_MEMORY_MB", 512))
+        self.STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", 1500))
+
         # Other
         self.ENVIRONMENT = os.getenv("ENVIRONMENT", "production")
         self.DEBUG = os.getenv("DEBUG", "False").lower() == "true"
         self.PORT = int(os.getenv("PORT", 8000))
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+        # "default" for plain text lines, "json" for one JSON object per line
+        self.LOG_FORMAT = os.getenv("LOG_FORMAT", "default")
+        # Fraction of requests whose INFO lines are kept, warnings are never dropped
+        self.LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", 1.0))
         self.TALLY_SIGNING_SECRET = os.getenv("HEPI_TALLY_SIGNING_SECRET")
 
 
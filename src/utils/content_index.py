@@ -0,0 +1,81 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Optional
+from src.utils.buffers import Buffer, as_buffer
+from src.utils.config import config
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_md5(file_stream: Buffer) -> str:
+    """Hex MD5 of a buffer, the digest Drive reports as md5Checksum."""
+    view = as_buffer(file_stream)
+    digest = hashlib.md5(usedforsecurity=False)
+    for offset in range(0, len(view), HASH_CHUNK_SIZE):
+        digest.update(view[offset : offset + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def get_content_key(md5: str, size: int, metadata: Dict) -> str:
+    """Key of an upload: its content, and the name, folder and properties it has."""
+    key = json.dumps({"md5": md5, "size": size, **metadata}, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ContentIndex:
+    """Ids of the files already uploaded, by content and metadata.
+
+    Kept in a SQLite file shared by the workers. A file is only reused for
+    the same bytes under the same name, folder and properties, so the result
+    is indistinguishable from a fresh upload. Entries expire after `ttl`
+    seconds, which bounds how long a file deleted on Drive can still be
+    handed out.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None):
+        self.path = Path(path or config.CONTENT_INDEX_PATH)
+        self.ttl = config.CONTENT_INDEX_TTL if ttl is None else ttl
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._init_index()
+                    self._initialized = True
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _init_index(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            with connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS uploads ("
+                    " key TEXT PRIMARY KEY, file_id TEXT, created_at REAL)"
+                )
+
+    def get(self, key: str) -> Optional[str]:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT file_id FROM uploads WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, file_id: str):
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)",
+                (key, file_id, time.time()),
+            )
+
+
+# Singleton instance of ContentIndex
+content_index = ContentIndex()
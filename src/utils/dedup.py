@@ -0,0 +1,239 @@
+import fcntl
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Tuple
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# Tally sends eventId first and data.responseId before the (large) fields
+# list, so a forward search stops early. User-entered values cannot match,
+# their quotes are escaped inside JSON strings.
+EVENT_ID_PATTERN = re.compile(rb'"eventId"\s*:\s*"([^"\\]+)"')
+RESPONSE_ID_PATTERN = re.compile(rb'"responseId"\s*:\s*"([^"\\]+)"')
+
+BLOOM_HEADER = b"BLOOM1"
+
+
+def scan_event_ids(body: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """Pull eventId and data.responseId out of a raw webhook body without parsing it."""
+    event_id = EVENT_ID_PATTERN.search(body)
+    response_id = RESPONSE_ID_PATTERN.search(body)
+    return (
+        event_id.group(1).decode("ascii", "replace") if event_id else None,
+        response_id.group(1).decode("ascii", "replace") if response_id else None,
+    )
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter sized for `capacity` items at `error_rate`."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(8, math.ceil(bits))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def _header(self) -> bytes:
+        return BLOOM_HEADER + self.size.to_bytes(8, "little") + bytes([self.hash_count])
+
+    def merge_from(self, path: Path):
+        """OR the bits saved at `path` into this filter, if they have the same shape."""
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return
+        header = self._header()
+        if not data.startswith(header) or len(data) != len(header) + len(self.bits):
+            logger.warning("Ignoring Bloom filter with a different shape: %s", path)
+            return
+        saved = int.from_bytes(data[len(header) :], "little")
+        current = int.from_bytes(self.bits, "little")
+        self.bits = bytearray((saved | current).to_bytes(len(self.bits), "little"))
+
+    def save(self, path: Path):
+        # Merge first, other workers may have saved completions of their own
+        self.merge_from(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._header())
+                f.write(self.bits)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+
+class CompletedResponses:
+    """Record of the Tally responses this service has already processed.
+
+    Recent results are kept in an LRU keyed by both eventId and responseId,
+    so a redelivered webhook is answered with its original result. Older
+    responseIds are only remembered by a Bloom filter, whose hits still have
+    to be confirmed against storage because of false positives.
+
+    The LRU and the filter are per worker, a redelivery reaching another
+    worker falls through to the endpoint, which still finds the stored file.
+
+    Completions are appended to a journal, and the filter is saved every
+    `max_entries` completions and on shutdown, compacting the journal. Both
+    are restored on startup. Workers share the files under a lock file, held
+    exclusively while saving and shared while appending.
+    """
+
+    def __init__(
+        self, directory: str, max_entries: int, capacity: int, error_rate: float
+    ):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.bloom = BloomFilter(capacity, error_rate)
+        self._results: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._unsaved = 0
+
+    @property
+    def journal_path(self) -> Path:
+        return self.directory / "completed.jsonl"
+
+    @property
+    def bloom_path(self) -> Path:
+        return self.directory / "bloom.bin"
+
+    @contextmanager
+    def _lock_files(self, operation: int):
+        """Hold the lock file of the journal and the filter across workers."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _remember(self, event_id: Optional[str], response_id: str, result: dict):
+        self.bloom.add(response_id)
+        for key in (event_id, response_id):
+            if key:
+                self._results[key] = result
+                self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def get(
+        self, event_id: Optional[str], response_id: Optional[str]
+    ) -> Optional[dict]:
+        """The cached result of a completed event or response, if still in the LRU."""
+        with self._lock:
+            for key in (event_id, response_id):
+                if key and key in self._results:
+                    self._results.move_to_end(key)
+                    return self._results[key]
+        return None
+
+    def might_contain(self, response_id: str) -> bool:
+        return response_id in self.bloom
+
+    def add(self, event_id: Optional[str], response_id: str, result: dict):
+        """Remember a completed response and journal it, blocking on file I/O."""
+        entry = {"event_id": event_id, "response_id": response_id, "result": result}
+        with self._lock:
+            self._remember(event_id, response_id, result)
+            metrics.set_gauge("dedup_cached_results", len(self._results))
+            self._unsaved += 1
+            save = self._unsaved >= self.max_entries
+            if save:
+                self._unsaved = 0
+        try:
+            with self._lock_files(fcntl.LOCK_SH):
+                # Single appends of one line, so concurrent workers do not interleave
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        except OSError as e:
+            logger.warning("Failed to journal completed response: %s", e)
+        if save:
+            self.save()
+
+    def load(self):
+        """Restore the filter and the most recent results from disk."""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            self.bloom.merge_from(self.bloom_path)
+            try:
+                with open(self.journal_path, encoding="utf-8") as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                lines = []
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                    self._remember(
+                        entry["event_id"], entry["response_id"], entry["result"]
+                    )
+                except (ValueError, KeyError, TypeError):
+                    # A torn last line of a crashed worker
+                    continue
+        metrics.set_gauge("dedup_cached_results", len(self._results))
+        logger.info("Restored %s completed responses", len(lines))
+
+    def save(self):
+        """Persist the filter, and trim the journal to what the LRU can hold."""
+        try:
+            with self._lock_files(fcntl.LOCK_EX):
+                with self._lock:
+                    self.bloom.save(self.bloom_path)
+                self._compact_journal()
+        except OSError as e:
+            logger.warning("Failed to save completed responses: %s", e)
+
+    def _compact_journal(self):
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        # Every responseId is in the saved filter, only recent results are needed
+        if len(lines) <= 2 * self.max_entries:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.writelines(lines[-self.max_entries :])
+        os.replace(tmp_path, self.journal_path)
+
+
+# Singleton instance of CompletedResponses
+completed_responses = CompletedResponses(
+    config.DEDUP_STATE_DIR,
+    config.DEDUP_MAX_ENTRIES,
+    config.DEDUP_BLOOM_CAPACITY,
+    config.DEDUP_BLOOM_ERROR_RATE,
+)
@@ -1,16 +1,38 @@
-from src.pdfkit_pdf_generator import PDFKitPerjanjianJasaPemasaranPropertiPDFGenerator
-from src.pymupdf_pdf_generator import PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator
 from src.utils.config import config
-from src.utils.storage import GoogleDriveClient, LocalStorageClient
+
+# Engines and storage backends are imported on first use, so a cold start
+# only pays for the ones selected by the configuration.
 
 
 def get_pdf_generator():
+    if config.HEPI_FF_PDF_ENGINE_ROUTER:
+        from src.pdf_engine_router import (
+            RoutingPerjanjianJasaPemasaranPropertiPDFGenerator,
+        )
+
+        return RoutingPerjanjianJasaPemasaranPropertiPDFGenerator()
     if config.USE_HTML_PDF_GENERATOR:
+        from src.pdfkit_pdf_generator import (
+            PDFKitPerjanjianJasaPemasaranPropertiPDFGenerator,
+        )
+
         return PDFKitPerjanjianJasaPemasaranPropertiPDFGenerator()
+    from src.pymupdf_pdf_generator import (
+        PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator,
+    )
+
     return PyMuPDFPerjanjianJasaPemasaranPropertiPDFGenerator()
 
 
-def get_storage_client():
+def get_async_storage_client():
     if config.HEPI_FF_UPLOAD_TO_DRIVE:
-        return GoogleDriveClient()
-    return LocalStorageClient()
+        from src.utils.async_google_drive import AsyncGoogleDriveClient
+
+        return AsyncGoogleDriveClient()
+    if config.HEPI_FF_UPLOAD_TO_S3:
+        from src.utils.async_s3 import AsyncS3StorageClient
+
+        return AsyncS3StorageClient()
+    from src.utils.async_storage import AsyncLocalStorageClient
+
+    return AsyncLocalStorageClient()
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# Eviction frees some headroom, so a full cache is not scanned on every write
+EVICT_TARGET_RATIO = 0.9
+
+
+class DiskCache:
+    """Size-bounded LRU cache of files in a directory.
+
+    Entries are written atomically (temp file + rename) and their access time
+    is bumped on every hit, so several worker processes can share one
+    directory: eviction removes the least recently used files until the total
+    size is under `max_bytes`, and drops entries older than `ttl` seconds.
+
+    Eviction scans the whole directory, so writes only trigger it once the
+    size seen by the last scan plus this process's writes since goes over
+    `max_bytes`, or `evict_interval` seconds after the last scan.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        ttl: Optional[float] = None,
+        name=None,
+        evict_interval: float = 60,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = name or self.directory.name
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self._evicted_at = 0.0
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self._path(key)
+        try:
+            stat = path.stat()
+        except OSError:
+            metrics.increment(f"{self.name}_cache_misses")
+            return None
+        if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+            self._remove(path)
+            metrics.increment(f"{self.name}_cache_misses")
+            return None
+        # Only the access time is bumped, the modification time marks creation
+        try:
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            # Evicted by another worker in the meantime
+            metrics.increment(f"{self.name}_cache_misses")
+            return None
+        metrics.increment(f"{self.name}_cache_hits")
+        return path
+
+    def put(self, key: str, data: bytes) -> Path:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(Path(tmp_path))
+            raise
+        if self._grow(len(data)):
+            self.evict()
+        return path
+
+    def _grow(self, size: int) -> bool:
+        """Account for a write and tell whether an eviction scan is due."""
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            return (
+                self._size is None
+                or self._size > self.max_bytes
+                or time.monotonic() - self._evicted_at > self.evict_interval
+            )
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        total = 0
+        for path in self.directory.glob("*/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                self._remove(path)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        target = self.max_bytes
+        if total > self.max_bytes:
+            target *= EVICT_TARGET_RATIO
+        for _, size, path in entries:
+            if total <= target:
+                break
+            logger.debug("Evicting %s cache entry: %s", self.name, path.name)
+            self._remove(path)
+            metrics.increment(f"{self.name}_cache_evictions")
+            total -= size
+        with self._lock:
+            self._size = total
+            self._evicted_at = time.monotonic()
+        metrics.set_gauge(f"{self.name}_cache_bytes", total)
+
+    def _remove(self, path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# Supplementary documents are named after their agreement, see
+# get_supplementary_filename, so they can be matched back to it
+SUPPLEMENTARY_FILENAME = re.compile(
+    r"^(?P<stem>.+)_(property_certificate|owner_ktp|property_pbb|property_imb)"
+    r"\.(pdf|jpg|png)$"
+)
+UNKNOWN_AGENT = "_unknown"
+
+MIGRATION_FILE_FIELDS = "id, name, parents, createdTime, properties"
+
+
+def get_shard_path(properties: Dict[str, str]) -> List[str]:
+    """Names of the nested folders an agreement and its documents are stored in.
+
+    Dated by the submission, e.g. 2025/03, then grouped by agent.
+    """
+    created_at = datetime.fromisoformat(properties["created_at"])
+    agent_name = " ".join((properties.get("agent_name") or "").split())
+    return [
+        *created_at.strftime(config.DRIVE_SHARD_DATE_FORMAT).split("/"),
+        agent_name or UNKNOWN_AGENT,
+    ]
+
+
+class DriveFolders:
+    """Finds or creates the shard folders under the result folder.
+
+    Folder ids are cached in memory and in a SQLite file shared by the
+    workers, so each folder is looked up on Drive once. Creation is
+    serialized within a worker, and a folder is always looked up before it
+    is created. Two workers racing on a brand new folder can still both
+    create it; the oldest one is used from then on.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or config.DRIVE_FOLDER_CACHE_PATH)
+        self._folders: Dict[tuple, str] = {}
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        self._create_locks: Dict[tuple, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._init_cache()
+                    self._initialized = True
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _init_cache(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            with connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS folders ("
+                    " parent_id TEXT, name TEXT, folder_id TEXT,"
+                    " PRIMARY KEY (parent_id, name))"
+                )
+
+    def _get_cached(self, parent_id: str, name: str) -> Optional[str]:
+        key = (parent_id, name)
+        if key not in self._folders:
+            with closing(self._connect()) as connection:
+                row = connection.execute(
+                    "SELECT folder_id FROM folders WHERE parent_id = ? AND name = ?",
+                    key,
+                ).fetchone()
+            if row is None:
+                return None
+            self._folders[key] = row[0]
+        return self._folders[key]
+
+    def _set_cached(self, parent_id: str, name: str, folder_id: str):
+        self._folders[(parent_id, name)] = folder_id
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?, ?)",
+                (parent_id, name, folder_id),
+            )
+
+    async def _lookup(self, parent_id: str, name: str) -> Optional[str]:
+        """A cached folder id, reading the SQLite file off the event loop."""
+        folder_id = self._folders.get((parent_id, name))
+        if folder_id is None:
+            folder_id = await asyncio.to_thread(self._get_cached, parent_id, name)
+        return folder_id
+
+    async def get_folder(self, client, parent_id: str, name: str) -> str:
+        folder_id = await self._lookup(parent_id, name)
+        if folder_id:
+            metrics.increment("drive_folder_cache_hits")
+            return folder_id
+        metrics.increment("drive_folder_cache_misses")
+        async with self._create_locks[(parent_id, name)]:
+            # Another request may have found or created it while this one waited
+            folder_id = await self._lookup(parent_id, name)
+            if folder_id:
+                return folder_id
+            folder_id = await client.find_folder(name, parent_id)
+            if folder_id is None:
+                folder_id = await client.create_folder(name, parent_id)
+                metrics.increment("drive_folders_created")
+            await asyncio.to_thread(self._set_cached, parent_id, name, folder_id)
+            return folder_id
+
+    async def get_shard_folder(self, client, properties: Dict[str, str]) -> str:
+        """The id of the folder a submission is uploaded to, created on demand."""
+        folder_id = config.HEPI_PDF_RESULT_DRIVE_ID
+        for name in get_shard_path(properties):
+            folder_id = await self.get_folder(client, folder_id, name)
+        return folder_id
+
+
+def get_migration_properties(
+    file: Dict[str, Any], agreements: Dict[str, Dict[str, str]]
+) -> Dict[str, str]:
+    """The properties a file is sharded by, borrowed from its agreement if needed."""
+    properties = file.get("properties") or {}
+    if properties.get("response_id"):
+        return properties
+    match = SUPPLEMENTARY_FILENAME.match(file["name"])
+    if match and f"{match['stem']}.pdf" in agreements:
+        return agreements[f"{match['stem']}.pdf"]
+    return {"created_at": file["createdTime"].replace("Z", "+00:00")}
+
+
+async def migrate(batch_size: int, concurrency: int, dry_run: bool = False) -> int:
+    """Move the files lying flat in the result folder into their shard folders."""
+    from src.utils.async_google_drive import AsyncGoogleDriveClient, FOLDER_MIME_TYPE
+    from src.utils.scheduler import Priority
+
+    root_id = config.HEPI_PDF_RESULT_DRIVE_ID
+    client = AsyncGoogleDriveClient(priority=Priority.BACKFILL)
+    query = (
+        f"'{root_id}' in parents and trashed = false"
+        f" and mimeType != '{FOLDER_MIME_TYPE}'"
+    )
+    try:
+        files = []
+        async for page in client.list_files(query, MIGRATION_FILE_FIELDS):
+            files.extend(page)
+        logger.info("Found %s files to migrate", len(files))
+
+        # Files sharing a name are matched to the latest agreement of that name
+        files.sort(key=lambda file: file["createdTime"])
+        agreements = {
+            file["name"]: file["properties"]
+            for file in files
+            if (file.get("properties") or {}).get("response_id")
+        }
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def move(file: Dict[str, Any]):
+            properties = get_migration_properties(file, agreements)
+            if dry_run:
+                path = "/".join(get_shard_path(properties))
+                logger.info("Would move %s to %s", file["name"], path)
+                return
+            async with semaphore:
+                folder_id = await drive_folders.get_shard_folder(client, properties)
+                await client.move_file(file["id"], folder_id, root_id)
+
+        moved = 0
+        for start in range(0, len(files), batch_size):
+            batch = files[start : start + batch_size]
+            await asyncio.gather(*[move(file) for file in batch])
+            moved += len(batch)
+            logger.info("Migrated %s of %s files", moved, len(files))
+        return moved
+    finally:
+        await AsyncGoogleDriveClient.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Move the files of the result folder into date and agent folders."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    migration = commands.add_parser("migrate", help="Shard the existing files")
+    migration.add_argument("--batch-size", type=int, default=100)
+    migration.add_argument("--concurrency", type=int, default=8)
+    migration.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if not config.HEPI_PDF_RESULT_DRIVE_ID:
+        parser.error("HEPI_PDF_RESULT_DRIVE_ID is not set")
+    count = asyncio.run(migrate(args.batch_size, args.concurrency, args.dry_run))
+    print(f"Migrated {count} files")
+
+
+# Singleton instance of DriveFolders
+drive_folders = DriveFolders()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,12 @@ class FileNotFoundError(Exception):
     pass
 
 
+class ImageNormalizationError(Exception):
+    """Custom exception for supplementary images that cannot be normalized"""
+
+    pass
+
+
 class InvalidSignatureError(Exception):
     """Custom exception for invalid signatures"""
 
@@ -21,3 +27,21 @@ class PDFGenerationError(Exception):
     """Custom exception for PDF generation failures"""
 
     pass
+
+
+class RangeNotSatisfiableError(Exception):
+    """Custom exception for unsatisfiable HTTP Range requests"""
+
+    pass
+
+
+class ServiceOverloadedError(Exception):
+    """Custom exception for requests shed by admission control"""
+
+    pass
+
+
+class UnauthorizedError(Exception):
+    """Custom exception for requests without valid API credentials"""
+
+    pass
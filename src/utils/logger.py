@@ -1,42 +1,130 @@
+import atexit
+import contextvars
+import json
 import logging
-import logging.config
+import logging.handlers
+import os
+import queue
+import random
 import sys
 from pathlib import Path
 from src.utils.config import config
 
-# Create logs directory if it doesn't exist
 logs_dir = Path("logs")
-logs_dir.mkdir(exist_ok=True)
-
-# Configure logging
-logging_config = {
-    "version": 1,
-    "formatters": {
-        "default": {
-            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "default",
-            "stream": sys.stdout,
-        },
-        "file": {
-            "class": "logging.FileHandler",
-            "formatter": "default",
-            "filename": logs_dir / "app.log",
-            "mode": "a",
-        },
-    },
-    "root": {
-        "level": config.LOG_LEVEL,
-        "handlers": ["console", "file"],
-    },
+
+# Per-request logging context, copied into every task and thread of the request
+request_id_var = contextvars.ContextVar("request_id", default="-")
+stage_var = contextvars.ContextVar("stage", default="-")
+sampled_var = contextvars.ContextVar("sampled", default=True)
+
+
+def start_request_context(request_id: str) -> bool:
+    """Bind the request id to the current context and decide its INFO sampling."""
+    request_id_var.set(request_id)
+    stage_var.set("-")
+    sampled = random.random() < config.LOG_INFO_SAMPLE_RATE
+    sampled_var.set(sampled)
+    return sampled
+
+
+def set_stage(stage: str):
+    """Tag the following log lines of the current request with a pipeline stage."""
+    stage_var.set(stage)
+
+
+class FileHandler(logging.FileHandler):
+    """File handler that creates the logs directory when the file is first opened."""
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+
+class ContextFilter(logging.Filter):
+    """Attach the request context to records, and sample INFO lines per request.
+
+    Runs on the calling thread, before the record is handed to the queue.
+    Warnings and errors are always kept, as is everything outside a request.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.stage = stage_var.get()
+        return record.levelno != logging.INFO or sampled_var.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": record.request_id,
+            "stage": record.stage,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """Queue listener that can be stopped and started again around a fork."""
+
+    def start(self):
+        if self._thread is None:
+            super().start()
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+# Configure logging: the actual handlers run on the listener thread only
+formatters = {
+    "default": logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s:%(stage)s] %(message)s"
+    ),
+    "json": JsonFormatter(),
 }
+console_handler = logging.StreamHandler(sys.stdout)
+file_handler = FileHandler(logs_dir / "app.log", mode="a", delay=True)
+formatter = formatters.get(config.LOG_FORMAT, formatters["default"])
+for handler in (console_handler, file_handler):
+    handler.setFormatter(formatter)
+
+log_queue = queue.SimpleQueue()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.addFilter(ContextFilter())
 
-# Apply logging configuration
-logging.config.dictConfig(logging_config)
+listener = QueueListener(
+    log_queue,
+    console_handler,
+    file_handler,
+)
+listener.start()
+atexit.register(listener.stop)
+
+# The listener thread does not survive a fork, so flush it beforehand and
+# start it again on both sides
+os.register_at_fork(
+    before=listener.stop,
+    after_in_parent=listener.start,
+    after_in_child=listener.start,
+)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(config.LOG_LEVEL)
+root_logger.addHandler(queue_handler)
 
 # Create a logger instance
 logger = logging.getLogger(__name__)
+
+if config.LOG_FORMAT not in formatters:
+    logger.warning(
+        "Unknown LOG_FORMAT %r, expected one of %s, using default",
+        config.LOG_FORMAT,
+        ", ".join(formatters),
+    )
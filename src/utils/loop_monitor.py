@@ -0,0 +1,109 @@
+import asyncio
+import collections
+import os
+import statistics
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+
+# Upper bounds of the lag histogram buckets, in milliseconds
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+LAG_WINDOW = 600
+
+APP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+
+def get_blocking_location(frame) -> str:
+    """The innermost frame of the app's own code, where the blocking call is made."""
+    summary = traceback.extract_stack(frame)
+    for entry in reversed(summary):
+        path = os.path.abspath(entry.filename)
+        if path.startswith(APP_DIRECTORY) and "site-packages" not in path:
+            name = os.path.relpath(path, APP_DIRECTORY)
+            return f"{name}:{entry.lineno}({entry.name})"
+    return f"{summary[-1].filename}:{summary[-1].lineno}({summary[-1].name})"
+
+
+class LoopMonitor:
+    """Measures the event loop lag, and reports the calls that block the loop.
+
+    A task sleeps for `interval` seconds in a loop, and how late it wakes up
+    is the lag: the time other callbacks held the loop. Lags are counted in
+    the cumulative event_loop_lag_le_<ms> buckets, with p50 and p99 gauges
+    over the recent ones.
+
+    A watchdog thread checks that the task keeps waking up. When the loop is
+    stuck for longer than `block_threshold` seconds, it logs the stack of the
+    loop thread, which is still inside the blocking call, and counts it by
+    the line of the app's code that made it.
+    """
+
+    def __init__(self, interval: float, block_threshold: float):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._lags = collections.deque(maxlen=LAG_WINDOW)
+        self._stopped = threading.Event()
+
+    def record_lag(self, lag: float):
+        lag_ms = lag * 1000
+        for bucket in LAG_BUCKETS_MS:
+            if lag_ms <= bucket:
+                metrics.increment(f"event_loop_lag_le_{bucket}ms")
+        metrics.increment("event_loop_lag_count")
+        metrics.increment("event_loop_lag_sum_ms", lag_ms)
+        self._lags.append(lag_ms)
+        if len(self._lags) >= 2:
+            quantiles = statistics.quantiles(self._lags, n=100, method="inclusive")
+            metrics.set_gauge("event_loop_lag_p50_ms", quantiles[49])
+            metrics.set_gauge("event_loop_lag_p99_ms", quantiles[98])
+
+    async def run(self):
+        """Measure the lag of the running loop until cancelled."""
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        watchdog = threading.Thread(
+            target=self._watch, name="loop-monitor", daemon=True
+        )
+        watchdog.start()
+        try:
+            while True:
+                start_time = time.monotonic()
+                self._heartbeat = start_time
+                await asyncio.sleep(self.interval)
+                lag = time.monotonic() - start_time - self.interval
+                self.record_lag(max(lag, 0.0))
+        finally:
+            self._stopped.set()
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(min(self.interval, self.block_threshold / 2)):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            # Reported once per stall, while the loop is still stuck in it
+            if blocked_for < self.block_threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            location = get_blocking_location(frame)
+            metrics.increment("event_loop_blocks")
+            metrics.increment(f"event_loop_blocks_at_{location}")
+            logger.warning(
+                "Event loop blocked for %.0fms at %s:\n%s",
+                blocked_for * 1000,
+                location,
+                "".join(traceback.format_stack(frame)),
+            )
+
+
+# Singleton instance of LoopMonitor
+loop_monitor = LoopMonitor(config.LOOP_MONITOR_INTERVAL, config.LOOP_BLOCK_THRESHOLD)
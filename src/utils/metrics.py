@@ -0,0 +1,32 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Union
+
+
+class Metrics:
+    """Process-wide counters and gauges, exposed through the /metrics endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Union[int, float]] = defaultdict(int)
+        self._gauges: Dict[str, Union[int, float]] = {}
+
+    def increment(self, name: str, value: Union[int, float] = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: Union[int, float]):
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name: str) -> Union[int, float]:
+        with self._lock:
+            return self._counters.get(name, self._gauges.get(name, 0))
+
+    def snapshot(self) -> Dict[str, Union[int, float]]:
+        with self._lock:
+            return {**self._counters, **self._gauges}
+
+
+# Singleton instance of Metrics
+metrics = Metrics()
@@ -0,0 +1,124 @@
+import cProfile
+import hashlib
+import hmac
+import pstats
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, List, Optional, TypeVar
+from src.utils.config import config
+from src.utils.logger import logger, request_id_var
+from src.utils.metrics import metrics
+
+T = TypeVar("T")
+
+# cProfile can only trace one session per process at a time
+_session_lock = threading.Lock()
+
+
+class ProfileSession:
+    """The profiles of one submission: its event-loop thread and worker threads."""
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def new_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+
+# The session of the submission being profiled. asyncio.to_thread copies the
+# context, so the worker threads of that submission see it too.
+_session_var: ContextVar[Optional[ProfileSession]] = ContextVar(
+    "profile_session", default=None
+)
+
+
+def sign_profile_request(response_id: str) -> str:
+    """The X-Profile-Signature value that asks for a profile of one response."""
+    return hmac.new(
+        config.PROFILE_SIGNING_SECRET.encode("utf-8"),
+        response_id.encode("utf-8"),
+        digestmod=hashlib.sha256,
+    ).hexdigest()
+
+
+def is_profile_requested(signature: Optional[str], response_id: str) -> bool:
+    """Whether a submission should be profiled, by signed header or by sampling."""
+    if signature and config.PROFILE_SIGNING_SECRET:
+        if hmac.compare_digest(sign_profile_request(response_id), signature):
+            return True
+        logger.warning("Ignoring invalid profile signature for: %s", response_id)
+    return random.random() < config.PROFILE_SAMPLE_RATE
+
+
+def prune_profiles(directory: Path):
+    """Keep only the most recent PROFILE_MAX_FILES profiles."""
+    profiles = sorted(directory.glob("*.prof"), key=lambda path: path.stat().st_mtime)
+    for path in profiles[: max(0, len(profiles) - config.PROFILE_MAX_FILES)]:
+        path.unlink(missing_ok=True)
+
+
+@contextmanager
+def profile_session(response_id: str):
+    """Profile the enclosed block with cProfile, and dump it tagged with the id.
+
+    The calling thread is traced, which in an async handler mostly shows the
+    event loop waiting. The rendering it offloads to threads is traced by
+    running it through `profile_call`. Work sent to the image normalizer's
+    process pool is not covered. Skipped if another session is running already.
+    """
+    if not _session_lock.acquire(blocking=False):
+        logger.info("Another profile is running, not profiling: %s", response_id)
+        yield
+        return
+
+    session = ProfileSession()
+    profile = session.new_profile()
+    token = _session_var.set(session)
+    start_time = time.perf_counter()
+    try:
+        profile.enable()
+        yield
+    finally:
+        profile.disable()
+        _session_var.reset(token)
+        _session_lock.release()
+        # Slow failures are worth a profile as much as slow successes
+        write_profile(session.profiles, response_id, time.perf_counter() - start_time)
+
+
+def profile_call(func: Callable[..., T], *args, **kwargs) -> T:
+    """Call `func`, profiling it on this thread if its submission is profiled.
+
+    Meant for the blocking work a handler runs with asyncio.to_thread. Without
+    a session, it only costs a context variable lookup.
+    """
+    session = _session_var.get()
+    if session is None:
+        return func(*args, **kwargs)
+    profile = session.new_profile()
+    profile.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+
+
+def write_profile(profiles: List[cProfile.Profile], response_id: str, elapsed: float):
+    directory = Path(config.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+    tag = re.sub(r"[^\w-]", "_", response_id)
+    path = directory / f"{tag}-{timestamp}-{request_id_var.get()}.prof"
+    pstats.Stats(*profiles).dump_stats(path)
+    prune_profiles(directory)
+    metrics.increment("profiles_captured")
+    logger.info("Profiled %s in %.2fs, written to %s", response_id, elapsed, path)
@@ -0,0 +1,29 @@
+import multiprocessing
+
+
+class Readiness:
+    """Tracks which server workers have finished warming up.
+
+    The flags live in shared memory that is created before the server forks,
+    so the /ready endpoint of any worker reports on all of them.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.configure(workers)
+
+    def configure(self, workers: int):
+        self._flags = multiprocessing.Array("b", workers)
+        self.worker_index = 0
+
+    def mark_ready(self):
+        self._flags[self.worker_index] = 1
+
+    def mark_not_ready(self, worker_index: int):
+        self._flags[worker_index] = 0
+
+    def is_ready(self) -> bool:
+        return all(self._flags)
+
+
+# Singleton instance of Readiness
+readiness = Readiness()
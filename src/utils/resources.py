@@ -0,0 +1,48 @@
+import math
+import os
+from pathlib import Path
+from typing import Optional
+
+CGROUP_DIRECTORY = Path("/sys/fs/cgroup")
+
+
+def get_cpu_count() -> int:
+    """CPUs available to this process, honouring affinity and cgroup quotas."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = (CGROUP_DIRECTORY / "cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(cpus, 1)
+
+
+def get_available_memory() -> Optional[int]:
+    """Bytes of memory left for workers, from the cgroup limit or the host."""
+    try:
+        limit = (CGROUP_DIRECTORY / "memory.max").read_text().strip()
+        if limit != "max":
+            used = int((CGROUP_DIRECTORY / "memory.current").read_text())
+            return int(limit) - used
+    except (OSError, ValueError):
+        pass
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_rss() -> Optional[int]:
+    """Bytes of memory resident for this process right now, not the peak."""
+    try:
+        resident_pages = int(Path("/proc/self/statm").read_text().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
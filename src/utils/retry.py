@@ -0,0 +1,38 @@
+import random
+from typing import Optional
+from src.utils.config import config
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given (1-based) attempt."""
+    delay = min(
+        config.DRIVE_RETRY_MAX_DELAY, config.DRIVE_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+    )
+    return random.uniform(0, delay)
+
+
+def is_retryable_status(status_code: int, reason: str = None) -> bool:
+    """Whether a Drive response status is worth retrying.
+
+    Drive reports rate limiting as either 429 or 403 with a rate limit reason.
+    """
+    if status_code in RETRYABLE_STATUS_CODES:
+        return True
+    return is_rate_limited_status(status_code, reason)
+
+
+def is_rate_limited_status(status_code: int, reason: str = None) -> bool:
+    """Whether a Drive response status means the quota has been exceeded."""
+    if status_code == 429:
+        return True
+    return status_code == 403 and reason in RATE_LIMIT_REASONS
+
+
+def get_error_reason(errors) -> Optional[str]:
+    """Extract the reason of the first entry of a Drive error list, if any."""
+    if isinstance(errors, list) and errors and isinstance(errors[0], dict):
+        return errors[0].get("reason")
+    return None
@@ -0,0 +1,230 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Optional
+from src.utils.config import config
+from src.utils.logger import logger
+from src.utils.metrics import metrics
+from src.utils.retry import backoff_delay
+
+
+class Priority(enum.IntEnum):
+    """Drive request priority classes, lower values are served first."""
+
+    SUBMISSION = 0
+    LOOKUP = 1
+    BACKFILL = 2
+
+
+class TokenBucket:
+    """Token bucket kept in a SQLite file, so all the workers draw from it.
+
+    Under the pre-fork server every worker process shares the bucket, so
+    together they stay under the rate, and a pause after a rate limit response
+    holds all of them back. Each change of the state is one exclusive
+    transaction. Should the file fail, requests are let through rather than
+    stalled.
+    """
+
+    def __init__(self, rate: float, capacity: float, path: Optional[str] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = Path(path or config.DRIVE_RATE_STATE_PATH)
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        # Transactions are begun explicitly, see _state
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        # The state is worthless after a crash, no need to sync every commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._init_bucket()
+                    self._initialized = True
+        return self._open()
+
+    def _init_bucket(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._open()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bucket ("
+                " id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " tokens REAL, updated_at REAL, paused_until REAL)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO bucket VALUES (0, ?, ?, 0)",
+                (self.capacity, time.time()),
+            )
+
+    @contextmanager
+    def _state(self) -> Iterator[Dict[str, float]]:
+        """Read the state, and write it back once the block has changed it."""
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT tokens, updated_at, paused_until FROM bucket"
+                ).fetchone()
+                state = dict(zip(("tokens", "updated_at", "paused_until"), row))
+                yield state
+                connection.execute(
+                    "UPDATE bucket SET tokens = ?, updated_at = ?, paused_until = ?",
+                    (state["tokens"], state["updated_at"], state["paused_until"]),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _refill(self, state: Dict[str, float], now: float):
+        # updated_at lies in the future while paused, nothing refills until then
+        if now > state["updated_at"]:
+            state["tokens"] = min(
+                self.capacity, state["tokens"] + (now - state["updated_at"]) * self.rate
+            )
+            state["updated_at"] = now
+
+    def take(self) -> float:
+        """Take a token if one is available, else return how long to wait for one."""
+        try:
+            with self._state() as state:
+                now = time.time()
+                self._refill(state, now)
+                if now < state["paused_until"]:
+                    return state["paused_until"] - now
+                if state["tokens"] >= 1:
+                    state["tokens"] -= 1
+                    return 0.0
+                return (1 - state["tokens"]) / self.rate
+        except sqlite3.Error as e:
+            logger.warning("Drive rate state unavailable, not limiting: %s", e)
+            return 0.0
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the given time, and drain the burst."""
+        try:
+            with self._state() as state:
+                now = time.time()
+                state["paused_until"] = max(state["paused_until"], now + seconds)
+                state["tokens"] = 0
+                state["updated_at"] = max(now, state["paused_until"])
+        except sqlite3.Error as e:
+            logger.warning("Drive rate state unavailable, not pausing: %s", e)
+
+
+class DriveScheduler:
+    """Gate for every Drive API call made by this process.
+
+    Callers wait in a priority queue until the token bucket shared with the
+    other workers hands them a token, so bursts of submissions, lookups and
+    backfills together stay under the Drive quota. Identical read requests in flight are coalesced.
+    A single dispatcher thread wakes the waiting event loops.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._dispatcher: Optional[threading.Thread] = None
+        self._inflight = {}
+        self._throttle_attempt = 0
+
+    def _start_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(
+                target=self._dispatch, name="drive-scheduler", daemon=True
+            )
+            self._dispatcher.start()
+
+    def _enqueue(self, priority: Priority, wake: Callable[[], None]):
+        with self._condition:
+            self._start_dispatcher()
+            heapq.heappush(
+                self._waiters,
+                (priority, next(self._sequence), time.monotonic(), wake),
+            )
+            metrics.set_gauge("drive_queue_depth", len(self._waiters))
+            self._condition.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._waiters:
+                    self._condition.wait()
+                delay = self.bucket.take()
+                if delay > 0:
+                    # Wake up early if a waiter arrives, then re-check the order
+                    self._condition.wait(timeout=delay)
+                    continue
+                priority, _, enqueued_at, wake = heapq.heappop(self._waiters)
+                metrics.set_gauge("drive_queue_depth", len(self._waiters))
+
+            queued = time.monotonic() - enqueued_at
+            name = priority.name.lower()
+            metrics.increment(f"drive_queue_jobs_{name}")
+            metrics.increment(f"drive_queue_seconds_{name}", queued)
+            logger.debug("Drive %s request queued for %.3fs", name, queued)
+            try:
+                wake()
+            except RuntimeError as e:
+                # The waiting event loop has been closed in the meantime
+                logger.debug("Dropping Drive scheduler waiter: %s", e)
+
+    async def acquire_async(self, priority: Priority = Priority.LOOKUP):
+        """Wait, without blocking the event loop, until a Drive request may be sent."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(_resolve, future)
+
+        self._enqueue(priority, wake)
+        await future
+
+    def throttle(self):
+        """Back off every caller after Drive reported a rate limit."""
+        self._throttle_attempt = min(self._throttle_attempt + 1, 10)
+        delay = backoff_delay(self._throttle_attempt)
+        metrics.increment("drive_rate_limited")
+        logger.warning("Drive rate limit hit, pausing requests for %.2fs", delay)
+        self.bucket.pause(delay)
+
+    def reset_throttle(self):
+        self._throttle_attempt = 0
+
+    async def run_async(
+        self, func: Callable[[], Awaitable[Any]], key: Optional[Hashable] = None
+    ) -> Any:
+        """Run an async read, sharing the result with identical concurrent reads."""
+        if key is None:
+            return await func()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            metrics.increment("drive_coalesced_requests")
+        return await asyncio.shield(task)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Singleton instance of DriveScheduler, shared by every Drive client
+drive_scheduler = DriveScheduler(config.DRIVE_RATE_LIMIT, config.DRIVE_RATE_BURST)
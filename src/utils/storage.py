@@ -1,11 +1,23 @@
 import abc
 import enum
+import hashlib
 import io
+import json
+import mmap
+import os
+import sqlite3
+import tempfile
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+from pathlib import Path
+from src.utils.buffers import Buffer
+from src.utils.config import config
+from src.utils.exceptions import FileNotFoundError
 from src.utils.logger import logger
-from typing import Dict, Optional
-from google.auth import default
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from src.utils.metrics import metrics
+from typing import Optional
+from urllib.parse import quote
 
 
 class FileRole(enum.Enum):
@@ -19,7 +31,7 @@ class StorageClient(abc.ABC):
     @abc.abstractmethod
     def upload(
         self,
-        file_stream: io.BytesIO,
+        file_stream: Buffer,
         filename: str,
         file_mimetype: str = "application/pdf",
         folder_id=None,
@@ -40,137 +52,169 @@ class StorageClient(abc.ABC):
         pass
 
 
-class GoogleDriveClient(StorageClient):
-    def __init__(self, scopes=None):
-        if scopes is None:
-            scopes = ["https://www.googleapis.com/auth/drive"]
-        self.scopes = scopes
-        self.service = self._authenticate()
-
-    def _authenticate(self):
-        """Authenticate using a service account and return the Google Drive API service."""
-        creds, _ = default(scopes=self.scopes)
-        if creds is None:
-            raise ValueError("No valid credentials found")
-        return build("drive", "v3", credentials=creds)
+class LocalStorageClient(StorageClient):
+    """Content-addressed local store with a SQLite index of the file metadata.
+
+    Contents live under objects/<aa>/<bb>/<sha256> and are written with a
+    temp file plus rename, so readers never see partial files. The index maps
+    file ids and response_ids to their contents and custom properties.
+    """
+
+    _initialized = set()
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = Path(directory or config.LOCAL_STORAGE_DIR)
+        self.objects_directory = self.directory / "objects"
+        self.index_path = self.directory / "index.sqlite3"
+        if self.directory not in LocalStorageClient._initialized:
+            self._init_index()
+            LocalStorageClient._initialized.add(self.directory)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.index_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _init_index(self):
+        self.objects_directory.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    mimetype TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    folder_id TEXT,
+                    response_id TEXT,
+                    properties TEXT,
+                    created_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS files_response_id ON files (response_id);
+                CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+                CREATE TABLE IF NOT EXISTS permissions (
+                    file_id TEXT NOT NULL,
+                    email TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    PRIMARY KEY (file_id, email)
+                );
+                """
+            )
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_directory / digest[:2] / digest[2:4] / digest
+
+    def _write_object(self, file_stream: Buffer) -> str:
+        digest = hashlib.sha256(file_stream).hexdigest()
+        path = self._object_path(digest)
+        if path.exists():
+            logger.debug("Object already stored: %s", digest)
+            return digest
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(file_stream)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return digest
 
     def upload(
         self,
-        file_stream: bytes,
+        file_stream: Buffer,
         filename: str,
         file_mimetype: str = "application/pdf",
         folder_id=None,
         custom_property=None,
-    ):
-        """Upload a file to Google Drive."""
-        logger.info(f"Uploading file: {filename}")
-        logger.debug(f"File stream size: {len(file_stream)} bytes")
-        file_metadata = {"name": filename}
-        if folder_id:
-            file_metadata["parents"] = [folder_id]
-        media = MediaIoBaseUpload(io.BytesIO(file_stream), mimetype=file_mimetype)
-        file = (
-            self.service.files()
-            .create(body=file_metadata, media_body=media, fields="id")
-            .execute()
-        )
-        file_id = file.get("id")
-        if custom_property:
-            self._set_custom_property(file_id, custom_property)
+    ) -> str:
+        """Store a file and index its metadata.
+
+        With deduplication on, a file already stored with the same content,
+        name, folder and properties is reused.
+        """
+        logger.info("Storing file locally: %s", filename)
+        digest = self._write_object(file_stream)
+        properties = custom_property or {}
+        if config.HEPI_FF_UPLOAD_DEDUP:
+            file_id = self._find_stored(digest, filename, folder_id, properties)
+            if file_id is not None:
+                logger.info("File already stored, reusing %s: %s", file_id, filename)
+                metrics.increment("upload_dedup_hits")
+                return file_id
+
+        file_id = uuid.uuid4().hex
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    file_id,
+                    filename,
+                    file_mimetype,
+                    digest,
+                    len(file_stream),
+                    folder_id,
+                    properties.get("response_id"),
+                    json.dumps(properties),
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
         return file_id
 
-    def _set_custom_property(self, file_id: str, properties: Dict[str, str]):
-        """Set custom properties for a file."""
-        logger.info(f"Setting custom properties for file ID: {file_id}")
-        logger.debug(f"Custom properties: {properties}")
-        self.service.files().update(
-            fileId=file_id,
-            body={"properties": properties},
-            fields="id,properties",
-        ).execute()
+    def _find_stored(
+        self, digest: str, filename: str, folder_id, properties: dict
+    ) -> Optional[str]:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT file_id FROM files WHERE sha256 = ? AND filename = ?"
+                " AND folder_id IS ? AND properties = ? LIMIT 1",
+                (digest, filename, folder_id, json.dumps(properties)),
+            ).fetchone()
+        return row["file_id"] if row else None
 
     def share(self, file_id, email, role=FileRole.READER):
-        """Share a file with a specific email."""
-        logger.info(f"Sharing file ID: {file_id} with email: {email}")
+        """Record the permission, there is nobody to notify locally."""
         if not email:
             raise ValueError("Email address is required")
-
-        permission = {
-            "type": "user",
-            "role": role.value,
-            "emailAddress": email,
-        }
-        self.service.permissions().create(
-            fileId=file_id,
-            body=permission,
-            fields="id",
-        ).execute()
-
-    def _get_file_by_response_id(self, response_id: str):
-        """Get a file ID by its response_id."""
-        logger.info(f"Searching for file with response_id: {response_id}")
-        query = f"properties has {{ key='response_id' and value='{response_id}' }}"
-        results = self.service.files().list(q=query, fields="files(id, name)").execute()
-        files = results.get("files", [])
-        logger.debug(f"Found {len(files)} files for response_id: {response_id}")
-        if files:
-            return files[0]  # Return the first match
-        logger.warning(f"File not found for response_id: {response_id}")
-        return None
-
-    def get_file_url(self, response_id):
-        """Generate a sharable link for the file."""
-        logger.info(f"Generating file URL for response_id: {response_id}")
-        file_info = self._get_file_by_response_id(response_id)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO permissions VALUES (?, ?, ?)",
+                (file_id, email, role.value),
+            )
+
+    def get_file_by_response_id(self, response_id: str) -> Optional[sqlite3.Row]:
+        """Get the indexed metadata of the first file stored for a response_id."""
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "SELECT * FROM files WHERE response_id = ? ORDER BY created_at LIMIT 1",
+                (response_id,),
+            ).fetchone()
+
+    def get_file_path(self, response_id: str) -> Optional[Path]:
+        file_info = self.get_file_by_response_id(response_id)
         if not file_info:
-            logger.warning(f"File not found for response_id: {response_id}")
-            return ""
-
-        file = (
-            self.service.files()
-            .get(fileId=file_info["id"], fields="webViewLink")
-            .execute()
-        )
-        return file.get("webViewLink")
+            return None
+        return self._object_path(file_info["sha256"])
 
     def download(self, response_id):
-        """Download a file by its ID."""
-        logger.info(f"Downloading file with response_id: {response_id}")
-        file_info = self._get_file_by_response_id(response_id)
-        if not file_info:
+        """Return a read-only memory map of the file, backed by the page cache."""
+        path = self.get_file_path(response_id)
+        if path is None:
             raise FileNotFoundError(f"File not found: {response_id}")
-
-        request = self.service.files().get_media(fileId=file_info["id"])
-        file_stream = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_stream, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            logger.info(f"Download {int(status.progress() * 100)}% complete.")
-        file_stream.seek(0)
-        return file_stream
-
-
-class LocalStorageClient(StorageClient):
-    DIRECTORY = "logs"
-
-    def upload(
-        self,
-        file_stream: bytes,
-        filename: str,
-        file_mimetype: str = "application/pdf",
-        folder_id=None,
-        custom_property=None,
-    ) -> str:
-        with open(f"{self.DIRECTORY}/{filename}", "wb") as f:
-            f.write(file_stream)
-        return filename
-
-    def share(self, file_id, email, role=FileRole.READER):
-        pass
-
-    def download(self, response_id):
-        return open(f"{self.DIRECTORY}/{response_id}.pdf", "rb")
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return io.BytesIO()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
     def get_file_url(self, response_id):
-        pass
+        # Local files are only reachable through the app, which streams them
+        if self.get_file_path(response_id) is None:
+            return ""
+        return f"/pdf/{quote(response_id, safe='')}"
+
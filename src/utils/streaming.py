@@ -0,0 +1,92 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Iterator, Optional, Tuple
+from src.utils.exceptions import RangeNotSatisfiableError
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+ETAG_CACHE_SIZE = 1024
+
+_etags: "OrderedDict[Tuple[int, int, int, int], str]" = OrderedDict()
+_etags_lock = threading.Lock()
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range` header into an inclusive (start, end) pair.
+
+    Returns None when the whole file should be served, which includes
+    multi-range requests: RFC 9110 lets a server ignore those.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range, i.e. the last N bytes
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiableError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiableError(header)
+    return start, end
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags
+
+
+def get_file_etag(f: BinaryIO) -> str:
+    """ETag of an open file, hashed once per version of the file.
+
+    Read through the handle, so a file another worker evicts from the cache
+    in the meantime is still hashed whole.
+    """
+    stat = os.fstat(f.fileno())
+    # mtime and size are part of the key, so a rewritten file is rehashed
+    key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _etags_lock:
+        if key in _etags:
+            _etags.move_to_end(key)
+            return _etags[key]
+    digest = hashlib.md5(usedforsecurity=False)
+    offset = 0
+    while chunk := os.pread(f.fileno(), CHUNK_SIZE, offset):
+        digest.update(chunk)
+        offset += len(chunk)
+    etag = f'"{digest.hexdigest()}"'
+    with _etags_lock:
+        _etags[key] = etag
+        if len(_etags) > ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return etag
+
+
+def iter_file(f: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    """Yield the inclusive byte range [start, end] of an open file in chunks.
+
+    The file is closed once the range is sent, or the response abandoned.
+    """
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
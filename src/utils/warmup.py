@@ -0,0 +1,40 @@
+import time
+from src.utils.config import config
+from src.utils.logger import logger
+
+
+def warm_up():
+    """Load the expensive read-only state used by request handlers.
+
+    Only the configured engine and storage backend are loaded. Called by the
+    pre-fork server before forking, so workers share it copy-on-write, and
+    again on app startup, where it is a no-op once warm.
+    """
+    start_time = time.perf_counter()
+
+    # The engine router may fall back to either engine
+    router = config.HEPI_FF_PDF_ENGINE_ROUTER
+    if config.USE_HTML_PDF_GENERATOR or router:
+        from src.pdfkit_pdf_generator import get_template
+
+        get_template()
+    if not config.USE_HTML_PDF_GENERATOR or router:
+        import src.pymupdf_pdf_generator  # noqa: F401 (preloaded before forking)
+    if router:
+        import src.pdf_engine_router  # noqa: F401 (preloaded before forking)
+
+    if config.HEPI_FF_BUNDLE_DOCUMENTS:
+        import src.pdf_bundler  # noqa: F401 (preloaded before forking)
+    if config.HEPI_FF_NORMALIZE_IMAGES:
+        import src.image_normalizer  # noqa: F401 (preloaded before forking)
+
+    if config.HEPI_FF_UPLOAD_TO_DRIVE:
+        from src.utils.async_google_drive import AsyncGoogleDriveClient
+
+        try:
+            AsyncGoogleDriveClient.warm_up()
+        except Exception as e:
+            # The first upload authenticates again, starting is more important
+            logger.warning("Failed to warm up the Drive client: %s", e)
+
+    logger.info("Warm-up completed in %.2fs", time.perf_counter() - start_time)
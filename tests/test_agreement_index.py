@@ -0,0 +1,66 @@
+import asyncio
+import httpx
+import pytest
+from google.oauth2.credentials import Credentials
+from src.utils import async_google_drive
+from src.utils.agreement_index import AgreementIndex, apply_drive_changes
+from src.utils.async_google_drive import AsyncGoogleDriveClient
+from src.utils.config import config
+
+LINK = "https://drive.google.com/file/d/{}/view"
+
+
+class FakeDrive:
+    """Answers files.list like Drive, remembering every query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.queries.append(request.url.params["q"])
+        files = [{"id": "drive-file", "name": "a.pdf", "webViewLink": LINK}]
+        return httpx.Response(200, json={"files": files})
+
+
+@pytest.fixture
+def drive(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "HEPI_FF_DRIVE_SYNC", True)
+    index = AgreementIndex(str(tmp_path / "agreements.sqlite3"))
+    monkeypatch.setattr(async_google_drive, "agreement_index", index)
+    fake_drive = FakeDrive()
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(fake_drive))
+    monkeypatch.setattr(AsyncGoogleDriveClient, "_http_client", http_client)
+    monkeypatch.setattr(AsyncGoogleDriveClient, "_credentials", Credentials("t"))
+    yield index, fake_drive
+    asyncio.run(http_client.aclose())
+
+
+def get_change(file_id: str, response_id: str, removed: bool = False) -> dict:
+    file = {
+        "id": file_id,
+        "name": f"{file_id}.pdf",
+        "webViewLink": LINK.format(file_id),
+        "properties": {"response_id": response_id, "filename": f"{file_id}.pdf"},
+    }
+    return {"fileId": file_id, "removed": removed, "file": file}
+
+
+def test_indexed_response_is_not_searched_on_drive(drive):
+    index, fake_drive = drive
+    apply_drive_changes(index, [get_change("f1", "r1")])
+
+    url = asyncio.run(AsyncGoogleDriveClient().get_file_url("r1"))
+
+    assert url == LINK.format("f1")
+    assert not fake_drive.queries
+
+
+def test_unindexed_response_falls_back_to_drive(drive):
+    index, fake_drive = drive
+    apply_drive_changes(index, [get_change("f1", "r1"), get_change("f1", "r1", True)])
+    # Indexed by submit, before the changes feed reported its link
+    index.upsert("f2", {"response_id": "r2"})
+
+    assert asyncio.run(AsyncGoogleDriveClient().get_file_url("r1")) == LINK
+    assert asyncio.run(AsyncGoogleDriveClient().get_file_url("r2")) == LINK
+    assert len(fake_drive.queries) == 2
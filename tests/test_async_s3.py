@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from urllib.parse import parse_qsl, unquote
+import httpx
+import pytest
+from src.utils import async_s3
+from src.utils.async_s3 import (
+    UNSIGNED_PAYLOAD,
+    AsyncS3StorageClient,
+    get_signature,
+)
+from src.utils.config import config
+from src.utils.content_index import ContentIndex
+
+REGION = "us-east-1"
+SECRET_KEY = "minio-secret"
+PART_SIZE = async_s3.MIN_PART_SIZE
+
+
+class FakeBucket:
+    """A MinIO-like bucket behind httpx.MockTransport, checking every signature."""
+
+    def __init__(self, fail_part=None):
+        self.unavailable = False
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.requests = []
+        self.fail_part = fail_part
+
+    def verify(self, request: httpx.Request, path: str, params: dict) -> bool:
+        if "X-Amz-Signature" in params:
+            signature = params.pop("X-Amz-Signature")
+            expected, _, _ = get_signature(
+                request.method,
+                path,
+                params,
+                {"host": request.headers["host"]},
+                UNSIGNED_PAYLOAD,
+                params["X-Amz-Date"],
+                REGION,
+                SECRET_KEY,
+            )
+            return expected == signature
+        authorization = request.headers["authorization"]
+        signed = re.search(r"SignedHeaders=([^,]+)", authorization).group(1)
+        signature = re.search(r"Signature=(\w+)", authorization).group(1)
+        payload_hash = request.headers["x-amz-content-sha256"]
+        if payload_hash != hashlib.sha256(request.content).hexdigest():
+            return False
+        expected, _, _ = get_signature(
+            request.method,
+            path,
+            params,
+            {name: request.headers[name] for name in signed.split(";")},
+            payload_hash,
+            request.headers["x-amz-date"],
+            REGION,
+            SECRET_KEY,
+        )
+        return expected == signature
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        raw_path, _, query = request.url.raw_path.decode().partition("?")
+        path = unquote(raw_path)
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        if not self.verify(request, path, dict(params)):
+            return httpx.Response(403, text="SignatureDoesNotMatch")
+        key = path.split("/", 2)[2]
+        self.requests.append((request.method, key, sorted(params)))
+        if self.unavailable:
+            return httpx.Response(503, text="SlowDown")
+
+        if request.method == "POST" and "uploads" in params:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            body = (
+                '<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/'
+                f'2006-03-01/"><UploadId>{upload_id}</UploadId>'
+                "</InitiateMultipartUploadResult>"
+            )
+            return httpx.Response(200, content=body.encode())
+        if request.method == "PUT" and "partNumber" in params:
+            number = int(params["partNumber"])
+            if number == self.fail_part:
+                return httpx.Response(400, text="InvalidPart")
+            self.uploads[params["uploadId"]][number] = request.content
+            etag = hashlib.md5(request.content).hexdigest()
+            return httpx.Response(200, headers={"ETag": f'"{etag}"'})
+        if request.method == "POST" and "uploadId" in params:
+            parts = self.uploads.pop(params["uploadId"])
+            numbers = re.findall(rb"<PartNumber>(\d+)</PartNumber>", request.content)
+            content = b"".join(parts[int(number)] for number in numbers)
+            self.objects[key] = (content, request.headers)
+            return httpx.Response(200, content=b"<CompleteMultipartUploadResult/>")
+        if request.method == "DELETE" and "uploadId" in params:
+            self.uploads.pop(params["uploadId"], None)
+            self.aborted.append(key)
+            return httpx.Response(204)
+        if request.method == "PUT":
+            self.objects[key] = (request.content, request.headers)
+            return httpx.Response(200, headers={"ETag": '"etag"'})
+        if request.method == "GET":
+            if key not in self.objects:
+                return httpx.Response(404, text="NoSuchKey")
+            return httpx.Response(200, content=self.objects[key][0])
+        return httpx.Response(405)
+
+
+@pytest.fixture
+def bucket(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "S3_ENDPOINT_URL", "http://minio.local:9000")
+    monkeypatch.setattr(config, "S3_REGION", REGION)
+    monkeypatch.setattr(config, "S3_BUCKET", "hepi")
+    monkeypatch.setattr(config, "S3_PREFIX", "agreements/")
+    monkeypatch.setattr(config, "S3_ACCESS_KEY_ID", "minio")
+    monkeypatch.setattr(config, "S3_SECRET_ACCESS_KEY", SECRET_KEY)
+    monkeypatch.setattr(config, "S3_PART_SIZE", PART_SIZE)
+    monkeypatch.setattr(config, "HEPI_FF_UPLOAD_DEDUP", False)
+    monkeypatch.setattr(
+        async_s3, "content_index", ContentIndex(str(tmp_path / "content.sqlite3"))
+    )
+    fake_bucket = FakeBucket()
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(fake_bucket))
+    monkeypatch.setattr(AsyncS3StorageClient, "_http_client", http_client)
+    yield fake_bucket
+    asyncio.run(http_client.aclose())
+
+
+def test_single_part_upload(bucket):
+    client = AsyncS3StorageClient()
+    content = os.urandom(1024)
+    properties = {"response_id": "r1", "owner_name": "Budi Śantoso", "cp_name": None}
+
+    file_id = asyncio.run(
+        client.upload(memoryview(content), "Perjanjian.pdf", custom_property=properties)
+    )
+
+    stored, headers = bucket.objects[f"agreements/objects/{file_id}"]
+    assert stored == content
+    assert headers["content-type"] == "application/pdf"
+    assert unquote(headers["x-amz-meta-owner-name"]) == "Budi Śantoso"
+    assert "x-amz-meta-cp-name" not in headers
+    assert "agreements/responses/r1.json" in bucket.objects
+    assert not any("partNumber" in params for _, _, params in bucket.requests)
+    download = asyncio.run(client.download("r1"))
+    assert download.read() == content
+
+
+def test_multipart_upload(bucket):
+    client = AsyncS3StorageClient()
+    content = os.urandom(2 * PART_SIZE + 123)
+
+    file_id = asyncio.run(client.upload(content, "Perjanjian.pdf"))
+
+    assert bucket.objects[f"agreements/objects/{file_id}"][0] == content
+    parts = [params for _, _, params in bucket.requests if "partNumber" in params]
+    assert len(parts) == 3
+    assert not bucket.uploads
+
+
+def test_failed_multipart_upload_is_aborted(bucket):
+    bucket.fail_part = 2
+    client = AsyncS3StorageClient()
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(client.upload(os.urandom(2 * PART_SIZE + 123), "Perjanjian.pdf"))
+
+    assert len(bucket.aborted) == 1
+    assert not bucket.uploads
+    assert not bucket.objects
+
+
+def test_exhausted_retries_raise_the_last_status(bucket, monkeypatch):
+    monkeypatch.setattr(config, "S3_MAX_RETRIES", 1)
+    monkeypatch.setattr(async_s3, "backoff_delay", lambda attempt: 0)
+    bucket.unavailable = True
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(AsyncS3StorageClient().upload(b"%PDF", "Perjanjian.pdf"))
+
+    assert error.value.response.status_code == 503
+    assert len(bucket.requests) == 2
+
+
+def test_presigned_url(bucket):
+    client = AsyncS3StorageClient()
+    content = os.urandom(1024)
+    file_id = asyncio.run(
+        client.upload(content, "Perjanjian.pdf", custom_property={"response_id": "r1"})
+    )
+
+    url = asyncio.run(client.share(file_id, "owner@example.com"))
+
+    # Signed a second apart, the signatures of the two URLs may differ
+    file_url = httpx.URL(asyncio.run(client.get_file_url("r1")))
+    for key in ("X-Amz-Credential", "X-Amz-Expires"):
+        assert httpx.URL(url).params[key] == file_url.params[key]
+    assert httpx.URL(url).path == file_url.path
+    assert "X-Amz-Signature=" in url
+
+    async def get(url: str) -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(bucket)) as http:
+            return await http.get(url)
+
+    response = asyncio.run(get(url))
+    assert response.status_code == 200
+    assert response.content == content
+    tampered = url.replace("X-Amz-Expires=", "X-Amz-Expires=1")
+    assert asyncio.run(get(tampered)).status_code == 403
+
+
+def test_deduplicated_upload(bucket, monkeypatch):
+    monkeypatch.setattr(config, "HEPI_FF_UPLOAD_DEDUP", True)
+    client = AsyncS3StorageClient()
+    content = os.urandom(1024)
+
+    first = asyncio.run(client.upload(content, "Perjanjian.pdf"))
+    second = asyncio.run(client.upload(content, "Perjanjian.pdf"))
+    renamed = asyncio.run(client.upload(content, "Perjanjian 2.pdf"))
+
+    assert first == second
+    assert renamed != first
+    assert len(bucket.objects) == 2
@@ -0,0 +1,28 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+from src.utils.config import config
+
+# Runs in a fresh interpreter, so the measurement is a real cold start
+STARTUP_SCRIPT = """
+import json, time
+start_time = time.perf_counter()
+import main
+from src.utils.warmup import warm_up
+warm_up()
+print(json.dumps((time.perf_counter() - start_time) * 1000))
+"""
+
+
+def test_startup_is_within_budget():
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent.parent,
+    )
+    startup_ms = json.loads(result.stdout.strip().splitlines()[-1])
+
+    assert startup_ms < config.STARTUP_BUDGET_MS, "See `make profile-startup`"